@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+simple_enunu.main の処理全体を、長さの違う合成 UST で実行して段階ごとの時間を測る。
+
+tiny_voicebank.py で作った乱数のモデルを使うので、音源がなくても CPU だけで動く。
+UST の読み取りから WAV の書き出しまで、実際の合成と同じ関数を通る。
+ENUNU のメソッドと main から呼ぶ関数を計測用の関数で包んで、段階ごとの実行時間と
+実時間比 (RTF: 処理時間 / 音声の長さ) を曲の長さごとに表にする。
+
+段階の中で別の段階の関数が呼ばれた場合 (score_editor の中のラベル読み込みなど) は、
+外側の段階の時間に含める。どの段階にも入らない時間は other にまとめる。
+
+使い方:
+    python benchmarks/bench_e2e.py --sizes 50 200 800 --repeat 3 --json result.json
+"""
+
+import json
+import math
+import os
+import sys
+from argparse import ArgumentParser
+from functools import wraps
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from scipy.io import wavfile
+
+import synthetic
+import tiny_voicebank
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+DEFAULT_SIZES = (50, 200, 800)
+# 表に出す段階の順番
+STAGES = [
+    'load_models',
+    'ust_editor',
+    'score_conversion',
+    'label_load',
+    'score_editor',
+    'predict_timing',
+    'timing_editor',
+    'segmentation',
+    'predict_acoustic',
+    'postprocess_acoustic',
+    'acoustic_editor',
+    'predict_waveform',
+    'postprocess_waveform',
+    'write_wav',
+    'other',
+]
+
+
+class StageTimer:
+    """関数を包んで、段階ごとの実行時間を足し合わせる。"""
+
+    def __init__(self):
+        self.times = {}
+        self._active = None
+        self._patches = []
+
+    def wrap(self, owner, attr: str, stage: str):
+        """owner.attr を計測用の関数に置き換える。"""
+        func = getattr(owner, attr)
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            # 外側の段階を実行中なら、その段階の時間に含める
+            if self._active is not None:
+                return func(*args, **kwargs)
+            self._active = stage
+            t_start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[stage] = self.times.get(stage, 0.0) + perf_counter() - t_start
+                self._active = None
+
+        self._patches.append((owner, attr, func))
+        setattr(owner, attr, timed)
+
+    def reset(self):
+        """計測結果を消す。"""
+        self.times = {}
+
+    def restore(self):
+        """置き換えた関数を元に戻す。"""
+        for owner, attr, func in reversed(self._patches):
+            setattr(owner, attr, func)
+        self._patches = []
+
+
+def patch_stages(timer: StageTimer, simple_enunu):
+    """main と ENUNU.svs の中で呼ばれる関数を、段階ごとに計測するようにする。"""
+    engine_class = simple_enunu.ENUNU
+    for attr, stage in (
+        ('__init__', 'load_models'),
+        ('edit_ust', 'ust_editor'),
+        ('edit_score', 'score_editor'),
+        ('predict_timing', 'predict_timing'),
+        ('edit_timing', 'timing_editor'),
+        ('segment_labels', 'segmentation'),
+        ('predict_acoustic', 'predict_acoustic'),
+        ('postprocess_acoustic', 'postprocess_acoustic'),
+        ('edit_acoustic', 'acoustic_editor'),
+        ('predict_waveform', 'predict_waveform'),
+        ('postprocess_waveform', 'postprocess_waveform'),
+    ):
+        timer.wrap(engine_class, attr, stage)
+    enulib = simple_enunu.enulib
+    timer.wrap(enulib.utauplugin2score, 'utauplugin2score', 'score_conversion')
+    timer.wrap(simple_enunu.hts, 'load', 'label_load')
+    # dtype=np.float32 のときは postprocess_waveform の代わりにこれらを使う
+    timer.wrap(enulib.waveform, 'bandpass_filter_inplace', 'postprocess_waveform')
+    timer.wrap(enulib.waveform, 'finalize_waveform', 'postprocess_waveform')
+    timer.wrap(enulib.waveform, 'write_wav', 'write_wav')
+
+
+def make_input_ust(path_ust: str, voice_dir: str, n_notes: int, seed: int):
+    """音源フォルダを指定した UST を書き出す。表情サフィックスは変換テーブルにないので付けない。"""
+    ust = synthetic.make_ust(n_notes, seed, suffix=False)
+    ust.setting['VoiceDir'] = voice_dir
+    ust.write(path_ust)
+
+
+def run_main(simple_enunu, timer: StageTimer, path_ust: str, path_wav: str) -> dict:
+    """main を1回実行して、段階ごとの時間[s]と音声の長さ[s]を返す。"""
+    timer.reset()
+    cwd = os.getcwd()
+    t_start = perf_counter()
+    try:
+        simple_enunu.main(path_ust, path_wav=path_wav, play_wav=False)
+    finally:
+        # main は音源フォルダに移動するので元に戻す
+        os.chdir(cwd)
+    total = perf_counter() - t_start
+    times = dict(timer.times)
+    times['other'] = total - sum(times.values())
+    sample_rate, wav = wavfile.read(path_wav, mmap=True)
+    return {'total': total, 'audio': len(wav) / sample_rate, 'stages': times}
+
+
+def format_table(results: list, key: str, digits: int) -> str:
+    """段階を行、曲の長さを列にした表を作る。"""
+    header = f'{"stage":<22}' + ''.join(f'{r["notes"]:>10}' for r in results)
+    lines = [header, '-' * len(header)]
+    for stage in [*STAGES, 'total']:
+        values = [r[key].get(stage, math.nan) for r in results]
+        lines.append(f'{stage:<22}' + ''.join(f'{v:>10.{digits}f}' for v in values))
+    return '\n'.join(lines)
+
+
+def main():
+    """全体の処理をする"""
+    parser = ArgumentParser(description='SimpleEnunu の合成処理全体のベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='ノート数')
+    parser.add_argument('--repeat', type=int, default=3, help='計測の繰り返し回数')
+    parser.add_argument('--hidden_dim', type=int, default=16, help='乱数モデルの隠れ層の次元数')
+    parser.add_argument(
+        '--extensions',
+        action='store_true',
+        help='同梱の拡張機能 (vibrato_applier, velocity_applier, f0_smoother) を使う',
+    )
+    parser.add_argument('--seed', type=int, default=0, help='合成データの乱数のシード')
+    parser.add_argument('--json', help='計測結果を書き出す JSON ファイルのパス')
+    args = parser.parse_args()
+
+    # simple_enunu は import するだけで torch や nnsvs を読み込むので、ここで import する
+    sys.path.append(ROOT_DIR)
+    import simple_enunu  # pylint: disable=import-outside-toplevel
+
+    timer = StageTimer()
+    patch_stages(timer, simple_enunu)
+    results = []
+    try:
+        with TemporaryDirectory() as temp_dir:
+            voice_dir = join(temp_dir, 'voicebank')
+            tiny_voicebank.make_voicebank(
+                voice_dir,
+                hidden_dim=args.hidden_dim,
+                seed=args.seed,
+                extensions=tiny_voicebank.DEFAULT_EXTENSIONS if args.extensions else None,
+            )
+            for n_notes in args.sizes:
+                path_ust = join(temp_dir, f'song_{n_notes}.ust')
+                path_wav = join(temp_dir, f'song_{n_notes}.wav')
+                make_input_ust(path_ust, voice_dir, n_notes, args.seed)
+                runs = [
+                    run_main(simple_enunu, timer, path_ust, path_wav) for _ in range(args.repeat)
+                ]
+                # 段階ごとに最小の時間を使う
+                audio = runs[0]['audio']
+                times = {
+                    stage: min(run['stages'].get(stage, 0.0) for run in runs) for stage in STAGES
+                }
+                times['total'] = min(run['total'] for run in runs)
+                results.append(
+                    {
+                        'notes': n_notes,
+                        'audio': audio,
+                        'times': times,
+                        'rtf': {stage: t / audio for stage, t in times.items()},
+                    }
+                )
+    finally:
+        timer.restore()
+
+    print('Wall time [s]')
+    print(format_table(results, 'times', 3))
+    print()
+    print('Real-time factor')
+    print(format_table(results, 'rtf', 4))
+    print()
+    print('Audio length [s]: ' + ', '.join(f'{r["audio"]:.1f}' for r in results))
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
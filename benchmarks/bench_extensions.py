@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+同梱の拡張機能が曲の長さに対してどれくらい時間とメモリを使うかを測る。
+
+synthetic.py で作った UST, フルラベル, f0 を、ENUNU と同じ引数で拡張機能に渡して実行する。
+モデルや音源は使わないので、オフラインでどの PC でも動く。
+
+- in-process: runpy でスクリプトを実行する。拡張機能そのものの処理時間の目安。
+- subprocess: ENUNU と同じく別プロセスで実行する。Python の起動と import の時間を含む。
+
+実行時間は repeat 回のうち最小のものにする。
+ピークメモリは、in-process では tracemalloc で測った Python のメモリ確保量、
+subprocess では子プロセスの最大 RSS (Windows では psutil がない場合は測らない)。
+
+使い方:
+    python benchmarks/bench_extensions.py --sizes 100 400 910 1600 --repeat 3
+"""
+
+import json
+import math
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass
+from os.path import abspath, dirname, join
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+from typing import Callable, Optional
+
+import synthetic
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+EXTENSIONS_DIR = join(ROOT_DIR, 'extensions')
+# 約10分の曲 (約12万フレーム) になるノート数
+TEN_MINUTES_NOTES = 910
+# 既定の曲の長さ(ノート数)
+DEFAULT_SIZES = (100, 400, TEN_MINUTES_NOTES, 1600)
+
+
+@dataclass
+class Case:
+    """ベンチマークする拡張機能と呼び出す段階"""
+
+    name: str
+    script: str
+    stage: str
+    # 計測の前に実行しておく処理 (ust_editor の段階で作られる状態など)
+    prepare: Optional[Callable] = None
+
+
+@dataclass
+class Result:
+    """1回分の計測結果"""
+
+    name: str
+    stage: str
+    mode: str
+    notes: int
+    frames: int
+    time_ms: float
+    ms_per_kframe: float
+    peak_mb: float
+    mb_per_kframe: float
+
+
+def engine_kwargs(stage: str, song: synthetic.SyntheticSong, state_dir: str) -> dict:
+    """ENUNU の edit_* と同じ引数を作る。"""
+    kwargs = {
+        'ust': song.ust,
+        'table': song.table,
+        'feedback': song.ust,
+        'state_dir': state_dir,
+    }
+    if stage in ('score_editor', 'timing_editor', 'acoustic_editor'):
+        kwargs['full_score'] = song.full_score
+    if stage in ('timing_editor', 'acoustic_editor'):
+        kwargs['full_timing'] = song.full_timing
+        kwargs['mono_timing'] = song.mono_timing
+    if stage == 'acoustic_editor':
+        kwargs['f0'] = song.f0
+        kwargs['frame_period'] = str(synthetic.FRAME_PERIOD)
+    return kwargs
+
+
+def to_args(kwargs: dict) -> list:
+    """enulib.extensions.run_extension と同じく --key value の形にする。"""
+    args = []
+    for key, value in kwargs.items():
+        if value is not None:
+            args += [f'--{key}', value]
+    return args
+
+
+def run_in_process(path_script: str, kwargs: dict, trace_memory: bool = False) -> tuple:
+    """スクリプトを同じプロセスで実行して、(実行時間[s], ピークメモリ[byte]) を返す。"""
+    old_argv, old_cwd = sys.argv, os.getcwd()
+    sys.argv = [path_script, *to_args(kwargs)]
+    os.chdir(dirname(path_script))
+    peak = math.nan
+    # 拡張機能によっては標準出力のファイル記述子を使うので、StringIO ではなく devnull に捨てる
+    try:
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+            if trace_memory:
+                tracemalloc.start()
+            t_start = perf_counter()
+            runpy.run_path(path_script, run_name='__main__')
+            elapsed = perf_counter() - t_start
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        sys.argv = old_argv
+        os.chdir(old_cwd)
+    return elapsed, peak
+
+
+def _child_peak_rss(pid: int, rusage) -> float:
+    """子プロセスの最大 RSS[byte] を返す。測れない場合は nan。"""
+    if rusage is not None:
+        # Linux は KB、macOS は byte で返ってくる
+        return rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    try:
+        import psutil  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return math.nan
+    try:
+        info = psutil.Process(pid).memory_info()
+    except psutil.Error:
+        return math.nan
+    return getattr(info, 'peak_wset', math.nan)
+
+
+def run_subprocess(path_script: str, kwargs: dict, path_log: str) -> tuple:
+    """スクリプトを ENUNU と同じく別プロセスで実行して、(実行時間[s], ピークメモリ[byte]) を返す。"""
+    args = [sys.executable, path_script, *to_args(kwargs)]
+    with open(path_log, 'w', encoding='utf-8') as f_log:
+        t_start = perf_counter()
+        proc = subprocess.Popen(args, cwd=dirname(path_script), stdout=f_log, stderr=f_log)
+        rusage = None
+        if hasattr(os, 'wait4'):
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            peak = _child_peak_rss(proc.pid, rusage)
+        else:
+            # Windows では終了前に測る
+            peak = math.nan
+            while proc.poll() is None:
+                peak = _child_peak_rss(proc.pid, None)
+                sleep(0.01)
+        elapsed = perf_counter() - t_start
+    if proc.returncode != 0:
+        with open(path_log, encoding='utf-8') as f_log:
+            raise RuntimeError(f'{path_script} failed:\n{f_log.read()}')
+    return elapsed, peak
+
+
+def prepare_stage(case: Case, song: synthetic.SyntheticSong, state_dir: str):
+    """ust_editor の段階を計測せずに実行しておく。acoustic_editor の段階を測るため。"""
+    path_script = join(EXTENSIONS_DIR, case.script)
+    run_in_process(path_script, engine_kwargs('ust_editor', song, state_dir))
+
+
+CASES = [
+    Case('voicecolor_applier', 'voicecolor_applier/voicecolor_applier.py', 'ust_editor'),
+    Case('vibrato_applier', 'vibrato_applier.py', 'ust_editor'),
+    Case('style_shifter', 'style_shifter.py', 'ust_editor'),
+    Case('velocity_applier', 'velocity_applier.py', 'timing_editor'),
+    Case('f0_smoother', 'f0_smoother.py', 'acoustic_editor'),
+    Case('vibrato_applier', 'vibrato_applier.py', 'acoustic_editor', prepare=prepare_stage),
+    Case('style_shifter', 'style_shifter.py', 'acoustic_editor', prepare=prepare_stage),
+    Case('f0_feedbacker', 'f0_feedbacker.py', 'acoustic_editor'),
+]
+
+
+def copy_song(song: synthetic.SyntheticSong, work_dir: str) -> synthetic.SyntheticSong:
+    """拡張機能はファイルを上書きするので、実行ごとに元のファイルを複製して使う。"""
+    paths = {}
+    for key in ('ust', 'table', 'full_score', 'full_timing', 'mono_timing', 'f0'):
+        paths[key] = shutil.copy2(getattr(song, key), work_dir)
+    return synthetic.SyntheticSong(**paths, n_notes=song.n_notes, n_frames=song.n_frames)
+
+
+def measure(
+    case: Case, song: synthetic.SyntheticSong, mode: str, repeat: int, temp_dir: str
+) -> Result:
+    """1つの拡張機能を repeat 回実行して計測する。"""
+    path_script = join(EXTENSIONS_DIR, case.script)
+    times, peaks = [], []
+    # in-process のときは、時間を測る実行とは別に tracemalloc を使って1回実行する
+    n_runs = repeat + 1 if mode == 'in-process' else repeat
+    for i_run in range(n_runs):
+        work_dir = join(temp_dir, f'{case.name}_{case.stage}_{mode}_{i_run}')
+        state_dir = join(work_dir, 'extension_state')
+        os.makedirs(state_dir)
+        run_song = copy_song(song, work_dir)
+        if case.prepare is not None:
+            case.prepare(case, run_song, state_dir)
+        kwargs = engine_kwargs(case.stage, run_song, state_dir)
+        if mode == 'subprocess':
+            elapsed, peak = run_subprocess(path_script, kwargs, join(work_dir, 'log.txt'))
+        else:
+            elapsed, peak = run_in_process(path_script, kwargs, trace_memory=i_run == repeat)
+        if i_run < repeat:
+            times.append(elapsed)
+        peaks.append(peak)
+        shutil.rmtree(work_dir)
+
+    time_ms = min(times) * 1000
+    peak_mb = max((p for p in peaks if not math.isnan(p)), default=math.nan) / 1024 / 1024
+    kframes = song.n_frames / 1000
+    return Result(
+        name=case.name,
+        stage=case.stage,
+        mode=mode,
+        notes=song.n_notes,
+        frames=song.n_frames,
+        time_ms=time_ms,
+        ms_per_kframe=time_ms / kframes,
+        peak_mb=peak_mb,
+        mb_per_kframe=peak_mb / kframes,
+    )
+
+
+def format_table(results: list) -> str:
+    """計測結果を表にする。"""
+    header = (
+        f'{"extension":<20} {"stage":<16} {"mode":<11} {"notes":>6} {"frames":>8} '
+        f'{"time[ms]":>10} {"ms/kframe":>10} {"peak[MB]":>9} {"MB/kframe":>10}'
+    )
+    lines = [header, '-' * len(header)]
+    for r in results:
+        lines.append(
+            f'{r.name:<20} {r.stage:<16} {r.mode:<11} {r.notes:>6} {r.frames:>8} '
+            f'{r.time_ms:>10.1f} {r.ms_per_kframe:>10.3f} '
+            f'{r.peak_mb:>9.1f} {r.mb_per_kframe:>10.4f}'
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    """全体の処理をする"""
+    parser = ArgumentParser(description='同梱の拡張機能のベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='ノート数')
+    parser.add_argument('--repeat', type=int, default=3, help='計測の繰り返し回数')
+    parser.add_argument(
+        '--mode',
+        choices=['in-process', 'subprocess', 'both'],
+        default='both',
+        help='拡張機能の実行方法',
+    )
+    parser.add_argument('--only', nargs='+', help='計測する拡張機能の名前')
+    parser.add_argument('--seed', type=int, default=0, help='合成データの乱数のシード')
+    parser.add_argument('--json', help='計測結果を書き出す JSON ファイルのパス')
+    args = parser.parse_args()
+
+    modes = ['in-process', 'subprocess'] if args.mode == 'both' else [args.mode]
+    cases = [case for case in CASES if args.only is None or case.name in args.only]
+    results = []
+    with TemporaryDirectory() as temp_dir:
+        for n_notes in args.sizes:
+            song_dir = join(temp_dir, f'song_{n_notes}')
+            os.makedirs(song_dir)
+            song = synthetic.make_song(song_dir, n_notes, seed=args.seed)
+            for case in cases:
+                for mode in modes:
+                    result = measure(case, song, mode, args.repeat, temp_dir)
+                    print(
+                        f'{result.name} ({result.stage}, {result.mode}, {n_notes} notes):'
+                        f' {result.time_ms:.1f} ms',
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+
+    print(format_table(results))
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([asdict(r) for r in results], f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
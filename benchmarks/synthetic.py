@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ベンチマーク用の合成データ(UST, 変換テーブル, フルラベル, f0)を作る。
+
+音源やモデルがなくても拡張機能や合成処理の速さを測れるように、
+乱数で決めたノートから、ENUNU が拡張機能に渡すのと同じ形式のファイルを作る。
+同じ seed からは同じファイルができる。
+"""
+
+import sys
+from dataclasses import dataclass
+from os.path import abspath, dirname, join
+
+import numpy as np
+import utaupy
+
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.features  # noqa: E402  # pylint: disable=wrong-import-position
+import enulib.timing  # noqa: E402  # pylint: disable=wrong-import-position
+
+# f0 のフレーム周期[ms]
+FRAME_PERIOD = 5
+# 歌詞と音素の対応 (ベンチマーク用の最小限の変換テーブル)
+TABLE = {
+    'R': ['pau'],
+    'あ': ['a'],
+    'い': ['i'],
+    'か': ['k', 'a'],
+    'さ': ['s', 'a'],
+    'た': ['t', 'a'],
+    'な': ['n', 'a'],
+    'きゃ': ['ky', 'a'],
+    'ん': ['N'],
+    'っ': ['cl'],
+}
+# 歌詞に付ける表情サフィックス (voicecolor_applier の対応表から)
+SUFFIXES = ['', '', '', '強', '弱', '裏', '息']
+# ノート長[tick]の候補
+NOTE_LENGTHS = [120, 240, 480, 960, 1440]
+
+
+@dataclass
+class SyntheticSong:
+    """ベンチマーク用に書き出したファイルのパスの組"""
+
+    ust: str
+    table: str
+    full_score: str
+    full_timing: str
+    mono_timing: str
+    f0: str
+    n_notes: int
+    n_frames: int
+
+
+def write_table(path):
+    """歌詞を音素に変換するテーブルを書き出す。"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(f'{kana} {" ".join(phonemes)}' for kana, phonemes in TABLE.items()))
+
+
+def make_ust(
+    n_notes: int,
+    seed: int = 0,
+    rest_ratio: float = 0.12,
+    vibrato_ratio: float = 0.5,
+    style_shift_ratio: float = 0.3,
+    suffix: bool = True,
+) -> utaupy.ust.Ust:
+    """ランダムなノートの UST を作る。
+
+    休符、ビブラート、スタイルシフトのフラグ(S5 など)、子音速度、表情サフィックスを含む。
+    最初と最後のノートは休符にして、休符は連続させない。
+
+    >>> ust = make_ust(20, seed=1)
+    >>> len(ust.notes), ust.notes[0].lyric, ust.notes[-1].lyric
+    (20, 'R', 'R')
+    """
+    rng = np.random.default_rng(seed)
+    ust = utaupy.ust.Ust()
+    ust.version = '1.20'
+    ust.setting['Tempo'] = 120
+    ust.setting['Mode2'] = 'True'
+    lyrics = [kana for kana in TABLE if kana not in ('R', 'ん', 'っ')]
+    for i in range(n_notes):
+        note = utaupy.ust.Note()
+        note.tag = f'[#{i:04}]'
+        note.length = int(rng.choice(NOTE_LENGTHS))
+        note.notenum = int(rng.integers(55, 76))
+        note.tempo = ust.setting['Tempo']
+        # 休符が続くとラベルでは1つにまとめられてノート数が合わなくなるので、続けない
+        previous_is_rest = i > 0 and ust.notes[-1].lyric == 'R'
+        random_rest = not previous_is_rest and i < n_notes - 2 and rng.random() < rest_ratio
+        if i in (0, n_notes - 1) or random_rest:
+            note.lyric = 'R'
+        else:
+            note.lyric = str(rng.choice(lyrics))
+            if suffix:
+                note.lyric += str(rng.choice(SUFFIXES))
+            note.velocity = int(rng.integers(50, 151))
+            if rng.random() < style_shift_ratio:
+                note.flags = f'S{int(rng.integers(-5, 6))}'
+            if rng.random() < vibrato_ratio:
+                note.vibrato = [
+                    int(rng.integers(30, 100)),
+                    int(rng.integers(100, 250)),
+                    int(rng.integers(10, 80)),
+                    int(rng.integers(1, 50)),
+                    int(rng.integers(1, 50)),
+                    int(rng.integers(0, 100)),
+                    0,
+                    0,
+                ]
+        ust.notes.append(note)
+    return ust
+
+
+def prepare_for_label(ust: utaupy.ust.Ust) -> utaupy.ust.Ust:
+    """フルラベルに変換できるように、歌詞から表情サフィックスを取り除く。
+
+    フラグは utauplugin2score と同じく、区切り文字と干渉する符号を置換する。
+    """
+    for note in ust.notes:
+        for suffix in SUFFIXES:
+            if suffix:
+                note.lyric = note.lyric.replace(suffix, '')
+        if note.flags != '':
+            note.flags = note.flags.replace('-', 'n').replace('+', 'p')
+    return ust
+
+
+def make_f0(ust: utaupy.ust.Ust, seed: int = 0, frame_period: float = FRAME_PERIOD) -> np.ndarray:
+    """UST のノートの音高に近い f0[Hz] を作る。
+
+    休符は 0Hz にして、ゆらぎと急な 0Hz を少し混ぜる。
+    f0_smoother などが処理する部分を含むようにするため。
+    """
+    rng = np.random.default_rng(seed)
+    ends = np.cumsum([note.length_ms for note in ust.notes])
+    n_frames = int(np.ceil(ends[-1] / frame_period))
+    note_index = np.searchsorted(ends, np.arange(n_frames) * frame_period, side='right')
+    note_index = np.minimum(note_index, len(ust.notes) - 1)
+    notenums = np.array([note.notenum for note in ust.notes], dtype=np.float64)
+    is_rest = np.array([note.lyric == 'R' for note in ust.notes])
+    f0 = 440 * 2 ** ((notenums[note_index] - 69 + rng.normal(0, 0.1, n_frames)) / 12)
+    f0[is_rest[note_index]] = 0
+    f0[rng.random(n_frames) < 0.002] = 0
+    return f0
+
+
+def make_song(out_dir: str, n_notes: int, seed: int = 0) -> SyntheticSong:
+    """UST と、それから作ったフルラベルと f0 をまとめて書き出す。
+
+    タイミングラベルは楽譜どおりの時刻にする。
+    """
+    path_ust = join(out_dir, 'song.ust')
+    path_table = join(out_dir, 'song.table')
+    path_full_score = join(out_dir, 'song_score.full')
+    path_full_timing = join(out_dir, 'song_timing.full')
+    path_mono_timing = join(out_dir, 'song_timing.lab')
+    path_f0 = join(out_dir, 'song_acoustic_f0.csv')
+
+    ust = make_ust(n_notes, seed)
+    ust.write(path_ust)
+    write_table(path_table)
+    # フルラベルはサフィックスなしの歌詞から作る (voicecolor_applier の適用後と同じ)
+    table = utaupy.table.load(path_table)
+    song = utaupy.utils.ustobj2songobj(prepare_for_label(make_ust(n_notes, seed)), table)
+    song.write(path_full_score, strict_sinsy_style=False)
+    song.write(path_full_timing, strict_sinsy_style=False)
+    enulib.timing.load(path_full_timing).as_mono().write(path_mono_timing)
+    f0 = make_f0(ust, seed)
+    enulib.features.save_feature_csv(path_f0, f0.astype(np.float32).reshape(-1, 1))
+    return SyntheticSong(
+        ust=path_ust,
+        table=path_table,
+        full_score=path_full_score,
+        full_timing=path_full_timing,
+        mono_timing=path_mono_timing,
+        f0=path_f0,
+        n_notes=n_notes,
+        n_frames=len(f0),
+    )
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+ベンチマーク用の小さな音源 (NNSVS のパッケージ済みモデル) を作る。
+
+timelag, duration, acoustic の各モデルは、乱数で初期化した小さな FFN にする。
+ファイル構成とスケーラの形式は enunu2nnsvs が書き出すものと同じなので、
+ENUNU (SPSVS) でそのまま読み込める。歌声としては聞けないが、処理の流れと計算量は本物と同じ。
+ニューラルボコーダは含めないので、波形生成は WORLD になる。
+"""
+
+import sys
+from os import makedirs
+from os.path import abspath, dirname, join
+
+import numpy as np
+import yaml
+
+import synthetic
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+# 同梱の拡張機能を使うときの config.yaml の extensions 項目
+DEFAULT_EXTENSIONS = {
+    'ust_editor': ['%e/extensions/vibrato_applier.py'],
+    'timing_editor': ['%e/extensions/velocity_applier.py'],
+    'acoustic_editor': [
+        '%e/extensions/f0_smoother.py',
+        '%e/extensions/vibrato_applier.py',
+    ],
+}
+SAMPLE_RATE = 48000
+# WORLD の特徴量の次元数 (48kHz)
+MGC_DIM = 60
+BAP_DIM = 5
+# 音高の数値特徴量 (前・現在・次のノート)。SPSVS はこの3つが数値特徴量の先頭にあるものとして扱う。
+PITCH_QUESTIONS = [
+    'CQS "d1" {/D:(\\NOTE)_}',
+    'CQS "e1" {/E:(\\NOTE)]}',
+    'CQS "f1" {/F:(\\NOTE)#}',
+]
+
+
+def write_question_set(path: str) -> tuple:
+    """音素記号と音高だけの最小限の質問ファイルを書き出して、(二値特徴量数, 数値特徴量数) を返す。"""
+    phonemes = sorted({p for phonemes in synthetic.TABLE.values() for p in phonemes} | {'sil'})
+    lines = []
+    for phoneme in phonemes:
+        lines.append(f'QS "L-Phone_{phoneme}" {{*^{phoneme}-*}}')
+        lines.append(f'QS "C-Phone_{phoneme}" {{*-{phoneme}+*}}')
+        lines.append(f'QS "R-Phone_{phoneme}" {{*+{phoneme}=*}}')
+    lines += PITCH_QUESTIONS
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return len(lines) - len(PITCH_QUESTIONS), len(PITCH_QUESTIONS)
+
+
+def save_scalers(model_dir: str, typ: str, in_scale: np.ndarray, out_mean, out_scale):
+    """enunu2nnsvs と同じ名前で、入力の MinMaxScaler と出力の StandardScaler の値を保存する。"""
+    out_mean = np.asarray(out_mean, dtype=np.float64)
+    out_scale = np.asarray(out_scale, dtype=np.float64)
+    np.save(join(model_dir, f'in_{typ}_scaler_min.npy'), np.zeros_like(in_scale))
+    np.save(join(model_dir, f'in_{typ}_scaler_scale.npy'), in_scale)
+    np.save(join(model_dir, f'out_{typ}_scaler_mean.npy'), out_mean)
+    np.save(join(model_dir, f'out_{typ}_scaler_scale.npy'), out_scale)
+    np.save(join(model_dir, f'out_{typ}_scaler_var.npy'), out_scale**2)
+
+
+def acoustic_stats() -> tuple:
+    """acoustic モデルの出力 (mgc, lf0, vuv, bap の静的・動的特徴量) の平均と標準偏差を作る。"""
+    mean, scale = [], []
+    for dim, static_mean, static_scale in (
+        (MGC_DIM, 0.0, 0.1),
+        (1, 0.0, 0.05),
+        (BAP_DIM, -3.0, 0.5),
+    ):
+        # 静的特徴量、Δ、ΔΔ の順
+        mean += [static_mean] * dim + [0.0] * dim * 2
+        scale += [static_scale] * dim + [0.01] * dim * 2
+    # vuv は lf0 の後ろに入れる
+    i_vuv = MGC_DIM * 3 + 3
+    mean.insert(i_vuv, 0.9)
+    scale.insert(i_vuv, 0.05)
+    return mean, scale
+
+
+def make_voicebank(voice_dir: str, hidden_dim: int = 16, seed: int = 0, extensions=None) -> str:
+    """乱数で初期化したモデルの音源フォルダを作って、モデルのフォルダのパスを返す。"""
+    # pylint: disable=import-outside-toplevel
+    import torch
+    from hydra.utils import instantiate
+    from omegaconf import OmegaConf
+
+    model_dir = join(voice_dir, 'model')
+    makedirs(model_dir, exist_ok=True)
+    with open(join(voice_dir, 'character.txt'), 'w', encoding='utf-8') as f:
+        f.write('name=benchmark\n')
+    synthetic.write_table(join(model_dir, 'benchmark.table'))
+    n_binary, n_numeric = write_question_set(join(model_dir, 'qst.hed'))
+    n_linguistic = n_binary + n_numeric
+    # 音高は MIDI ノート番号なので 0-1 に収まるようにする
+    in_scale = np.ones(n_linguistic)
+    in_scale[n_binary:] = 1 / 128
+
+    config = {
+        'sample_rate': SAMPLE_RATE,
+        'frame_period': synthetic.FRAME_PERIOD,
+        'log_f0_conditioning': True,
+        'use_world_codec': True,
+        'feature_type': 'world',
+        'timelag': {
+            'allowed_range': [-20, 20],
+            'allowed_range_rest': [-40, 40],
+            'force_clip_input_features': True,
+        },
+        'duration': {'force_clip_input_features': True},
+        'acoustic': {
+            'subphone_features': 'coarse_coding',
+            'force_clip_input_features': True,
+            'relative_f0': True,
+        },
+        'simple_enunu': {'segmentation': {'enabled': True}},
+    }
+    if extensions is not None:
+        config['extensions'] = extensions
+    with open(join(model_dir, 'config.yaml'), 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f, allow_unicode=True, sort_keys=False)
+
+    mean, scale = acoustic_stats()
+    # (モデルの種類, 入力のスケール, 出力の平均, 出力の標準偏差, stream_sizes, has_dynamic_features)
+    models = [
+        ('timelag', in_scale, [0.0], [2.0], [1], [False]),
+        ('duration', in_scale, [20.0], [5.0], [1], [False]),
+        (
+            'acoustic',
+            np.concatenate([in_scale, np.ones(4)]),  # coarse coding の4次元を足す
+            mean,
+            scale,
+            [MGC_DIM * 3, 3, 1, BAP_DIM * 3],
+            [True, True, False, True],
+        ),
+    ]
+    torch.manual_seed(seed)
+    for typ, typ_in_scale, out_mean, out_scale, stream_sizes, has_dynamic_features in models:
+        model_config = {
+            'netG': {
+                '_target_': 'nnsvs.model.FFN',
+                'in_dim': len(typ_in_scale),
+                'hidden_dim': hidden_dim,
+                'out_dim': len(out_mean),
+                'num_layers': 2,
+                'dropout': 0.0,
+            },
+            'stream_sizes': stream_sizes,
+            'has_dynamic_features': has_dynamic_features,
+            'num_windows': 3 if any(has_dynamic_features) else 1,
+        }
+        path_model_config = join(model_dir, f'{typ}_model.yaml')
+        with open(path_model_config, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(model_config, f, sort_keys=False)
+        # SPSVS と同じ方法でモデルを作って、乱数の重みを保存する
+        model = instantiate(OmegaConf.load(path_model_config).netG)
+        torch.save({'state_dict': model.state_dict()}, join(model_dir, f'{typ}_model.pth'))
+        save_scalers(model_dir, typ, typ_in_scale, out_mean, out_scale)
+    return model_dir
+
+
+if __name__ == '__main__':
+    make_voicebank(sys.argv[1] if len(sys.argv) > 1 else join(ROOT_DIR, 'benchmark_voicebank'))
@@ -1 +1,15 @@
-from . import enunu2nnsvs, extensions, install_torch, utauplugin2score  # noqa: F401
+# NOTE: 拡張機能からも軽く import できるように、torch や scipy.signal に依存する
+#       enunu2nnsvs と waveform はここでは import しない。
+from . import (  # noqa: F401
+    extensions,
+    features,
+    install_torch,
+    memory,
+    perf_history,
+    render_range,
+    score_rewriter,
+    segmentation,
+    timing,
+    trace,
+    utauplugin2score,
+)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+音響特徴量(mgc, f0, vuv, bap)を float32 のまま受け渡すための関数とか
+
+float32 で受け渡しても、合成される音声は float64 の場合と誤差の範囲で一致する。
+lf0 の丸めは WORLD の位相のずれとして積み重なるので、波形の差は最大振幅の 1e-3 程度になる。
+(tests/test_features.py で、WORLD で分析した特徴量を使って確かめている)
+
+>>> import pyworld
+>>> from tempfile import TemporaryDirectory
+>>> from os.path import join
+>>> rng = np.random.default_rng(0)
+>>> f0 = 220 + 20 * np.sin(np.arange(200) / 10)
+>>> sp = np.exp(rng.standard_normal((200, 513)) * 0.1) * 1e-3
+>>> ap = np.clip(rng.uniform(0, 1, (200, 513)), 0.001, 1)
+>>> wav_64 = pyworld.synthesize(f0, sp, ap, 16000, 5)
+>>> with TemporaryDirectory() as d:
+...     save_feature_csv(join(d, 'f0.csv'), f0.astype(np.float32))
+...     save_feature_csv(join(d, 'sp.csv'), np.log(sp).astype(np.float32))
+...     f0_32 = load_feature_csv(join(d, 'f0.csv'))
+...     sp_32 = np.exp(load_feature_csv(join(d, 'sp.csv')))
+>>> f0_32.dtype, sp_32.dtype
+(dtype('float32'), dtype('float32'))
+>>> wav_32 = pyworld.synthesize(f0_32.astype(np.float64), sp_32.astype(np.float64), ap, 16000, 5)
+>>> bool(np.max(np.abs(wav_32 - wav_64)) < 1e-4 * np.max(np.abs(wav_64)))
+True
+"""
+
+from os.path import splitext
+
+import numpy as np
+
+# float32 を誤差なく往復できる桁数(有効数字9桁)で書き出す
+FEATURE_CSV_FORMAT = '%.9g'
+# この拡張子のときは CSV ではなく npy で読み書きする
+NPY_SUFFIX = '.npy'
+
+
+def is_npy(path: str) -> bool:
+    """npy で読み書きするファイルかどうかを返す。
+
+    >>> is_npy('f0.npy'), is_npy('f0.csv')
+    (True, False)
+    """
+    return splitext(str(path))[1].lower() == NPY_SUFFIX
+
+
+def as_float32(multistream_features) -> tuple:
+    """マルチストリーム特徴量を float32 にそろえる。すでに float32 の場合は複製しない。
+
+    >>> mgc, lf0 = as_float32((np.zeros((2, 3)), np.zeros((2, 1), dtype=np.float32)))
+    >>> mgc.dtype, lf0.dtype
+    (dtype('float32'), dtype('float32'))
+    """
+    return tuple(np.asarray(x, dtype=np.float32) for x in multistream_features)
+
+
+def save_feature(path: str, feature: np.ndarray):
+    """特徴量を書き出す。拡張子が .npy の場合は npy、それ以外は CSV にする。"""
+    if is_npy(path):
+        np.save(path, feature)
+    else:
+        np.savetxt(path, feature, fmt=FEATURE_CSV_FORMAT, delimiter=',')
+
+
+def load_feature(path: str, column: bool = False, dtype=np.float32) -> np.ndarray:
+    """特徴量を読み取る。拡張子が .npy の場合は npy、それ以外は CSV として読む。
+
+    column=True の場合は (N, 1) の形にする。
+    """
+    if is_npy(path):
+        feature = np.load(path).astype(dtype, copy=False)
+    else:
+        feature = np.loadtxt(path, delimiter=',', dtype=dtype)
+    if column:
+        return feature.reshape(-1, 1)
+    return feature
+
+
+def save_feature_csv(path: str, feature: np.ndarray):
+    """特徴量をCSVファイルに書き出す。"""
+    np.savetxt(path, feature, fmt=FEATURE_CSV_FORMAT, delimiter=',')
+
+
+def load_feature_csv(path: str, column: bool = False) -> np.ndarray:
+    """CSVファイルから特徴量を float32 で読み取る。column=True の場合は (N, 1) の形にする。
+
+    float32 の特徴量は書き出して読み直しても値が変わらない。
+
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> rng = np.random.default_rng(0)
+    >>> mgc = rng.standard_normal((100, 60)).astype(np.float32)
+    >>> lf0 = np.log(rng.uniform(100, 1000, (100, 1))).astype(np.float32)
+    >>> with TemporaryDirectory() as d:
+    ...     save_feature_csv(join(d, 'mgc.csv'), mgc)
+    ...     save_feature_csv(join(d, 'f0.csv'), np.exp(lf0))
+    ...     new_mgc = load_feature_csv(join(d, 'mgc.csv'))
+    ...     new_lf0 = np.log(load_feature_csv(join(d, 'f0.csv'), column=True))
+    >>> new_mgc.dtype, new_lf0.dtype, new_lf0.shape
+    (dtype('float32'), dtype('float32'), (100, 1))
+    >>> bool(np.array_equal(new_mgc, mgc))
+    True
+    >>> bool(np.allclose(new_lf0, lf0, rtol=0, atol=1e-6))
+    True
+    """
+    return load_feature(path, column=column)
+
+
+def format_column(values) -> str:
+    """1行に1つの値を書いた文字列にする。拡張機能が書き出す f0 などのファイルの形式。
+
+    0 は 0 と書き、それ以外は Python の float の文字列にする。
+
+    >>> format_column(np.array([0.0, 440.0, 261.6255653005986]))
+    '0\\n440.0\\n261.6255653005986'
+    """
+    values = np.asarray(values, dtype=np.float64).tolist()
+    return '\n'.join('0' if x == 0 else str(x) for x in values)
+
+
+def load_column(path: str) -> np.ndarray:
+    """1行に1つの値を書いたファイル (f0, vuv など) を float64 の1次元配列で読み取る。
+
+    拡張子が .npy の場合は npy として読む。空のファイルは長さ0の配列にする。
+    """
+    if is_npy(path):
+        return np.load(path).astype(np.float64, copy=False).reshape(-1)
+    with open(path, 'r', encoding='utf-8') as f:
+        return np.array(f.read().split(), dtype=np.float64)
+
+
+def save_column(path: str, values, end: str = ''):
+    """1行に1つの値を書いたファイル (f0, vuv など) を書き出す。
+
+    拡張子が .npy の場合は npy として書き出す。CSV の場合は end を末尾に付ける。
+
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> f0 = np.array([0, 220.5, 0, 440.25])
+    >>> with TemporaryDirectory() as d:
+    ...     save_column(join(d, 'f0.csv'), f0, end='\\n')
+    ...     with open(join(d, 'f0.csv'), encoding='utf-8') as f:
+    ...         s = f.read()
+    ...     save_column(join(d, 'f0.npy'), f0)
+    ...     same = [np.array_equal(load_column(join(d, name)), f0) for name in ('f0.csv', 'f0.npy')]
+    >>> s, same
+    ('0\\n220.5\\n0\\n440.25\\n', [True, True])
+    """
+    if is_npy(path):
+        np.save(path, np.asarray(values, dtype=np.float64))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(format_column(values) + end)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成中のメモリ使用量を、段階の切り替わりごとに記録する。
+
+enulib.trace.Tracer に渡すと、span の開始と終了のたびに次の値を記録する。
+- プロセスの RSS (別スレッドで一定間隔で測って、区切りの間の最大値を記録する)
+- tracemalloc で測った Python のメモリ確保量 (現在値と区切りの間の最大値)
+- torch の CUDA メモリ確保量 (torch を使っていて GPU がある場合)
+
+区切りの間の最大値は、その間に実行していた一番内側の段階のものとして記録する。
+最後に、どの段階のどの区間でメモリ使用量が最大になったかをまとめて表示できる。
+"""
+
+import math
+import os
+import sys
+import threading
+import tracemalloc
+
+MB = 1024 * 1024
+
+
+def _windows_memory_counters():
+    """Windows でプロセスのメモリ使用量 (PROCESS_MEMORY_COUNTERS) を返す。取得できない場合は None。"""
+    # pylint: disable=import-outside-toplevel
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        """PROCESS_MEMORY_COUNTERS"""
+
+        _fields_ = [  # noqa: RUF012
+            ('cb', wintypes.DWORD),
+            ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t),
+            ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t),
+            ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_process_memory_info.argtypes = [
+        wintypes.HANDLE,
+        ctypes.POINTER(ProcessMemoryCounters),
+        wintypes.DWORD,
+    ]
+    get_process_memory_info.restype = wintypes.BOOL
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_process_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+def get_rss() -> float:
+    """プロセスの現在の RSS[byte] を返す。測れない場合は nan。
+
+    >>> get_rss() > 0 or math.isnan(get_rss())
+    True
+    """
+    if sys.platform == 'win32':
+        counters = _windows_memory_counters()
+        return math.nan if counters is None else float(counters.WorkingSetSize)
+    try:
+        with open('/proc/self/statm', encoding='ascii') as f:
+            return float(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return math.nan
+
+
+def get_peak_rss() -> float:
+    """プロセスが起動してからの最大 RSS[byte] を返す。測れない場合は nan。
+
+    >>> get_peak_rss() > 0 or math.isnan(get_peak_rss())
+    True
+    """
+    if sys.platform == 'win32':
+        counters = _windows_memory_counters()
+        return math.nan if counters is None else float(counters.PeakWorkingSetSize)
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return math.nan
+    # Linux は KB、macOS は byte で返ってくる
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return float(peak if sys.platform == 'darwin' else peak * 1024)
+
+
+def _cuda_stats() -> dict:
+    """torch の CUDA メモリの確保量[byte]を返す。使っていない場合は空の辞書。
+
+    torch を import していない場合は、import せずに空の辞書を返す。
+    """
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return {}
+    stats = {
+        'torch_allocated': float(torch.cuda.memory_allocated()),
+        'torch_peak': float(torch.cuda.max_memory_allocated()),
+        'torch_reserved': float(torch.cuda.memory_reserved()),
+    }
+    torch.cuda.reset_peak_memory_stats()
+    return stats
+
+
+class MemoryMonitor:
+    """段階の区切りごとのメモリ使用量を記録する。
+
+    Args:
+        interval (float): RSS を測る間隔[s]
+        trace_python (bool): tracemalloc で Python のメモリ確保量を測るかどうか。
+            処理が少し遅くなる。
+        n_top (int): 最大時の tracemalloc のスナップショットから表示する行数
+    """
+
+    def __init__(self, interval: float = 0.05, trace_python: bool = True, n_top: int = 10):
+        self.interval = interval
+        self.trace_python = trace_python
+        self.n_top = n_top
+        self.records = []
+        self._lock = threading.Lock()
+        self._rss_peak = math.nan
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_tracemalloc = False
+        # Python のメモリ確保量が最大だった区切りのスナップショット
+        self._snapshot = None
+        self._snapshot_size = -1
+
+    def _sample(self):
+        """区切りの間の RSS の最大値を更新する。"""
+        rss = get_rss()
+        with self._lock:
+            if math.isnan(self._rss_peak) or rss > self._rss_peak:
+                self._rss_peak = rss
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """計測を始める。"""
+        if self.trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._sample()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='memory_monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """計測を終える。"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def boundary(self, stage: str, segment=None) -> dict:
+        """段階の区切りで呼ぶ。前の区切りからの最大値を stage のものとして記録して返す。"""
+        rss = self._sample()
+        with self._lock:
+            rss_peak = self._rss_peak
+            self._rss_peak = rss
+        record = {'stage': stage, 'segment': segment, 'rss': rss, 'rss_peak': rss_peak}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            record['python_current'] = float(current)
+            record['python_peak'] = float(peak)
+            if current > self._snapshot_size:
+                self._snapshot = tracemalloc.take_snapshot()
+                self._snapshot_size = current
+        record.update(_cuda_stats())
+        self.records.append(record)
+        return record
+
+    def peak_record(self, key: str = 'rss_peak'):
+        """key の値が最大だった記録を返す。記録がない場合は None。"""
+        records = [r for r in self.records if not math.isnan(r.get(key, math.nan))]
+        if len(records) == 0:
+            return None
+        return max(records, key=lambda r: r[key])
+
+    def format_summary(self) -> str:
+        """メモリ使用量が最大になった段階と区間をまとめた文字列を返す。
+
+        >>> monitor = MemoryMonitor(trace_python=False)
+        >>> monitor.records = [
+        ...     {'stage': 'predict_acoustic', 'segment': 0, 'rss': 1e8, 'rss_peak': 2e8},
+        ...     {'stage': 'predict_waveform', 'segment': 3, 'rss': 1e8, 'rss_peak': 5e8},
+        ... ]
+        >>> print(monitor.format_summary())
+        Peak RSS: 476.8 MB in predict_waveform (segment 3)
+        """
+        lines = []
+        for key, label in (
+            ('rss_peak', 'Peak RSS'),
+            ('python_peak', 'Peak Python allocation'),
+            ('torch_peak', 'Peak torch CUDA allocation'),
+        ):
+            record = self.peak_record(key)
+            if record is None:
+                continue
+            where = record['stage']
+            if record['segment'] is not None:
+                where += f' (segment {record["segment"]})'
+            lines.append(f'{label}: {record[key] / MB:.1f} MB in {where}')
+        if self._snapshot is not None and self.n_top > 0:
+            lines.append(
+                f'Top Python allocations at the boundary with the most live memory '
+                f'({self._snapshot_size / MB:.1f} MB):'
+            )
+            for stat in self._snapshot.statistics('lineno')[: self.n_top]:
+                lines.append(f'    {stat}')
+        return '\n'.join(lines)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成ごとの処理時間などの記録を、ローカルのファイルに追記して集計する。
+
+記録は1回の合成につき1行の JSON (JSON Lines) で、追記するだけで書き換えない。
+simple_enunu.py --perf-report で、音源や拡張機能の組み合わせごとの実時間比 (RTF) の
+分布、週ごとの推移、極端に遅かった合成を表示する。
+"""
+
+import json
+import math
+from datetime import datetime
+
+import numpy as np
+
+# 集計に使うパーセンタイル
+PERCENTILES = (50, 90, 99)
+# 外れ値とみなす四分位範囲の倍数
+OUTLIER_IQR_FACTOR = 3.0
+# 外れ値を探すのに必要な記録数
+MIN_RECORDS_FOR_OUTLIERS = 4
+
+
+def append_record(path: str, record: dict):
+    """記録を1行の JSON としてファイルの末尾に追記する。"""
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+    # NOTE: 同時に複数の合成をしても行が混ざらないように、1回の write で書く。
+    with open(path, 'a', encoding='utf-8', newline='\n') as f:
+        f.write(line)
+
+
+def load_records(path: str) -> list:
+    """記録を全部読み取る。書き込み途中などで壊れている行は読み飛ばす。"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def extension_chain(record: dict) -> str:
+    """記録に含まれる拡張機能の一覧を、段階:名前 の並びにする。
+
+    >>> extension_chain({'extensions': ['ust_editor:vibrato_applier', 'timing_editor:x']})
+    'ust_editor:vibrato_applier > timing_editor:x'
+    >>> extension_chain({'extensions': []})
+    '(none)'
+    """
+    extensions = record.get('extensions') or []
+    return ' > '.join(extensions) if extensions else '(none)'
+
+
+def percentiles(values, qs=PERCENTILES) -> list:
+    """パーセンタイルのリストを返す。値がない場合は nan にする。
+
+    >>> percentiles([1, 2, 3, 4, 100], (50, 90))  # doctest: +ELLIPSIS
+    [3.0, 61.6...]
+    >>> percentiles([], (50,))
+    [nan]
+    """
+    values = [v for v in values if v is not None and not math.isnan(v)]
+    if len(values) == 0:
+        return [math.nan for _ in qs]
+    return [float(v) for v in np.percentile(values, qs)]
+
+
+def find_outliers(records: list, key: str = 'rtf', group: str = 'voicebank') -> list:
+    """同じ group の中で key の値が極端に大きい記録を、大きい順に返す。
+
+    第3四分位数 + 四分位範囲 * OUTLIER_IQR_FACTOR より大きいものを外れ値にする。
+
+    >>> records = [{'voicebank': 'a', 'rtf': r} for r in (0.5, 0.6, 0.55, 0.52, 4.0)]
+    >>> [r['rtf'] for r in find_outliers(records)]
+    [4.0]
+    """
+    groups = {}
+    for record in records:
+        if record.get(key) is not None:
+            groups.setdefault(record.get(group), []).append(record)
+    outliers = []
+    for group_records in groups.values():
+        if len(group_records) < MIN_RECORDS_FOR_OUTLIERS:
+            continue
+        q1, q3 = np.percentile([r[key] for r in group_records], (25, 75))
+        threshold = q3 + (q3 - q1) * OUTLIER_IQR_FACTOR
+        outliers += [r for r in group_records if r[key] > threshold]
+    return sorted(outliers, key=lambda r: r[key], reverse=True)
+
+
+def _week(record: dict) -> str:
+    """記録の日時の ISO 週 (2025-W07 の形) を返す。"""
+    year, week, _ = datetime.fromisoformat(record['time']).isocalendar()
+    return f'{year}-W{week:02}'
+
+
+def _format_group_table(title: str, records: list, key_func, last=None) -> list:
+    """key_func でまとめた記録ごとに、RTF とピーク RSS の分布を表にする。
+
+    last を指定した場合は名前順に並べて最後の last 個だけ表示する。指定しない場合は多い順。
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(key_func(record), []).append(record)
+    header = (
+        f'{title:<40} {"n":>6} {"RTF p50":>8} {"p90":>8} {"p99":>8} '
+        f'{"audio[s]":>9} {"RSS[MB]":>8}'
+    )
+    lines = [header, '-' * len(header)]
+    if last is None:
+        items = sorted(groups.items(), key=lambda item: -len(item[1]))
+    else:
+        items = sorted(groups.items(), key=lambda item: str(item[0]))[-last:]
+    for name, group_records in items:
+        p50, p90, p99 = percentiles([r.get('rtf') for r in group_records])
+        (audio,) = percentiles([r.get('audio_sec') for r in group_records], (50,))
+        (rss,) = percentiles([r.get('peak_rss_mb') for r in group_records], (50,))
+        lines.append(
+            f'{str(name)[:40]:<40} {len(group_records):>6} {p50:>8.3f} {p90:>8.3f} {p99:>8.3f} '
+            f'{audio:>9.1f} {rss:>8.0f}'
+        )
+    return lines
+
+
+def format_report(records: list, n_weeks: int = 8, n_outliers: int = 10) -> str:
+    """記録を集計した文字列を返す。"""
+    if len(records) == 0:
+        return 'No records.'
+    records = sorted(records, key=lambda r: r['time'])
+    succeeded = [r for r in records if r.get('status') == 'ok' and r.get('rtf') is not None]
+    lines = [
+        f'Renders: {len(records)} ({len(records) - len(succeeded)} failed), '
+        f'{records[0]["time"]} - {records[-1]["time"]}',
+        '',
+    ]
+    lines += _format_group_table('voicebank', succeeded, lambda r: r.get('voicebank'))
+    lines.append('')
+    lines += _format_group_table('extensions', succeeded, extension_chain)
+    lines.append('')
+    lines += _format_group_table('vocoder', succeeded, lambda r: r.get('vocoder'))
+    lines.append('')
+
+    # 段階ごとの実時間比
+    stages = []
+    for record in succeeded:
+        stages += [stage for stage in record.get('stages', {}) if stage not in stages]
+    header = f'{"stage RTF":<40} {"p50":>8} {"p90":>8} {"p99":>8}'
+    lines += [header, '-' * len(header)]
+    for stage in stages:
+        values = [
+            r['stages'][stage] / r['audio_sec']
+            for r in succeeded
+            if stage in r.get('stages', {}) and r.get('audio_sec')
+        ]
+        p50, p90, p99 = percentiles(values)
+        lines.append(f'{stage:<40} {p50:>8.4f} {p90:>8.4f} {p99:>8.4f}')
+    lines.append('')
+
+    # 週ごとの推移
+    lines += _format_group_table('week', succeeded, _week, last=n_weeks)
+    lines.append('')
+
+    # 外れ値
+    outliers = find_outliers(succeeded)[:n_outliers]
+    lines.append(f'Outliers (RTF > Q3 + {OUTLIER_IQR_FACTOR:g} IQR of the same voicebank)')
+    for record in outliers:
+        stage_times = record.get('stages', {})
+        slowest = max(stage_times, key=stage_times.get) if stage_times else '-'
+        lines.append(
+            f'  {record["time"]}  {record.get("voicebank")}  RTF {record["rtf"]:.3f}  '
+            f'{record.get("audio_sec", math.nan):.1f} s  slowest stage: {slowest}'
+        )
+    if len(outliers) == 0:
+        lines.append('  (none)')
+    return '\n'.join(lines)
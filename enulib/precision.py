@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+CPU で推論するときに、timelag, duration, acoustic モデルを低い精度で動かす。
+
+- int8: Linear と LSTM, GRU の重みを int8 にする (torch の dynamic quantization)。
+- bf16: bfloat16 の autocast で推論する。CPU が bfloat16 に対応している場合だけ使う。
+
+config.yaml の simple_enunu.precision で選ぶ (既定は fp32)。
+int8 の場合、model フォルダに {typ}_model_int8.pth があればそれを読み込み、なければ読み込み時に変換する。
+{typ}_model_int8.json に変換元の {typ}_model.pth のサイズと更新日時を記録しておき、
+モデルが更新されて一致しなくなった場合は変換しなおす。
+
+オフラインで int8 のモデルを model フォルダに保存して、float32 との差 (f0 RMSE, MCD) を確かめる:
+    python -m enulib.precision path/to/model --check song_score.full
+"""
+
+import argparse
+import json
+import math
+import os
+from os.path import exists, join, splitext
+
+import numpy as np
+import torch
+
+PRECISIONS = ('fp32', 'int8', 'bf16')
+# 低い精度にするモデル
+MODEL_TYPES = ('timelag', 'duration', 'acoustic')
+# int8 で保存したモデルのファイル名の末尾
+INT8_SUFFIX = '_int8'
+# dynamic quantization で int8 にする層
+QUANTIZED_LAYERS = {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}
+
+
+def int8_model_path(model_dir: str, typ: str) -> str:
+    """int8 にしたモデルを保存するパスを返す。"""
+    return join(model_dir, f'{typ}_model{INT8_SUFFIX}.pth')
+
+
+def fp32_model_path(model_dir: str, typ: str) -> str:
+    """int8 にする元の float32 のモデルのパスを返す。"""
+    return join(model_dir, f'{typ}_model.pth')
+
+
+def signature_path(path_converted: str) -> str:
+    """変換したモデル (int8, TorchScript) の変換元を記録するファイルのパスを返す。"""
+    return splitext(path_converted)[0] + '.json'
+
+
+def file_signature(path: str) -> dict:
+    """ファイルのサイズと更新日時を返す。重みのファイルは大きいので、中身は読まない。"""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def quantize_dynamic(model: torch.nn.Module) -> torch.nn.Module:
+    """Linear と LSTM, GRU の重みを int8 にしたモデルを返す。元のモデルは変更しない。"""
+    return torch.ao.quantization.quantize_dynamic(model, QUANTIZED_LAYERS, dtype=torch.qint8)
+
+
+def save_signature(path: str, path_fp32: str):
+    """変換元の float32 のモデル (path_fp32) のサイズと更新日時を、変換したモデルの隣に記録する。"""
+    with open(signature_path(path), 'w', encoding='utf-8') as f:
+        json.dump(file_signature(path_fp32), f)
+
+
+def signature_matches(path: str, path_fp32: str) -> bool:
+    """変換したモデルが、今の float32 のモデルから変換したものかどうかを返す。"""
+    try:
+        with open(signature_path(path), encoding='utf-8') as f:
+            signature = json.load(f)
+        return signature == file_signature(path_fp32)
+    except (OSError, ValueError):
+        return False
+
+
+def save_int8_model(model: torch.nn.Module, path: str, path_fp32: str):
+    """int8 にしたモデルを保存する。int8 の層は state_dict を float のモデルに読めないので、丸ごと保存する。
+
+    変換元の float32 のモデル (path_fp32) のサイズと更新日時を、隣の JSON ファイルに記録する。
+    """
+    torch.save(model, path)
+    save_signature(path, path_fp32)
+
+
+def int8_model_is_current(path: str, path_fp32: str) -> bool:
+    """int8 にしたモデルが、今の float32 のモデルから変換したものかどうかを返す。"""
+    return signature_matches(path, path_fp32)
+
+
+def load_int8_model(path: str) -> torch.nn.Module:
+    """save_int8_model で保存したモデルを読み込む。"""
+    model = torch.load(path, map_location='cpu', weights_only=False)
+    model.eval()
+    return model
+
+
+def get_int8_model(model: torch.nn.Module, model_dir: str, typ: str, logger) -> torch.nn.Module:
+    """保存した int8 のモデルを読み込む。
+
+    ない場合は読み込み時に変換する。変換元のモデルと一致しない場合は変換しなおして保存する。
+    """
+    path = int8_model_path(model_dir, typ)
+    path_fp32 = fp32_model_path(model_dir, typ)
+    if not exists(path):
+        return quantize_dynamic(model)
+    if int8_model_is_current(path, path_fp32):
+        return load_int8_model(path)
+    logger.warning('%s does not match %s. Quantizing it again.', path, path_fp32)
+    model = quantize_dynamic(model)
+    try:
+        save_int8_model(model, path, path_fp32)
+    except OSError as e:
+        logger.warning('Failed to save %s: %s', path, e)
+    return model
+
+
+def supports_bf16() -> bool:
+    """CPU で bfloat16 の行列演算を高速に実行できるかどうかを返す。"""
+    is_supported = getattr(torch.cpu, '_is_avx512_bf16_supported', None)
+    if is_supported is None:
+        return False
+    amx = getattr(torch.cpu, '_is_amx_tile_supported', lambda: False)
+    return bool(is_supported() or amx())
+
+
+def _to_float32(outputs):
+    """モデルの出力のテンソルを float32 に戻す。NNSVS は出力を numpy にするため。"""
+    if isinstance(outputs, torch.Tensor):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    if isinstance(outputs, (tuple, list)):
+        return type(outputs)(_to_float32(o) for o in outputs)
+    return outputs
+
+
+class Bf16Autocast(torch.nn.Module):
+    """モデルを bfloat16 の autocast で実行して、出力を float32 で返す。
+
+    NNSVS がモデルに対して呼ぶ inference や is_autoregressive などは、包んだモデルのものを使う。
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.model, name)
+
+    def forward(self, *args, **kwargs):
+        with torch.autocast('cpu', dtype=torch.bfloat16):
+            return _to_float32(self.model(*args, **kwargs))
+
+    def inference(self, *args, **kwargs):
+        with torch.autocast('cpu', dtype=torch.bfloat16):
+            return _to_float32(self.model.inference(*args, **kwargs))
+
+
+def apply_precision(engine, precision: str, model_dir: str, logger) -> str:
+    """SPSVS の timelag, duration, acoustic モデルを precision の精度にして、実際に使う精度を返す。"""
+    if precision not in PRECISIONS:
+        raise ValueError(f'precision must be one of {PRECISIONS}, not {precision}')
+    if precision == 'fp32':
+        return precision
+    if torch.device(engine.device).type != 'cpu':
+        logger.warning('precision: %s is only for CPU inference. Using fp32.', precision)
+        return 'fp32'
+    if precision == 'bf16' and not supports_bf16():
+        logger.warning('This CPU does not support bfloat16. Using fp32.')
+        return 'fp32'
+    for typ in MODEL_TYPES:
+        model = getattr(engine, f'{typ}_model')
+        if precision == 'int8':
+            model = get_int8_model(model, model_dir, typ, logger)
+        else:
+            model = Bf16Autocast(model)
+        setattr(engine, f'{typ}_model', model)
+    logger.info('Using %s models for timelag, duration and acoustic.', precision)
+    return precision
+
+
+def f0_rmse_cent(lf0_ref: np.ndarray, lf0: np.ndarray, vuv_ref, vuv, threshold=0.5) -> float:
+    """両方で有声のフレームの f0 の差の二乗平均平方根[cent]を返す。
+
+    >>> lf0 = np.log(np.full(4, 440.0))
+    >>> round(f0_rmse_cent(lf0, lf0 + np.log(2) / 12, np.ones(4), np.ones(4)), 3)
+    100.0
+    """
+    voiced = (np.ravel(vuv_ref) > threshold) & (np.ravel(vuv) > threshold)
+    if not voiced.any():
+        return math.nan
+    diff = (np.ravel(lf0)[voiced] - np.ravel(lf0_ref)[voiced]) * 1200 / np.log(2)
+    return float(np.sqrt(np.mean(diff**2)))
+
+
+def mel_cepstral_distortion(mgc_ref: np.ndarray, mgc: np.ndarray) -> float:
+    """0次を除いたメルケプストラムの平均の歪み[dB]を返す。
+
+    >>> mgc = np.zeros((3, 4))
+    >>> mel_cepstral_distortion(mgc, mgc)
+    0.0
+    """
+    diff = mgc[:, 1:] - mgc_ref[:, 1:]
+    return float(np.mean(10 / np.log(10) * np.sqrt(2 * np.sum(diff**2, axis=1))))
+
+
+def compare_outputs(engine_ref, engine, labels) -> dict:
+    """float32 のモデルと低い精度のモデルで、同じラベルから音響特徴量を作って比べる。
+
+    タイミングは float32 のモデルで推定したものを両方に使う。
+    """
+    duration_modified_labels = engine_ref.predict_timing(labels)
+    durations = engine.predict_timing(labels)
+    features = []
+    for e in (engine_ref, engine):
+        acoustic_features = e.predict_acoustic(duration_modified_labels)
+        features.append(
+            e.postprocess_acoustic(
+                duration_modified_labels=duration_modified_labels,
+                acoustic_features=acoustic_features,
+                post_filter_type='none',
+                trajectory_smoothing=False,
+            )
+        )
+    (mgc_ref, lf0_ref, vuv_ref, *_), (mgc, lf0, vuv, *_) = features
+    # 推定した音素の長さの差[フレーム]
+    frame_shift = duration_modified_labels.frame_shift
+    ref_frames = np.asarray(duration_modified_labels.end_times) / frame_shift
+    test_frames = np.asarray(durations.end_times) / frame_shift
+    return {
+        'f0_rmse_cent': f0_rmse_cent(lf0_ref, lf0, vuv_ref, vuv),
+        'mcd_db': mel_cepstral_distortion(mgc_ref, mgc),
+        'timing_rmse_frames': float(np.sqrt(np.mean((ref_frames - test_frames) ** 2))),
+        'vuv_mismatch': float(np.mean((np.ravel(vuv_ref) > 0.5) != (np.ravel(vuv) > 0.5))),
+    }
+
+
+def main():
+    """int8 のモデルを保存して、float32 のモデルとの差を表示する。"""
+    # pylint: disable=import-outside-toplevel
+    from nnmnkwii.io import hts
+    from nnsvs.logger import getLogger
+    from nnsvs.svs import SPSVS
+
+    parser = argparse.ArgumentParser(description='Save reduced-precision NNSVS models')
+    parser.add_argument('model_dir', help='NNSVS packed model dir (e.g. voicebank/model)')
+    parser.add_argument(
+        '--precision', choices=PRECISIONS[1:], default='int8', help='Precision to check'
+    )
+    parser.add_argument('--check', nargs='*', default=[], help='Full-context score labels')
+    parser.add_argument('--no_save', action='store_true', help='Do not save int8 models')
+    args = parser.parse_args()
+    logger = getLogger(verbose=100)
+
+    engine_ref = SPSVS(args.model_dir, device='cpu')
+    if args.precision == 'int8' and not args.no_save:
+        for typ in MODEL_TYPES:
+            path = int8_model_path(args.model_dir, typ)
+            save_int8_model(
+                quantize_dynamic(getattr(engine_ref, f'{typ}_model')),
+                path,
+                fp32_model_path(args.model_dir, typ),
+            )
+            logger.info('Saved %s', path)
+    if not args.check:
+        return
+    engine = SPSVS(args.model_dir, device='cpu')
+    if apply_precision(engine, args.precision, args.model_dir, logger) == 'fp32':
+        return
+    for path_label in args.check:
+        labels = hts.load(path_label).round_()
+        result = compare_outputs(engine_ref, engine, labels)
+        logger.info(
+            '%s: f0 RMSE %.2f cent, MCD %.3f dB, timing RMSE %.2f frames, V/UV mismatch %.2f%%',
+            path_label,
+            result['f0_rmse_cent'],
+            result['mcd_db'],
+            result['timing_rmse_frames'],
+            result['vuv_mismatch'] * 100,
+        )
+
+
+if __name__ == '__main__':
+    main()
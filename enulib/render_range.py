@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+長い曲の一部の範囲だけを合成するための計算をする。
+
+範囲の前後に余裕 (padding) を持たせたノートだけでタイミングを推定し、
+範囲に重なる合成区間だけを合成して、波形を範囲ぴったりに切り取る。
+NNSVS のタイミング推定はノートの時刻に time-lag を足すだけで時間軸を伸縮しないので、
+楽譜上の時刻の範囲をそのまま合成結果の時刻として切り取れる。
+
+拡張機能には範囲のノートだけにしたUSTを渡して、範囲の情報 (RANGE_INFO_FILE_NAME) を
+状態保存用フォルダに置く。
+"""
+
+import json
+import re
+from os.path import exists, join
+from typing import Union
+
+import numpy as np
+
+# 範囲の前後に、タイミング推定の文脈として含める長さ[s]
+DEFAULT_PADDING = 2.0
+# 4分音符の長さ[Ticks]
+TICKS_PER_QUARTER = 480
+RANGE_PATTERN = re.compile(r'^\s*([\d.]+)\s*(s?)\s*-\s*([\d.]+)\s*(s?)\s*$')
+# 範囲を指定して合成するときに、拡張機能の状態保存用フォルダに置く範囲の情報のファイル
+RANGE_INFO_FILE_NAME = 'render_range.json'
+
+
+def parse_range(text: str) -> tuple:
+    """範囲の文字列を (開始, 終了, 単位) にする。
+
+    's' が付いていれば秒、なければ Ticks とみなす。
+
+    >>> parse_range('12.5-20s')
+    (12.5, 20.0, 'sec')
+    >>> parse_range('1920-3840')
+    (1920.0, 3840.0, 'ticks')
+    >>> parse_range('20-10s')
+    Traceback (most recent call last):
+      ...
+    ValueError: The end of the range must be after the start: 20-10s
+    """
+    match = RANGE_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f'Range must be like "1920-3840" (ticks) or "12.5-20s": {text}')
+    start, end = float(match.group(1)), float(match.group(3))
+    if end <= start:
+        raise ValueError(f'The end of the range must be after the start: {text}')
+    unit = 'sec' if match.group(2) or match.group(4) else 'ticks'
+    return start, end, unit
+
+
+def ticks_to_seconds(ticks, note_lengths, note_seconds) -> np.ndarray:
+    """ノートの長さ[Ticks]と長さ[s]の列から、曲頭からの Ticks を秒にする。
+
+    テンポ変更はノートごとに反映する。曲の範囲外は曲頭と曲末にそろえる。
+
+    >>> ticks_to_seconds([0, 720, 1440, 9999], [480, 960], [0.5, 0.5])
+    array([0.   , 0.625, 1.   , 1.   ])
+    """
+    cum_ticks = np.concatenate([[0], np.cumsum(note_lengths)])
+    cum_seconds = np.concatenate([[0], np.cumsum(note_seconds)])
+    return np.interp(ticks, cum_ticks, cum_seconds)
+
+
+def choose_window(
+    starts, note_start_mask, range_start: float, range_end: float, padding: float
+) -> tuple:
+    """範囲の前後に padding[s] 以上の文脈を含むように、ラベルの範囲を決める。
+
+    ノートの途中で区切らないように、ノートの最初の音素 (休符を含む) で区切る。
+    (最初のラベルのインデックス, 最後のラベルのインデックス) を返す。
+
+    >>> starts = np.arange(10, dtype=float)  # 1秒ごとのノート
+    >>> choose_window(starts, np.ones(10, dtype=bool), 4.5, 5.5, 2.0)
+    (2, 7)
+    >>> choose_window(starts, np.ones(10, dtype=bool), 0.5, 9.5, 2.0)
+    (0, 9)
+    """
+    candidates = np.flatnonzero(note_start_mask)
+    starts = np.asarray(starts)
+    before = candidates[starts[candidates] <= range_start - padding]
+    after = candidates[starts[candidates] >= range_end + padding]
+    first = int(before[-1]) if len(before) > 0 else 0
+    last = int(after[0]) - 1 if len(after) > 0 else len(starts) - 1
+    return first, last
+
+
+def window_notes(note_start_mask, first: int, last: int) -> tuple:
+    """ラベルの first から last までに含まれるノートを (曲頭からのノート番号, ノート数) で返す。
+
+    >>> window_notes(np.array([True, False, True, True, False, True]), 2, 4)
+    (1, 2)
+    """
+    note_start_mask = np.asarray(note_start_mask)
+    return int(note_start_mask[:first].sum()), int(note_start_mask[first : last + 1].sum())
+
+
+def crop_ust(ust, note_offset: int, n_notes: int):
+    """USTを範囲のノートだけにする。
+
+    最初のノートにはその時点のテンポを書いておいて、範囲の前のテンポ変更を引き継ぐ。
+    """
+    # テンポを書いていないノートにも、その時点のテンポを設定しておく
+    ust.reload_tempo()
+    notes = ust.notes[note_offset : note_offset + n_notes]
+    notes[0].tempo = notes[0].tempo
+    ust.notes = notes
+    return ust
+
+
+def save_range_info(state_dir: str, range_info: dict):
+    """範囲の情報を拡張機能の状態保存用フォルダに書き出す。"""
+    with open(join(state_dir, RANGE_INFO_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(range_info, f)
+
+
+def load_range_info(state_dir: Union[str, None]) -> Union[dict, None]:
+    """範囲の情報を読み取る。範囲を指定せずに合成している場合は None を返す。"""
+    if state_dir is None or not exists(join(state_dir, RANGE_INFO_FILE_NAME)):
+        return None
+    with open(join(state_dir, RANGE_INFO_FILE_NAME), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def first_f0_frame(
+    range_info: Union[dict, None], frame_period: float, from_song_start: bool = False
+) -> int:
+    """最初に合成する区間の f0 の先頭フレームの位置を返す。
+
+    from_song_start が True なら曲頭から、False なら切り取ったラベルの先頭から数える。
+    範囲を指定せずに合成している場合は 0 を返す。
+
+    >>> first_f0_frame({'label_offset': 10.0, 'f0_start': 1.5}, 5)
+    300
+    >>> first_f0_frame({'label_offset': 10.0, 'f0_start': 1.5}, 5, from_song_start=True)
+    2300
+    >>> first_f0_frame(None, 5)
+    0
+    """
+    if range_info is None:
+        return 0
+    start = range_info.get('f0_start', 0.0)
+    if from_song_start:
+        start += range_info['label_offset']
+    return round(start * 1000 / frame_period)
+
+
+def select_segments(durations, origin: float, range_start: float, range_end: float) -> tuple:
+    """範囲に重なる合成区間を選ぶ。
+
+    区間は時刻 origin[s] から durations[s] の長さで隙間なく並んでいるとする。
+    (最初の区間のインデックス, 最後の区間のインデックス, 最初の区間の開始時刻) を返す。
+
+    >>> select_segments([3.0, 4.0, 5.0], 1.0, 5.0, 7.5)
+    (1, 1, 4.0)
+    >>> select_segments([3.0, 4.0, 5.0], 1.0, 3.0, 9.0)
+    (0, 2, 1.0)
+    """
+    ends = origin + np.cumsum(durations)
+    starts = ends - np.asarray(durations)
+    overlapping = np.flatnonzero((starts < range_end) & (ends > range_start))
+    if len(overlapping) == 0:
+        raise ValueError(f'No segments overlap the range {range_start:.3f}-{range_end:.3f} s')
+    first, last = int(overlapping[0]), int(overlapping[-1])
+    return first, last, float(starts[first])
+
+
+def trim_samples(
+    range_start: float, range_end: float, wav_start: float, sample_rate: int, n_samples: int
+) -> tuple:
+    """時刻 wav_start[s] から始まる波形から、範囲を切り取るサンプルの位置を返す。
+
+    >>> trim_samples(5.0, 7.5, 4.0, 100, 1000)
+    (100, 350)
+    >>> trim_samples(3.0, 20.0, 4.0, 100, 1000)
+    (0, 1000)
+    """
+    begin = round((range_start - wav_start) * sample_rate)
+    end = begin + round((range_end - range_start) * sample_rate)
+    return min(max(begin, 0), n_samples), min(max(end, 0), n_samples)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+フルラベル(score)の音素記号を、音素の種類ごとの置換表でまとめて書き換える。
+
+score_myaizer のように全部の音素を書き換える処理を、外部プロセスを起動せずに行う。
+コンテキスト文字列から音素の種類(p1)と音素記号(p4)の列だけを取り出して配列で置換し、
+前後の音素記号(p2, p3, p5, p6)も合わせて書き換える。
+
+config.yaml の score_editor に、拡張機能のパスの代わりに置換表を書くと使える。
+
+    extensions:
+        score_editor:
+            - rewrite: {vowel: a, default: my}
+              keep: [N]
+            - "%e/extensions/velocity_applier.py"
+"""
+
+import re
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# 置換表で指定できる音素の種類と、対応する p1 の値
+PHONEME_CLASSES = {'vowel': 'v', 'consonant': 'c', 'break': 'b'}
+# 種類や音素記号で指定されなかった音素に使う置換表のキー
+DEFAULT_KEY = 'default'
+# 書き換えない音素の種類 (sil, pau)
+REST_CLASSES = ('s', 'p')
+# p1@p2^p3-p4+p5=p6_ の部分
+PHONEME_PART = re.compile(r'([^@]*)@([^\^]*)\^([^-]*)-([^+]*)\+([^=]*)=([^_]*)_')
+# 前後に音素がないときの値
+EMPTY = 'xx'
+
+
+@dataclass
+class RewriteRule:
+    """音素の置換表
+
+    replacements のキーには、音素の種類 (vowel, consonant, break) と、
+    個別の音素記号と、それ以外の全部の音素を表す default が使える。
+    優先順位は 音素記号 > 音素の種類 > default の順。
+    休符と keep に含まれる音素記号は書き換えない。
+    """
+
+    replacements: dict
+    keep: tuple = field(default=('N',))
+
+    @classmethod
+    def from_config(cls, config) -> 'RewriteRule':
+        """config.yaml の項目 ({rewrite: {...}, keep: [...]}) から置換表を作る。"""
+        keep = config.get('keep', ('N',))
+        if isinstance(keep, str):
+            keep = (keep,)
+        replacements = {str(k): str(v) for k, v in config['rewrite'].items()}
+        return cls(replacements, tuple(str(symbol) for symbol in keep))
+
+
+# score_myaizer と同じ置換表。母音は a に、それ以外は my にする。
+MYAIZE_RULE = RewriteRule({'vowel': 'a', DEFAULT_KEY: 'my'})
+
+
+def is_rewrite_rule(entry) -> bool:
+    """拡張機能の項目が置換表かどうかを返す。
+
+    >>> is_rewrite_rule({'rewrite': {'vowel': 'a'}}), is_rewrite_rule('%e/extensions/dummy.py')
+    (True, False)
+    """
+    return not isinstance(entry, str) and 'rewrite' in entry
+
+
+def rewrite_identities(identities: np.ndarray, classes: np.ndarray, rule: RewriteRule):
+    """音素記号の配列を置換表で書き換えた配列を返す。
+
+    >>> identities = np.array(['pau', 'k', 'a', 'N', 'cl', 't', 'o', 'sil'], dtype=object)
+    >>> classes = np.array(['p', 'c', 'v', 'v', 'b', 'c', 'v', 's'])
+    >>> rewrite_identities(identities, classes, MYAIZE_RULE).tolist()
+    ['pau', 'my', 'a', 'N', 'my', 'my', 'a', 'sil']
+    >>> rule = RewriteRule({'consonant': 'ny', 'vowel': 'a', 'o': 'i'}, keep=())
+    >>> rewrite_identities(identities, classes, rule).tolist()
+    ['pau', 'ny', 'a', 'a', 'cl', 'ny', 'i', 'sil']
+    """
+    replacements = rule.replacements
+    target = ~np.isin(classes, REST_CLASSES) & ~np.isin(identities, list(rule.keep))
+    new_identities = identities.copy()
+    if DEFAULT_KEY in replacements:
+        new_identities[target] = replacements[DEFAULT_KEY]
+    for name, phoneme_class in PHONEME_CLASSES.items():
+        if name in replacements:
+            new_identities[target & (classes == phoneme_class)] = replacements[name]
+    for symbol, replacement in replacements.items():
+        if symbol == DEFAULT_KEY or symbol in PHONEME_CLASSES:
+            continue
+        new_identities[target & (identities == symbol)] = replacement
+    return new_identities
+
+
+def _shift(values: np.ndarray, n: int, fill_value=EMPTY) -> np.ndarray:
+    """配列を n 個ずらして、はみ出した部分を fill_value で埋める。n > 0 で後ろにずらす。"""
+    shifted = np.full(len(values), fill_value, dtype=values.dtype)
+    if n > 0:
+        shifted[n:] = values[:-n]
+    else:
+        shifted[:n] = values[-n:]
+    return shifted
+
+
+def rewrite_contexts(contexts: list, rules) -> list:
+    """フルラベルのコンテキスト文字列のリストを、置換表を順に適用して書き換える。
+
+    複数の置換表を続けて適用しても、コンテキスト文字列の解析と組み立ては1回だけ行う。
+
+    >>> contexts = ['p@xx^xx-pau+k=a_xx', 'c@xx^pau-k+a=N_1', 'v@pau^k-a+N=pau_2',
+    ...             'v@k^a-N+pau=xx_1', 'p@a^N-pau+xx=xx_xx']
+    >>> for c in rewrite_contexts(contexts, [MYAIZE_RULE]):
+    ...     print(c)
+    p@xx^xx-pau+my=a_xx
+    c@xx^pau-my+a=N_1
+    v@pau^my-a+N=pau_2
+    v@my^a-N+pau=xx_1
+    p@a^N-pau+xx=xx_xx
+    """
+    if len(contexts) == 0:
+        return contexts
+    matches = [PHONEME_PART.match(c) for c in contexts]
+    columns = np.array([m.groups() for m in matches], dtype=object)
+    classes = columns[:, 0].astype(str)
+    old_identities = columns[:, 3]
+    identities = old_identities
+    for rule in rules:
+        identities = rewrite_identities(identities, classes, rule)
+    changed = identities != old_identities
+    if not changed.any():
+        return contexts
+    # 前後の音素記号は、その音素が書き換わったところだけ置き換える
+    for i_column, n in ((1, 2), (2, 1), (4, -1), (5, -2)):
+        mask = _shift(changed, n, fill_value=False)
+        columns[mask, i_column] = _shift(identities, n)[mask]
+    columns[:, 3] = identities
+    return [
+        f'{p1}@{p2}^{p3}-{p4}+{p5}={p6}_{c[m.end():]}'
+        for (p1, p2, p3, p4, p5, p6), c, m in zip(columns.tolist(), contexts, matches)
+    ]
+
+
+def rewrite_labels(labels, rules):
+    """nnmnkwii の HTSLabelFile の音素記号を置換表で書き換える。"""
+    labels.contexts = rewrite_contexts(list(labels.contexts), rules)
+    return labels
+
+
+def rewrite_file(path_full, rules):
+    """フルラベルファイルの音素記号を置換表で書き換えて上書きする。"""
+    with open(path_full, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    lines = [line.split(maxsplit=2) for line in lines if line.strip()]
+    contexts = rewrite_contexts([context for _, _, context in lines], rules)
+    s = '\n'.join(f'{start} {end} {c}' for (start, end, _), c in zip(lines, contexts))
+    with open(path_full, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(s)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成時にフルラベルを分割する位置を決める。
+
+曲の長さ、並列数、1区間あたりのメモリ上限から区間数を決めて、
+各区間の長さがなるべく均等になるように休符で区切る。
+"""
+
+from math import ceil
+
+import numpy as np
+
+# HTSラベルの時刻の単位[s]
+HTS_TIME_UNIT = 1e-7
+# 1フレームあたりの特徴量が推論中に何回複製されるかの目安
+FEATURE_MEMORY_FACTOR = 4
+# 波形1サンプルあたりのボコーダのメモリ使用量の目安[byte]
+# WORLD: スペクトル包絡と非周期性指標(float64)の分
+# ニューラルボコーダ: 中間層(64ch程度, float32)の分
+WORLD_BYTES_PER_SAMPLE = 80
+NEURAL_VOCODER_BYTES_PER_SAMPLE = 1024
+
+
+def is_silence(context: str) -> bool:
+    """ラベルが休符(sil, pau)かどうかを返す。
+
+    >>> is_silence('xx^xx-pau+k=a@xx')
+    True
+    >>> is_silence('pau^k-a+sil=xx@1')
+    False
+    >>> is_silence('sil')
+    True
+    """
+    if '@' in context:
+        return '-sil+' in context or '-pau+' in context
+    return context in ('sil', 'pau')
+
+
+def estimate_memory_per_second(
+    sample_rate: int,
+    frame_period: float,
+    n_linguistic: int,
+    n_acoustic: int,
+    neural_vocoder: bool,
+) -> float:
+    """1秒ぶんの合成に必要なメモリ量[MB]をおおまかに見積もる。
+
+    >>> round(estimate_memory_per_second(48000, 5, 800, 200, False), 2)
+    6.71
+    """
+    frames_per_second = 1000 / frame_period
+    feature_bytes = frames_per_second * (n_linguistic + n_acoustic) * 4 * FEATURE_MEMORY_FACTOR
+    if neural_vocoder:
+        waveform_bytes = sample_rate * NEURAL_VOCODER_BYTES_PER_SAMPLE
+    else:
+        waveform_bytes = sample_rate * WORLD_BYTES_PER_SAMPLE
+    return (feature_bytes + waveform_bytes) / 1024 / 1024
+
+
+def count_segments(
+    total_duration: float,
+    max_duration=None,
+    min_duration: float = 5.0,
+    workers: int = 1,
+) -> int:
+    """区間数を決める。
+
+    - メモリ上限から決まる最大長を超えない数にする。
+    - 並列処理したときに均等に終わるように、並列数の倍数にする。
+    - ただし、各区間が最小長を下回るほど細かくはしない。(メモリ上限のほうを優先する)
+
+    >>> count_segments(60)
+    1
+    >>> count_segments(60, max_duration=25)
+    3
+    >>> count_segments(60, max_duration=25, workers=4)
+    4
+    >>> count_segments(12, workers=4)
+    2
+    """
+    n_required = 1
+    if max_duration is not None and max_duration > 0:
+        n_required = ceil(total_duration / max_duration)
+    n_segments = ceil(n_required / workers) * workers
+    n_upper = max(1, int(total_duration // min_duration))
+    return max(n_required, min(n_segments, n_upper))
+
+
+def find_split_candidates(labels, silence_threshold: float = 0.1) -> np.ndarray:
+    """分割位置の候補として、一定以上の長さがある休符のインデックスを返す。
+    最初と最後のラベルは候補にしない。
+    """
+    start_times = np.asarray(labels.start_times)
+    end_times = np.asarray(labels.end_times)
+    durations = (end_times - start_times) * HTS_TIME_UNIT
+    silences = np.fromiter((is_silence(c) for c in labels.contexts), dtype=bool, count=len(labels))
+    mask = silences & (durations > silence_threshold)
+    mask[0] = False
+    mask[-1] = False
+    return np.flatnonzero(mask)
+
+
+def choose_split_indices(
+    end_times: np.ndarray,
+    candidates: np.ndarray,
+    n_segments: int,
+    max_duration=None,
+) -> list[int]:
+    """区間の長さが均等になるように、候補の中から分割位置を選ぶ。
+
+    選ばれた休符は直前の区間の末尾に含めるので、区切りの時刻は休符の終了時刻になる。
+    メモリ上限(max_duration)を超える区間が残った場合は、その区間の中央に近い候補でさらに区切る。
+
+    >>> end_times = np.arange(1, 11) * 1e7  # 1秒ごとのラベル
+    >>> choose_split_indices(end_times, np.array([2, 4, 6, 8]), 2)
+    [4]
+    >>> choose_split_indices(end_times, np.array([2, 4, 6, 8]), 3)
+    [2, 6]
+    >>> choose_split_indices(end_times, np.array([2, 4, 6, 8]), 1, max_duration=4)
+    [2, 4, 6]
+    """
+    if len(candidates) == 0:
+        return []
+    cut_times = end_times[candidates] * HTS_TIME_UNIT
+    total_duration = end_times[-1] * HTS_TIME_UNIT
+
+    # 均等に区切った場合の時刻に一番近い候補を選ぶ
+    chosen = set()
+    for target in total_duration * np.arange(1, n_segments) / n_segments:
+        chosen.add(int(np.argmin(np.abs(cut_times - target))))
+
+    # メモリ上限を超える区間を、その区間の中央に近い候補で区切る
+    if max_duration is not None and max_duration > 0:
+        while True:
+            bounds = [0.0] + [cut_times[i] for i in sorted(chosen)] + [total_duration]
+            for seg_start, seg_end in zip(bounds[:-1], bounds[1:]):
+                if seg_end - seg_start <= max_duration:
+                    continue
+                inside = np.flatnonzero((cut_times > seg_start) & (cut_times < seg_end))
+                if len(inside) == 0:
+                    continue
+                middle = (seg_start + seg_end) / 2
+                chosen.add(int(inside[np.argmin(np.abs(cut_times[inside] - middle))]))
+                break
+            # 区切れる区間がなくなったら終了
+            else:
+                break
+
+    return [int(candidates[i]) for i in sorted(chosen)]
+
+
+def split_labels(labels, split_indices: list[int]) -> list:
+    """指定したインデックスのラベルの直後で区切って、各区間の開始時刻を0にそろえる。"""
+    bounds = [0] + [idx + 1 for idx in split_indices] + [len(labels)]
+    segments = []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        seg = labels[first:last]
+        offset = seg.start_times[0]
+        seg.start_times = np.asarray(seg.start_times) - offset
+        seg.end_times = np.asarray(seg.end_times) - offset
+        segments.append(seg)
+    return segments
+
+
+def plan_segments(
+    labels,
+    workers: int = 1,
+    max_duration=None,
+    min_duration: float = 5.0,
+    silence_threshold: float = 0.1,
+) -> list:
+    """曲の長さと並列数とメモリ上限をもとに、ラベルを長さの揃った区間に分割する。
+
+    Args:
+        labels (nnmnkwii.io.hts.HTSLabelFile): タイミング推定済みのフルラベル
+        workers (int): 区間を並列に合成する外部のワーカープロセスの数。区間数がこの倍数になるようにする。
+        max_duration (float): 1区間の最大長[s]。メモリ上限から計算する。
+        min_duration (float): 1区間の最小長[s]。
+        silence_threshold (float): 分割に使う休符の最小長[s]。
+
+    Returns:
+        list[nnmnkwii.io.hts.HTSLabelFile]: 分割されたラベルのリスト
+    """
+    end_times = np.asarray(labels.end_times) - labels.start_times[0]
+    total_duration = end_times[-1] * HTS_TIME_UNIT
+    n_segments = count_segments(total_duration, max_duration, min_duration, workers)
+    candidates = find_split_candidates(labels, silence_threshold)
+    split_indices = choose_split_indices(end_times, candidates, n_segments, max_duration)
+    return split_labels(labels, split_indices)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+CPU で推論するときの torch のスレッド数を、モデルと CPU に合わせて自動で決める。
+
+torch の既定のスレッド数は CPU の論理コア数になっていて、小さな系列モデルでは
+スレッドの同期のほうが重くなったり、複数のプロセスで並列に合成するとコアを取り合ったりする。
+読み込んだモデルに短い合成用の入力を通して、いくつかのスレッド数で時間を測り、一番速いものを使う。
+結果はモデルのファイルと CPU の組み合わせごとにキャッシュして、次からは測らずに使う。
+
+スレッド数は次の順で決める。
+1. 引数 (simple_enunu.py の --torch_threads)
+2. 環境変数 SIMPLE_ENUNU_TORCH_THREADS (並列で合成するワーカーに指定する)
+3. config.yaml の simple_enunu.torch_threads
+4. auto (自動調整)
+"""
+
+import hashlib
+import json
+import os
+import platform
+from os.path import exists, isfile, join
+from time import perf_counter
+
+import torch
+
+# スレッド数を指定する環境変数
+THREADS_ENV = 'SIMPLE_ENUNU_TORCH_THREADS'
+# 時間を測るときの入力の長さ[フレーム] (timelag と duration は音素数)
+BENCHMARK_FRAMES = 400
+BENCHMARK_PHONEMES = 100
+
+
+def cpu_signature() -> str:
+    """CPU の種類と論理コア数と torch のバージョンを表す文字列を返す。"""
+    return '|'.join(
+        [
+            platform.machine(),
+            platform.processor(),
+            str(os.cpu_count()),
+            torch.__version__,
+        ]
+    )
+
+
+def model_signature(model_dir: str) -> str:
+    """モデルのフォルダのファイルの名前・サイズ・更新日時から、モデルを区別するハッシュを作る。
+
+    重みのファイルは大きいので、中身は読まない。
+    """
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = join(model_dir, name)
+        if isfile(path):
+            stat = os.stat(path)
+            h.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return h.hexdigest()[:16]
+
+
+def candidate_thread_counts(n_cpu: int) -> list:
+    """試すスレッド数の候補 (1 と 2 の累乗と論理コア数) を返す。
+
+    >>> candidate_thread_counts(12)
+    [1, 2, 4, 8, 12]
+    >>> candidate_thread_counts(1)
+    [1]
+    """
+    counts = []
+    n = 1
+    while n < n_cpu:
+        counts.append(n)
+        n *= 2
+    counts.append(n_cpu)
+    return counts
+
+
+def parse_threads(value):
+    """スレッド数の設定値を、'auto' か None か正の整数にする。
+
+    >>> parse_threads('4'), parse_threads('Auto'), parse_threads(None), parse_threads('')
+    (4, 'auto', None, None)
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and value.lower() == 'auto':
+        return 'auto'
+    value = int(value)
+    if value < 1:
+        raise ValueError(f'torch_threads must be a positive integer or "auto", not {value}')
+    return value
+
+
+def measure(forward_funcs: list, num_threads: int, repeat: int = 3) -> float:
+    """スレッド数を num_threads にして、全部のモデルを1回ずつ通す時間[s]の最小値を返す。"""
+    torch.set_num_threads(num_threads)
+    with torch.inference_mode():
+        # 1回目はメモリ確保などが入るので測らない
+        for forward in forward_funcs:
+            forward()
+        times = []
+        for _ in range(repeat):
+            t_start = perf_counter()
+            for forward in forward_funcs:
+                forward()
+            times.append(perf_counter() - t_start)
+    return min(times)
+
+
+def tune(forward_funcs: list, candidates: list, repeat: int = 3) -> tuple:
+    """候補のスレッド数ごとに時間を測って、(一番速いスレッド数, {スレッド数: 時間}) を返す。"""
+    timings = {n: measure(forward_funcs, n, repeat) for n in candidates}
+    best = min(timings, key=timings.get)
+    return best, timings
+
+
+def load_cache(path: str) -> dict:
+    """キャッシュを読み取る。ない場合や壊れている場合は空の辞書を返す。"""
+    if not exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_cache(path: str, cache: dict):
+    """キャッシュを書き出す。書き込み途中のファイルを読まれないように、別名で書いてから置き換える。"""
+    path_temp = f'{path}.{os.getpid()}.tmp'
+    with open(path_temp, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2, ensure_ascii=False)
+    os.replace(path_temp, path)
+
+
+def set_interop_threads(num_threads: int) -> bool:
+    """torch の inter-op スレッド数を設定する。並列処理を始めた後は変更できないので、その場合は False。"""
+    try:
+        torch.set_num_interop_threads(num_threads)
+    except RuntimeError:
+        return False
+    return True
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+タイミングラベル(モノラベル・フルラベル)の時刻を配列で加工するための関数とか
+
+utaupy.hts.load でコンテキストを全部解析すると遅いので、
+時刻とコンテキスト文字列だけを読み取って、ノートの区切りなど必要な情報だけを取り出す。
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+# HTSラベルの時刻の単位[100ns]で表した 5ms
+TIME_UNIT = 50000
+# フルラベルのコンテキストの区切り文字 (utaupy.hts と同じ)
+CONTEXT_SEPARATORS = re.compile('[' + re.escape('=+-~∼!@#$%^ˆ&;_|[]') + ']')
+
+
+@dataclass
+class TimingLabel:
+    """時刻の配列とコンテキスト文字列のリストの組"""
+
+    starts: np.ndarray
+    ends: np.ndarray
+    contexts: list
+
+    def __len__(self):
+        return len(self.contexts)
+
+    @property
+    def is_full(self) -> bool:
+        """フルラベルかどうか"""
+        return len(self.contexts) > 0 and '/A:' in self.contexts[0]
+
+    def phoneme_contexts(self) -> list:
+        """フルラベルの p1~p16 のリストを音素ごとに返す。"""
+        return [CONTEXT_SEPARATORS.split(c.split('/A:', 1)[0]) for c in self.contexts]
+
+    def note_start_mask(self) -> np.ndarray:
+        """ノート内の最初の音素かどうかの配列を返す。
+
+        utaupy.hts と同じく、休符のときと、ノート内で最初の音節の最初の音素のときにノートを切り替える。
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        for i, (c, p) in enumerate(zip(self.contexts, self.phoneme_contexts())):
+            b = CONTEXT_SEPARATORS.split(c.split('/B:', 1)[1].split('/C:', 1)[0])
+            # p1: 音素の種類, p12: 音節内の位置, b2: ノート内の位置
+            mask[i] = p[0] in ('s', 'p') or (b[1] == '1' and p[11] == '1')
+        if len(mask) > 0:
+            mask[0] = True
+        return mask
+
+    def consonant_mask(self) -> np.ndarray:
+        """子音かどうかの配列を返す。"""
+        return np.array([p[0] == 'c' for p in self.phoneme_contexts()], dtype=bool)
+
+    def as_mono(self) -> 'TimingLabel':
+        """モノラベルにする。フルラベルの p4 (現在の音素) を音素記号にする。"""
+        if not self.is_full:
+            return TimingLabel(self.starts.copy(), self.ends.copy(), list(self.contexts))
+        return TimingLabel(
+            self.starts.copy(), self.ends.copy(), [p[3] for p in self.phoneme_contexts()]
+        )
+
+    def write(self, path):
+        """ファイル出力する。"""
+        s = '\n'.join(
+            f'{start} {end} {context}'
+            for start, end, context in zip(self.starts.tolist(), self.ends.tolist(), self.contexts)
+        )
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(s)
+
+
+def load(path) -> TimingLabel:
+    """モノラベルかフルラベルを読み取る。"""
+    starts, ends, contexts = [], [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f.read().splitlines():
+            if not line.strip():
+                continue
+            start, end, context = line.split(maxsplit=2)
+            starts.append(int(start))
+            ends.append(int(end))
+            contexts.append(context)
+    return TimingLabel(np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64), contexts)
+
+
+def load_note_times(path) -> tuple:
+    """フルラベルから、ノートごとの開始時刻と終了時刻[100ns]の配列を読み取る。
+
+    utaupy.hts.load で全部のコンテキストを解析せずに、ノートの区切りだけを判定する。
+    """
+    label = load(path)
+    note_starts = np.flatnonzero(label.note_start_mask())
+    note_lasts = np.append(note_starts[1:], len(label)) - 1
+    return label.starts[note_starts], label.ends[note_lasts]
+
+
+def consonant_magnifications(velocities) -> np.ndarray:
+    """子音速度を子音の長さの倍率に変換する。
+
+    >>> consonant_magnifications([100, 0, 200]).tolist()
+    [1.0, 2.0, 0.5]
+    """
+    return 2 ** ((100 - np.asarray(velocities, dtype=np.float64)) / 100)
+
+
+def apply_velocities(label: TimingLabel, velocities) -> TimingLabel:
+    """各ノートの最初の音素が子音の場合、子音速度に応じてその発声開始時刻を変える。
+
+    直前の音素の発声終了時刻も合わせて変える。
+    """
+    note_starts = np.flatnonzero(label.note_start_mask())
+    # ノート数が一致しないと処理できないのでエラー
+    if len(note_starts) != len(velocities):
+        raise ValueError(
+            f'USTのノート数 ({len(velocities)} notes) と'
+            f'timingラベルのノート数 ({len(note_starts)} notes) が一致しません。'
+            f' / Numbers of notes in UST ({len(velocities)}) and'
+            f' in Timing-label ({len(note_starts)} notes) do not match.'
+        )
+    magnifications = consonant_magnifications(velocities)
+    # 最初の音素が子音のノートだけ処理する
+    is_consonant = label.consonant_mask()[note_starts]
+    indices = note_starts[is_consonant]
+    durations = label.ends[indices] - label.starts[indices]
+    new_durations = np.round(durations * magnifications[is_consonant]).astype(np.int64)
+    label.starts[indices] = label.ends[indices] - new_durations
+    # 発声終了時刻 = 次の音素の発声開始時刻 にする
+    label.ends[:-1] = label.starts[1:]
+    return label
+
+
+def repair_start_times(label: TimingLabel, time_unit: int = TIME_UNIT) -> TimingLabel:
+    """発声開始時刻が直前の音素の発声開始時刻より早くなっている音素を直す。
+
+    各音素の発声開始時刻を、直前の音素の発声開始時刻より time_unit 以上後ろにする。
+    発声終了時刻は次の音素の発声開始時刻に合わせる。
+
+    >>> starts = np.array([0, 100000, 50000, 300000])
+    >>> ends = np.array([100000, 50000, 300000, 400000])
+    >>> label = repair_start_times(TimingLabel(starts, ends, list('abcd')))
+    >>> label.starts.tolist(), label.ends.tolist()
+    ([0, 100000, 150000, 300000], [100000, 150000, 300000, 400000])
+    """
+    if len(label) == 0:
+        return label
+    # s'[k] = max(s[k], s'[k-1] + unit) を累積最大値でまとめて計算する
+    offsets = np.arange(len(label), dtype=np.int64) * time_unit
+    label.starts = np.maximum.accumulate(label.starts - offsets) + offsets
+    label.ends[:-1] = label.starts[1:]
+    label.ends[-1] = max(label.ends[-1], label.starts[-1] + time_unit)
+    return label
+
+
+def timing_pass(
+    path_full_timing,
+    path_mono_timing=None,
+    velocities=None,
+    repair: bool = True,
+    time_unit: int = TIME_UNIT,
+):
+    """タイミングラベルを1回読み取って、子音速度の適用と時刻の逆転の修正をまとめて行う。
+
+    フルラベルとモノラベルを両方書き出して、(モノラベル, フルラベル) を返す。
+
+    Args:
+        path_full_timing (str): タイミング推定済みのフルラベルのパス
+        path_mono_timing (str): モノラベルのパス。None の場合は書き出さない。
+        velocities (list): ノートごとの子音速度。None の場合は適用しない。
+        repair (bool): 発声開始時刻の逆転を直すかどうか
+        time_unit (int): 音素の最小の長さ[100ns]
+    """
+    full = load(path_full_timing)
+    if velocities is not None:
+        full = apply_velocities(full, velocities)
+    if repair:
+        full = repair_start_times(full, time_unit)
+    mono = full.as_mono()
+    full.write(path_full_timing)
+    if path_mono_timing is not None:
+        mono.write(path_mono_timing)
+    return mono, full
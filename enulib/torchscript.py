@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+timelag, duration, acoustic モデルとニューラルボコーダを TorchScript に書き出して使う。
+
+NNSVS のモデルは Python の nn.Module のまま1区間ずつ実行されるので、短いフレーズでは
+層ごとの呼び出しのオーバーヘッドが目立つ。TorchScript にして凍結 (freeze) すると、
+torch がグラフ全体を最適化 (演算の融合など) して実行できる。
+
+書き出し:
+    python -m enulib.torchscript path/to/model
+
+model フォルダに {typ}_model_scripted.pt があれば ENUNU はそれを使い、なければ今まで通り
+Python のモデルを使う。config.yaml の simple_enunu.backend: eager で使わないようにできる。
+{typ}_model_scripted.json に書き出し元の {typ}_model.pth のサイズと更新日時を記録しておき、
+モデルが更新されて一致しなくなった場合は警告して Python のモデルを使う。
+トレースした長さとは別の長さの入力で元のモデルと出力が一致しない場合は書き出さないので、
+自己回帰モデルなど、入力の長さで処理が変わるモデルは書き出されない。
+"""
+
+import argparse
+from os.path import exists, join
+from time import perf_counter
+
+import torch
+
+from .precision import fp32_model_path, save_signature, signature_matches
+
+BACKENDS = ('auto', 'eager', 'torchscript')
+# TorchScript にするモデル
+MODEL_TYPES = ('timelag', 'duration', 'acoustic', 'vocoder')
+SCRIPTED_SUFFIX = '_scripted'
+# トレースと確認に使う入力の長さ[フレーム]。確認ではトレースと違う長さを使う。
+TRACE_FRAMES = 100
+CHECK_FRAMES = 157
+# 元のモデルと出力が一致しているとみなす誤差
+ATOL = 1e-4
+RTOL = 1e-3
+
+
+def scripted_model_path(model_dir: str, typ: str) -> str:
+    """TorchScript にしたモデルのパスを返す。"""
+    return join(model_dir, f'{typ}_model{SCRIPTED_SUFFIX}.pt')
+
+
+def save_scripted_model(scripted, path: str, path_fp32: str):
+    """TorchScript にしたモデルを保存して、書き出し元のモデルのサイズと更新日時を隣に記録する。"""
+    torch.jit.save(scripted, path)
+    save_signature(path, path_fp32)
+
+
+class _Inference(torch.nn.Module):
+    """model.inference(x, [長さ]) を forward にする。トレース用。"""
+
+    def __init__(self, model, with_lengths: bool = True):
+        super().__init__()
+        self.model = model
+        self.with_lengths = with_lengths
+
+    def forward(self, x):
+        if self.with_lengths:
+            return self.model.inference(x, [x.shape[1]])
+        return self.model.inference(x)
+
+
+def _flatten(outputs) -> list:
+    """出力のテンソルを平らなリストにする。"""
+    if isinstance(outputs, torch.Tensor):
+        return [outputs]
+    if isinstance(outputs, (tuple, list)):
+        return [t for o in outputs for t in _flatten(o)]
+    return []
+
+
+def _allclose(a, b) -> bool:
+    a, b = _flatten(a), _flatten(b)
+    return len(a) == len(b) and all(
+        x.shape == y.shape and torch.allclose(x, y, atol=ATOL, rtol=RTOL) for x, y in zip(a, b)
+    )
+
+
+def make_input(typ: str, in_dim: int, n_frames: int) -> torch.Tensor:
+    """モデルに通す入力を作る。ボコーダは (フレーム, 次元)、それ以外は (1, フレーム, 次元)。"""
+    generator = torch.Generator().manual_seed(n_frames)
+    if typ == 'vocoder':
+        return torch.randn(n_frames, in_dim, generator=generator)
+    return torch.randn(1, n_frames, in_dim, generator=generator)
+
+
+def trace_model(model, typ: str, in_dim: int):
+    """モデルをトレースして凍結する。別の長さの入力で出力が一致しない場合は None を返す。"""
+    if getattr(model, 'is_autoregressive', lambda: False)():
+        return None
+    wrapper = _Inference(model, with_lengths=typ != 'vocoder').eval()
+    x_trace = make_input(typ, in_dim, TRACE_FRAMES)
+    x_check = make_input(typ, in_dim, CHECK_FRAMES)
+    with torch.inference_mode():
+        expected = wrapper(x_check)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(wrapper, x_trace, check_trace=False).eval())
+    with torch.inference_mode():
+        actual = scripted(x_check)
+    if not _allclose(expected, actual):
+        return None
+    return scripted
+
+
+def get_models(engine) -> dict:
+    """SPSVS から TorchScript にできるモデルと入力の次元を {種類: (モデル, 次元)} で返す。"""
+    models = {}
+    for typ in MODEL_TYPES[:3]:
+        config = getattr(engine, f'{typ}_config')
+        models[typ] = (getattr(engine, f'{typ}_model'), config.netG.in_dim)
+    # ニューラルボコーダは条件付けの特徴量だけを入力にするものだけ
+    in_scaler = getattr(engine, 'vocoder_in_scaler', None)
+    if engine.vocoder is not None and hasattr(engine.vocoder, 'inference') and in_scaler:
+        models['vocoder'] = (engine.vocoder, len(in_scaler.mean_))
+    return models
+
+
+class ScriptedModel(torch.nn.Module):
+    """TorchScript のモデルを NNSVS から元のモデルと同じように使えるようにする。
+
+    inference を入力だけで呼ばれた場合は TorchScript のモデルを使い、
+    それ以外の引数がある場合や、is_autoregressive などのメソッドは元のモデルを使う。
+    """
+
+    def __init__(self, scripted, model, typ: str):
+        super().__init__()
+        self.scripted = scripted
+        self.model = model
+        self.typ = typ
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self.model, name)
+
+    def forward(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
+
+    def inference(self, x, *args, **kwargs):
+        if kwargs:
+            return self.model.inference(x, *args, **kwargs)
+        if self.typ == 'vocoder':
+            if args:
+                return self.model.inference(x, *args)
+            return self.scripted(x)
+        # (x, lengths) で呼ばれる。長さは入力から決まるので使わない。
+        if len(args) > 1:
+            return self.model.inference(x, *args)
+        return self.scripted(x)
+
+
+def load_scripted_model(path: str, device):
+    """TorchScript のモデルを読み込む。CPU の場合は推論用の最適化もする。"""
+    scripted = torch.jit.load(path, map_location=device)
+    scripted.eval()
+    if torch.device(device).type == 'cpu':
+        try:
+            scripted = torch.jit.optimize_for_inference(scripted)
+        except RuntimeError:
+            pass
+    return scripted
+
+
+def apply_scripted_models(
+    engine, model_dir: str, backend: str, logger, model_types=MODEL_TYPES
+) -> list:
+    """model フォルダに TorchScript のモデルがあれば、元のモデルと置き換える。
+
+    置き換えたモデルの種類のリストを返す。
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'backend must be one of {BACKENDS}, not {backend}')
+    if backend == 'eager':
+        return []
+    replaced = []
+    for typ in model_types:
+        path = scripted_model_path(model_dir, typ)
+        attr = 'vocoder' if typ == 'vocoder' else f'{typ}_model'
+        model = getattr(engine, attr, None)
+        if model is None or not exists(path):
+            continue
+        # 書き出した後でモデルが更新されていたら、古いグラフを使わない
+        if not signature_matches(path, fp32_model_path(model_dir, typ)):
+            logger.warning(
+                '%s does not match %s. Using the eager model. '
+                'Export it again with "python -m enulib.torchscript".',
+                path,
+                fp32_model_path(model_dir, typ),
+            )
+            continue
+        try:
+            scripted = load_scripted_model(path, engine.device)
+        except RuntimeError as e:
+            logger.warning('Failed to load %s. Using the eager model: %s', path, e)
+            continue
+        setattr(engine, attr, ScriptedModel(scripted, model, typ))
+        replaced.append(typ)
+    if backend == 'torchscript' and len(replaced) == 0:
+        logger.warning('No TorchScript models are found in %s. Using eager models.', model_dir)
+    if replaced:
+        logger.info('Using TorchScript models: %s', ', '.join(replaced))
+    return replaced
+
+
+def _latency(func, x, repeat: int = 10) -> float:
+    with torch.inference_mode():
+        func(x)
+        t_start = perf_counter()
+        for _ in range(repeat):
+            func(x)
+    return (perf_counter() - t_start) / repeat
+
+
+def main():
+    """TorchScript にしたモデルを書き出して、元のモデルとの速さを比べる。"""
+    # pylint: disable=import-outside-toplevel
+    from nnsvs.logger import getLogger
+    from nnsvs.svs import SPSVS
+
+    parser = argparse.ArgumentParser(description='Export NNSVS models to TorchScript')
+    parser.add_argument('model_dir', help='NNSVS packed model dir (e.g. voicebank/model)')
+    args = parser.parse_args()
+    logger = getLogger(verbose=100)
+
+    engine = SPSVS(args.model_dir, device='cpu')
+    for typ, (model, in_dim) in get_models(engine).items():
+        try:
+            scripted = trace_model(model, typ, in_dim)
+        except Exception as e:  # noqa: BLE001
+            logger.warning('%s: can not be traced: %s', typ, e)
+            continue
+        if scripted is None:
+            logger.warning('%s: outputs depend on the input length. Skipped.', typ)
+            continue
+        path = scripted_model_path(args.model_dir, typ)
+        save_scripted_model(scripted, path, fp32_model_path(args.model_dir, typ))
+        x = make_input(typ, in_dim, CHECK_FRAMES)
+        eager = _latency(_Inference(model, with_lengths=typ != 'vocoder').eval(), x)
+        optimized = _latency(load_scripted_model(path, 'cpu'), x)
+        logger.info(
+            '%s: saved %s (eager %.2f ms, TorchScript %.2f ms)',
+            typ,
+            path,
+            eager * 1000,
+            optimized * 1000,
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+合成の段階ごとの処理時間を記録して、Chrome のトレース形式で書き出す。
+
+ENUNU.svs と main の各段階を span で囲むと、開始時刻と処理時間と区間番号などが記録される。
+書き出したファイルは chrome://tracing や https://ui.perfetto.dev で開ける。
+記録は数十件程度なので、書き出さない場合も常に記録する。
+enulib.memory.MemoryMonitor を渡すと、段階の区切りごとにメモリ使用量も記録する。
+"""
+
+import json
+import math
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Tracer:
+    """段階ごとの処理時間を記録する。
+
+    >>> tracer = Tracer()
+    >>> with tracer.span('predict_acoustic', segment=0) as args:
+    ...     args['frames'] = 120
+    >>> event = tracer.events[0]
+    >>> event['name'], event['ph'], event['args']['segment'], event['args']['frames']
+    ('predict_acoustic', 'X', 0, 120)
+    >>> list(tracer.stage_times())
+    ['predict_acoustic']
+    >>> tracer.count('predict_acoustic'), tracer.total_time > 0
+    (1, True)
+    """
+
+    def __init__(self, memory=None):
+        self.events = []
+        # enulib.memory.MemoryMonitor
+        self.memory = memory
+        # 実行中の段階 (名前, 引数) のスタック
+        self._stack = []
+        # 一番外側の段階の合計時間[s] (ファイル保存のダイアログなど、段階の外の時間を含まない)
+        self.total_time = 0.0
+        self.pid = os.getpid()
+        # トレースの時刻の基準
+        self._t0 = perf_counter()
+        self._thread_names = {}
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """with 文の中の処理を1つの段階として記録する。
+
+        返り値の辞書に値を入れると、フレーム数など処理の後でわかる情報も記録できる。
+        """
+        thread = threading.current_thread()
+        self._thread_names.setdefault(thread.ident, thread.name)
+        args['thread'] = thread.name
+        i_record = self._memory_boundary()
+        self._stack.append((name, args))
+        t_start = perf_counter()
+        try:
+            yield args
+        finally:
+            t_end = perf_counter()
+            self._memory_boundary()
+            self._stack.pop()
+            if len(self._stack) == 0:
+                self.total_time += t_end - t_start
+            if self.memory is not None:
+                # この段階(と内側の段階)を実行していた間の最大値
+                peaks = [r['rss_peak'] for r in self.memory.records[i_record:]]
+                args['rss_peak_mb'] = max(peaks, default=math.nan) / 1024 / 1024
+            self.events.append(
+                {
+                    'name': name,
+                    'cat': 'simple_enunu',
+                    'ph': 'X',
+                    'ts': (t_start - self._t0) * 1e6,
+                    'dur': (t_end - t_start) * 1e6,
+                    'pid': self.pid,
+                    'tid': thread.ident,
+                    'args': args,
+                }
+            )
+
+    def _memory_boundary(self) -> int:
+        """前の区切りからのメモリ使用量を、実行中の一番内側の段階のものとして記録する。
+
+        記録を始めた位置を返す。
+        """
+        if self.memory is None:
+            return 0
+        if self._stack:
+            name, args = self._stack[-1]
+            self.memory.boundary(name, args.get('segment'))
+        else:
+            self.memory.boundary('main')
+        return len(self.memory.records)
+
+    def stage_times(self) -> dict:
+        """段階ごとの合計時間[s]を、初めて記録された順に返す。"""
+        times = {}
+        for event in self.events:
+            times[event['name']] = times.get(event['name'], 0.0) + event['dur'] / 1e6
+        return times
+
+    def count(self, name: str) -> int:
+        """name の段階が記録された回数 (区間数など) を返す。"""
+        return sum(1 for event in self.events if event['name'] == name)
+
+    def to_chrome_trace(self) -> dict:
+        """Chrome のトレースイベント形式の辞書にする。"""
+        metadata = [
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self.pid,
+                'tid': tid,
+                'args': {'name': name},
+            }
+            for tid, name in self._thread_names.items()
+        ]
+        events = sorted(self.events, key=lambda event: event['ts'])
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path: str):
+        """Chrome のトレースイベント形式の JSON ファイルを書き出す。"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
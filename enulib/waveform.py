@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+長い曲の波形を、メモリに全部載せずに扱うための関数とか
+"""
+
+import struct
+from dataclasses import dataclass
+from math import cos, log10, pi, sin, sqrt
+
+import numpy as np
+from scipy import signal
+
+# 一度に処理するサンプル数
+CHUNK_SIZE = 1 << 20
+# ラウドネス(ITU-R BS.1770)の計算に使う値
+LOUDNESS_BLOCK_SIZE = 0.4  # [s]
+LOUDNESS_SUB_BLOCKS = 4  # 75% overlap
+LOUDNESS_ABSOLUTE_GATE = -70.0  # [LUFS]
+
+
+class WaveformSpill:
+    """区間ごとに合成した波形をファイルに追記していき、最後に memmap として開く。
+
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> with TemporaryDirectory() as d:
+    ...     spill = WaveformSpill(join(d, 'wav.raw'))
+    ...     spill.append(np.ones(3))
+    ...     spill.append(np.zeros(2))
+    ...     wav = spill.open()
+    ...     print(wav.dtype, wav.tolist())
+    ...     del wav
+    float32 [1.0, 1.0, 1.0, 0.0, 0.0]
+    """
+
+    def __init__(self, path: str, dtype=np.float32):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        # 空のファイルを作っておく
+        with open(self.path, 'wb'):
+            pass
+
+    def append(self, wav: np.ndarray):
+        """波形をファイルの末尾に追記する。"""
+        wav = np.asarray(wav).reshape(-1)
+        with open(self.path, 'ab') as f:
+            wav.astype(self.dtype, copy=False).tofile(f)
+        self.length += len(wav)
+
+    def open(self, mode='r+') -> np.memmap:
+        """書き出した波形全体を memmap として開く。"""
+        return np.memmap(self.path, dtype=self.dtype, mode=mode, shape=(self.length,))
+
+
+def _odd_ext_left(x: np.ndarray, n: int) -> np.ndarray:
+    return 2 * x[0] - x[n:0:-1]
+
+
+def _odd_ext_right(x: np.ndarray, n: int) -> np.ndarray:
+    return 2 * x[-1] - x[-2 : -(n + 2) : -1]
+
+
+def filtfilt_inplace(b, a, x: np.ndarray, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """scipy.signal.filtfilt (padtype='odd') と同じ計算を、チャンクごとにその場で行う。
+
+    一時的なメモリ使用量はチャンクの大きさで決まるので、memmap した波形にも使える。
+
+    >>> b, a = signal.butter(5, [0.01, 0.9], 'bandpass')
+    >>> x = np.random.default_rng(0).standard_normal(1000)
+    >>> y = x.copy()
+    >>> _ = filtfilt_inplace(b, a, y, chunk_size=64)
+    >>> bool(np.allclose(y, signal.filtfilt(b, a, x)))
+    True
+    """
+    padlen = 3 * max(len(a), len(b))
+    if len(x) <= padlen:
+        x[:] = signal.filtfilt(b, a, x)
+        return x
+    zi = signal.lfilter_zi(b, a)
+    left = _odd_ext_left(x, padlen)
+    right = _odd_ext_right(x, padlen)
+
+    # 前向きに畳み込む
+    _, state = signal.lfilter(b, a, left, zi=zi * left[0])
+    for i in range(0, len(x), chunk_size):
+        x[i : i + chunk_size], state = signal.lfilter(b, a, x[i : i + chunk_size], zi=state)
+    right, _ = signal.lfilter(b, a, right, zi=state)
+
+    # 後ろ向きに畳み込む
+    right = right[::-1]
+    _, state = signal.lfilter(b, a, right, zi=zi * right[0])
+    for i in range(len(x), 0, -chunk_size):
+        start = max(0, i - chunk_size)
+        y, state = signal.lfilter(b, a, x[start:i][::-1], zi=state)
+        x[start:i] = y[::-1]
+    return x
+
+
+def bandpass_filter_inplace(
+    wav: np.ndarray, sample_rate: int, cutoff: int = 70, chunk_size: int = CHUNK_SIZE
+) -> np.ndarray:
+    """nnsvs.dsp.bandpass_filter と同じ帯域通過フィルタを、その場で適用する。"""
+    nyquist = sample_rate // 2
+    b, a = signal.butter(5, [cutoff / nyquist, 0.999], 'bandpass')
+    return filtfilt_inplace(b, a, wav, chunk_size=chunk_size)
+
+
+def concatenate(wavs: list, dtype=np.float32) -> np.ndarray:
+    """区間ごとの波形を float32 の配列にまとめる。まとめた波形はリストから解放していく。"""
+    wav = np.empty(sum(len(w.reshape(-1)) for w in wavs), dtype=dtype)
+    position = 0
+    while wavs:
+        w = wavs.pop(0).reshape(-1)
+        wav[position : position + len(w)] = w
+        position += len(w)
+    return wav
+
+
+def _biquad(kind: str, fc: float, q: float, gain_db: float, sample_rate: int):
+    """K特性フィルタ用の双2次フィルタの係数を返す。(pyloudnorm と同じ計算)"""
+    a_gain = 10 ** (gain_db / 40)
+    w0 = 2 * pi * fc / sample_rate
+    alpha = sin(w0) / (2 * q)
+    if kind == 'high_shelf':
+        b = [
+            a_gain * ((a_gain + 1) + (a_gain - 1) * cos(w0) + 2 * sqrt(a_gain) * alpha),
+            -2 * a_gain * ((a_gain - 1) + (a_gain + 1) * cos(w0)),
+            a_gain * ((a_gain + 1) + (a_gain - 1) * cos(w0) - 2 * sqrt(a_gain) * alpha),
+        ]
+        a = [
+            (a_gain + 1) - (a_gain - 1) * cos(w0) + 2 * sqrt(a_gain) * alpha,
+            2 * ((a_gain - 1) - (a_gain + 1) * cos(w0)),
+            (a_gain + 1) - (a_gain - 1) * cos(w0) - 2 * sqrt(a_gain) * alpha,
+        ]
+    elif kind == 'high_pass':
+        b = [(1 + cos(w0)) / 2, -(1 + cos(w0)), (1 + cos(w0)) / 2]
+        a = [1 + alpha, -2 * cos(w0), 1 - alpha]
+    else:
+        raise ValueError(f'Unknown filter type: {kind}')
+    return np.array(b) / a[0], np.array(a) / a[0]
+
+
+@dataclass
+class WaveformStats:
+    """波形を1回なめて得られる統計量"""
+
+    peak: float
+    loudness: float = float('nan')
+    has_nan: bool = False
+
+
+def scan_waveform(
+    wav: np.ndarray, sample_rate: int, loudness: bool = False, chunk_size: int = CHUNK_SIZE
+) -> WaveformStats:
+    """波形を先頭から1回だけなめて、ピークとラウドネス(LUFS)を計算する。
+
+    ラウドネスは ITU-R BS.1770 (pyloudnorm の integrated_loudness) と同じ方法で計算する。
+
+    >>> sr = 48000
+    >>> sine = np.sin(2 * np.pi * 997 * np.arange(5 * sr) / sr)
+    >>> stats = scan_waveform(sine, sr, loudness=True, chunk_size=10000)
+    >>> round(stats.peak, 3), round(stats.loudness, 2)
+    (1.0, -3.05)
+    """
+    peak = 0.0
+    has_nan = False
+    # 100ms ごとのK特性フィルタ後の二乗和
+    sub_block_size = round(LOUDNESS_BLOCK_SIZE / LOUDNESS_SUB_BLOCKS * sample_rate)
+    sub_block_energies = []
+    carry = np.zeros(0)
+    filters = []
+    if loudness:
+        filters = [
+            _biquad('high_shelf', 1500.0, 1 / sqrt(2), 4.0, sample_rate),
+            _biquad('high_pass', 38.0, 0.5, 0.0, sample_rate),
+        ]
+        states = [np.zeros(2) for _ in filters]
+
+    for i in range(0, len(wav), chunk_size):
+        chunk = np.asarray(wav[i : i + chunk_size], dtype=np.float64)
+        chunk_peak = np.nanmax(np.abs(chunk))
+        if np.isnan(chunk).any():
+            has_nan = True
+        peak = max(peak, float(chunk_peak))
+        if not loudness:
+            continue
+        for j, (b, a) in enumerate(filters):
+            chunk, states[j] = signal.lfilter(b, a, chunk, zi=states[j])
+        chunk = np.concatenate([carry, chunk])
+        n_sub_blocks = len(chunk) // sub_block_size
+        usable = chunk[: n_sub_blocks * sub_block_size].reshape(n_sub_blocks, sub_block_size)
+        sub_block_energies.append(np.sum(usable**2, axis=1))
+        carry = chunk[n_sub_blocks * sub_block_size :]
+
+    stats = WaveformStats(peak=peak, has_nan=has_nan)
+    if loudness:
+        stats.loudness = _gated_loudness(np.concatenate(sub_block_energies), sub_block_size)
+    return stats
+
+
+def _gated_loudness(sub_block_energies: np.ndarray, sub_block_size: int) -> float:
+    """100ms ごとの二乗和から、ゲート付きのラウドネスを計算する。"""
+    n_blocks = len(sub_block_energies) - LOUDNESS_SUB_BLOCKS + 1
+    if n_blocks <= 0:
+        return float('-inf')
+    # 400ms のブロックごとの平均二乗値
+    cumsum = np.concatenate([[0.0], np.cumsum(sub_block_energies)])
+    block_energies = (cumsum[LOUDNESS_SUB_BLOCKS:] - cumsum[:n_blocks]) / (
+        sub_block_size * LOUDNESS_SUB_BLOCKS
+    )
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10 * np.log10(block_energies)
+    gated = block_energies[block_loudness >= LOUDNESS_ABSOLUTE_GATE]
+    if len(gated) == 0:
+        return float('-inf')
+    relative_gate = -0.691 + 10 * log10(np.mean(gated)) - 10
+    gated = block_energies[
+        (block_loudness > relative_gate) & (block_loudness > LOUDNESS_ABSOLUTE_GATE)
+    ]
+    if len(gated) == 0:
+        return float('-inf')
+    return -0.691 + 10 * log10(np.mean(gated))
+
+
+def estimate_scale(peak: float) -> float:
+    """学習データのビット深度を波形のピークから推定して、float の音量にするための倍率を返す。
+
+    16bitの最大値: 32767
+    32bitの最大値: 2147483647
+
+    >>> estimate_scale(0.9), estimate_scale(20000.0) * 32767, estimate_scale(1e9) * 2147483647
+    (1.0, 1.0, 1.0)
+    """
+    # 学習データのビット深度を推定(8388608=2^24)
+    # int32 -> float
+    if peak > 8388608:
+        return 1 / 2147483647
+    # int16 -> float
+    if peak > 8:
+        return 1 / 32767
+    # float
+    return 1.0
+
+
+def finalize_waveform(
+    wav: np.ndarray,
+    sample_rate: int,
+    peak_norm: bool = False,
+    loudness_norm: bool = False,
+    target_loudness: float = -20,
+    chunk_size: int = CHUNK_SIZE,
+) -> WaveformStats:
+    """波形を1回なめてピークとラウドネスを求め、音量の調整をその場で行う。
+
+    ピーク正規化、ラウドネス正規化、ビット深度に応じた音量調整(float用)をまとめて1回のかけ算にする。
+
+    >>> wav = np.array([0.0, 16000.0, -32000.0], dtype=np.float32)
+    >>> stats = finalize_waveform(wav, 48000)
+    >>> stats.peak, wav.dtype, np.round(wav * 32767).tolist()
+    (32000.0, dtype('float32'), [0.0, 16000.0, -32000.0])
+    """
+    stats = scan_waveform(wav, sample_rate, loudness=loudness_norm, chunk_size=chunk_size)
+    gain = 1.0
+    # Peak normalize audio to 0 dB
+    if peak_norm and stats.peak > 0:
+        gain = 1 / stats.peak
+    # Normalize loudness
+    if loudness_norm and np.isfinite(stats.loudness):
+        gain = 10 ** ((target_loudness - stats.loudness) / 20)
+    gain *= estimate_scale(stats.peak * gain)
+    if gain != 1.0:
+        for i in range(0, len(wav), chunk_size):
+            wav[i : i + chunk_size] *= gain
+    return stats
+
+
+def write_wav(path: str, wav: np.ndarray, sample_rate: int, chunk_size: int = CHUNK_SIZE):
+    """モノラルの波形を32bit floatのWAVファイルに少しずつ書き出す。
+
+    scipy.io.wavfile.write と同じヘッダを書くが、波形全体の複製は作らない。
+
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> from scipy.io import wavfile
+    >>> wav = np.random.default_rng(0).standard_normal(1000).astype(np.float32)
+    >>> with TemporaryDirectory() as d:
+    ...     write_wav(join(d, 'a.wav'), wav, 48000, chunk_size=300)
+    ...     wavfile.write(join(d, 'b.wav'), 48000, wav)
+    ...     with open(join(d, 'a.wav'), 'rb') as fa, open(join(d, 'b.wav'), 'rb') as fb:
+    ...         print(fa.read() == fb.read())
+    True
+    """
+    n_samples = len(wav)
+    data_size = n_samples * 4
+    # format_tag=3 (IEEE float), channels=1, 32bit, cbSize=0
+    fmt_chunk = struct.pack('<HHIIHH', 3, 1, sample_rate, sample_rate * 4, 4, 32) + b'\x00\x00'
+    header = b'WAVE'
+    header += b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk
+    header += b'fact' + struct.pack('<II', 4, n_samples)
+    header += b'data' + struct.pack('<I', data_size)
+    if len(header) + data_size > 0xFFFFFFFF:
+        raise ValueError('WAV file is too large for RIFF format.')
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', len(header) + data_size))
+        f.write(header)
+        for i in range(0, n_samples, chunk_size):
+            np.asarray(wav[i : i + chunk_size]).astype('<f4', copy=False).tofile(f)
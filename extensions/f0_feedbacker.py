@@ -3,60 +3,68 @@
 """
 ENUNUで合成したf0をUTAUのピッチ曲線としてフィードバックする。
 """
+import sys
 from argparse import ArgumentParser
 from math import log2
+from os.path import abspath, dirname
 
 import numpy as np
 import utaupy
 from scipy.signal import argrelmax, argrelmin
 
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.features  # noqa: E402  # pylint: disable=wrong-import-position
+import enulib.render_range  # noqa: E402  # pylint: disable=wrong-import-position
+
 FRAME_PERIOD = 5  # ms
 F0_FLOOR = 32
+# ピッチ点を削減するときの許容誤差[cent]。
+# 0 のときは極値をすべて残す。大きくするほどピッチ点が減るが、元のピッチ線から離れる。
+REDUCTION_TOLERANCE_CENT = 0
 
 
 def load_f0(path_f0, frame_period=FRAME_PERIOD):
     """f0のファイルを読み取って、周波数と時刻(ms)の一覧を返す。
     """
-    with open(path_f0, 'r', encoding='utf-8') as f:
-        freq_list = list(map(float, f.read().splitlines()))
-    time_list = [i*frame_period for i in range(len(freq_list))]
+    freq_list = enulib.features.load_column(path_f0)
+    time_list = np.arange(len(freq_list)) * frame_period
     return freq_list, time_list
 
 
 def distribute_f0(freq_list, time_list, ust):
     """周波数とその時刻の情報をノートごとに分割する。
+
+    各ノートには、ノート内の点に加えて直前のノートの最後の点も重複して含める。
+    f0 が足りないノートには最後の点だけを含める。
+
+    >>> ust = utaupy.ust.Ust()
+    >>> for length in (480, 240, 480):
+    ...     note = utaupy.ust.Note()
+    ...     note.length, note.tempo = length, 120
+    ...     ust.notes.append(note)
+    >>> freq_list, time_list = np.arange(8.0), np.arange(8) * 100
+    >>> distribute_f0(freq_list, time_list, ust)[1]
+    [[0, 100, 200, 300, 400], [400, 500, 600, 700], [700]]
     """
     # 要素数が一致していることを確認しておく。
     assert len(freq_list) == len(time_list)
-    len_f0 = len(freq_list)
+    freq_list = np.asarray(freq_list)
+    time_list = np.asarray(time_list)
+
+    # 各ノートの終了時刻
+    t_note_ends = np.cumsum([note.length_ms for note in ust.notes])
+    # 各ノート内の最後のf0点の次のインデックス
+    ends = np.searchsorted(time_list, t_note_ends, side='left')
+    # 直前のノートの最後の点を重複して含める
+    starts = np.maximum(np.concatenate(([0], ends[:-1] - 1)), 0)
+    # f0が足りないノートや、f0点を含まないほど短いノートにも1点は含める
+    starts = np.minimum(starts, len(freq_list) - 1)
+    ends = np.maximum(ends, starts + 1)
 
-    # ループ時にノートの終了時刻を記憶するための変数
-    t_note_end = 0
-    # ループ時にf0のインデックスを記憶するための変数
-    idx_f0 = 0
     # 各ノートごとに分割されたf0とその時刻を保持するためのリスト。
-    f0_freq_for_each_note = []
-    f0_time_for_each_note = []
-
-    # ノートごとにループする。
-    # 最後のf0点が使用されない可能性があることに注意。
-    for note in ust.notes:
-        t_note_end += note.length_ms
-        temp_f0_freq = []
-        temp_f0_time = []
-        # f0の時刻を前から順番に調べて、ノート内だったら一時リストに追加
-        while time_list[idx_f0] < t_note_end and idx_f0 < len_f0:
-            temp_f0_freq.append(freq_list[idx_f0])
-            temp_f0_time.append(time_list[idx_f0])
-            idx_f0 += 1
-            # 最後の点を処理したらループを抜ける
-            if idx_f0 == len_f0:
-                break
-        # 最後の点を次のノートにも重複して追加するために、インデックスを一つ下げる
-        idx_f0 -= 1
-        # 現在のノートに対するf0とその時刻のリストを、全体のリストに追加
-        f0_freq_for_each_note.append(temp_f0_freq)
-        f0_time_for_each_note.append(temp_f0_time)
+    f0_freq_for_each_note = [freq_list[i:j].tolist() for i, j in zip(starts, ends)]
+    f0_time_for_each_note = [time_list[i:j].tolist() for i, j in zip(starts, ends)]
 
     return f0_freq_for_each_note, f0_time_for_each_note
 
@@ -113,6 +121,44 @@ def reduce_f0_points_for_a_note(f0_list, time_list):
     return l_reduced_f0_freq, l_reduced_f0_time
 
 
+def reduce_f0_points_by_tolerance(cent_list, time_list, tolerance: float):
+    """Ramer-Douglas-Peucker 法でノート内のピッチ点を削減する。
+
+    残した点を直線で結んだときに、元のピッチとの差が tolerance 以下になるようにする。
+    最初と最後の点は必ず残す。
+
+    >>> reduce_f0_points_by_tolerance([0, 1, 2, 3, 10, 3], [0, 5, 10, 15, 20, 25], 2)
+    ([0, 3, 10, 3], [0, 15, 20, 25])
+    """
+    # 点数が一致することを確認しておく
+    assert len(cent_list) == len(time_list)
+    cents = np.asarray(cent_list, dtype=np.float64)
+    times = np.asarray(time_list, dtype=np.float64)
+    keep = np.zeros(len(cents), dtype=bool)
+    keep[[0, -1]] = True
+
+    # 区間の両端を結ぶ直線から一番離れた点が許容誤差を超えていたら、その点で区間を分ける
+    stack = [(0, len(cents) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner_times = times[first + 1 : last]
+        span = times[last] - times[first]
+        slope = (cents[last] - cents[first]) / span if span > 0 else 0
+        line = cents[first] + slope * (inner_times - times[first])
+        errors = np.abs(cents[first + 1 : last] - line)
+        idx_max = int(np.argmax(errors))
+        if errors[idx_max] > tolerance:
+            idx = first + 1 + idx_max
+            keep[idx] = True
+            stack.append((first, idx))
+            stack.append((idx, last))
+
+    indices = np.flatnonzero(keep).tolist()
+    return [cent_list[i] for i in indices], [time_list[i] for i in indices]
+
+
 def notenum2hz(notenum: int, concert_pitch=440) -> float:
     """UTAUの音階番号を周波数に変換する
     """
@@ -168,8 +214,10 @@ def round_pitches(plugin):
         note.pby = [round(x/10) * 10 for x in note.pby]
 
 
-def main(path_f0, path_plugin):
+def main(path_f0, path_plugin, tolerance_cent=REDUCTION_TOLERANCE_CENT):
     """Test
+
+    tolerance_cent が 0 より大きい場合は、許容誤差の範囲でピッチ点を削減する。
     """
     # USTファイルを読み取る
     # path_ust = input('USTファイルを指定してください: ').strip('"')
@@ -188,30 +236,40 @@ def main(path_f0, path_plugin):
     reduced_freq_list_2d = []
     reduced_time_list_2d = []
 
-    # 各ノートのf0点を削減する
+    # 各ノートのf0点を削減して、ノートの音高からの相対音高(PBYの単位)にする
     print('ピッチ点を削減します。')
-    for freq_list_for_a_note, time_list_for_a_note in zip(freq_list_2d, time_list_2d):
-        l_freq, l_time = reduce_f0_points_for_a_note(
-            freq_list_for_a_note, time_list_for_a_note
-        )
-        reduced_freq_list_2d.append(l_freq)
+    for note, freq_list_for_a_note, time_list_for_a_note in zip(
+        ust.notes, freq_list_2d, time_list_2d
+    ):
+        if tolerance_cent > 0:
+            # PBY は 10cent 単位
+            l_pby, l_time = reduce_f0_points_by_tolerance(
+                [hz2cent(freq, note.notenum) for freq in freq_list_for_a_note],
+                time_list_for_a_note,
+                tolerance_cent / 10,
+            )
+        else:
+            l_freq, l_time = reduce_f0_points_for_a_note(
+                freq_list_for_a_note, time_list_for_a_note
+            )
+            l_pby = [hz2cent(freq, note.notenum) for freq in l_freq]
+        reduced_freq_list_2d.append(l_pby)
         reduced_time_list_2d.append(l_time)
 
     # 各ノートのピッチ点を登録する
     assert len(ust.notes) == len(
         reduced_freq_list_2d) == len(reduced_time_list_2d)
     print('各ノートにPBYとPBWとPBMを登録します。')
-    for note, l_freq, l_time in zip(ust.notes, reduced_freq_list_2d, reduced_time_list_2d):
-        notenum = note.notenum
+    for note, l_pby, l_time in zip(ust.notes, reduced_freq_list_2d, reduced_time_list_2d):
         # PBSを仮登録
         note.pbs = [0, 0]
-        # 相対音高(cent)を計算してPBYを登録
-        note.pby = [hz2cent(freq, notenum) for freq in l_freq] + [0]
+        # 相対音高(cent)を登録
+        note.pby = l_pby + [0]
         # 時刻を計算してPBWを登録
         note.pbw = [0] + [t_next - t_now for t_now, t_next
                           in zip(l_time[:-1], l_time[1:])] + [0]
         # 全てS字で登録
-        note.pbm = [''] * (len(l_freq) + 1)
+        note.pbm = [''] * (len(l_pby) + 1)
 
     # PBSを計算して適切に登録しなおす
     print('各ノートにPBYとPBWとPBMを登録します。')
@@ -247,7 +305,19 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--f0', help='f0.csvのパス')
     parser.add_argument('--feedback', help='UTAUにフィードバックするために上書きするtmpファイル')
+    parser.add_argument(
+        '--tolerance_cent',
+        type=float,
+        default=REDUCTION_TOLERANCE_CENT,
+        help='ピッチ点を削減するときの許容誤差[cent]。0で極値をすべて残す。',
+    )
+    parser.add_argument('--state_dir', help='合成ごとの状態保存用フォルダのパス')
     # 使わない引数は無視
     args, _ = parser.parse_known_args()
-    # 実行引数を渡して処理
-    main(args.f0, args.feedback)
+    # 範囲を指定した合成では曲の一部の f0 しかないので、フィードバックしない
+    if enulib.render_range.load_range_info(args.state_dir) is not None:
+        print('範囲を指定した合成なので、f0をフィードバックしません。')
+        print('Skipped: f0 is not fed back when rendering a range.')
+    else:
+        # 実行引数を渡して処理
+        main(args.f0, args.feedback, args.tolerance_cent)
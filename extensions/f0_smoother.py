@@ -3,10 +3,17 @@
 """
 f0の極端に急峻な変化をなめらかにする拡張機能。
 """
+import sys
 from argparse import ArgumentParser
 from copy import copy
-from math import cos, log10, pi
-from pprint import pprint
+from math import cos, pi
+from os.path import abspath, dirname
+
+import numpy as np
+
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.features  # noqa: E402  # pylint: disable=wrong-import-position
 
 SMOOTHEN_WIDTH = 6  # 3から9くらいが良さそう。
 DETECT_THRESHOLD = 0.6
@@ -16,14 +23,16 @@ IGNORE_THRESHOLD = 0.01
 def repair_sudden_zero_f0(f0_list):
     """
     前後がどちらもf0=0ではないのに、急に出現したf0=0な点を修正する。
-    >>> repair_sudden_zero_f0([1, 2, 3, 0, 5, 6])
-    [1, 2, 3, 4, 5, 6]
+    >>> repair_sudden_zero_f0([1, 2, 3, 0, 5, 6]).tolist()
+    [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
     """
-    newf0_list = copy(f0_list)
-    for i, f0 in enumerate(f0_list[1:-2], 1):
-        if all((f0 == 0, f0_list[i-1] != 0, f0_list[i+1] != 0)):
-            newf0_list[i] = (f0_list[i-1] + f0_list[i+1]) / 2
-    return newf0_list
+    f0_array = np.asarray(f0_list, dtype=np.float64)
+    newf0_array = f0_array.copy()
+    # f0_list[1:-2] の範囲の点を、修正前の前後の値で判定する
+    prev_f0, f0, next_f0 = f0_array[:-3], f0_array[1:-2], f0_array[2:-1]
+    mask = (f0 == 0) & (prev_f0 != 0) & (next_f0 != 0)
+    newf0_array[1:-2][mask] = (prev_f0[mask] + next_f0[mask]) / 2
+    return newf0_array
 
 
 def repair_jaggy_f0(f0_list, ignore_threshold):
@@ -71,27 +80,28 @@ def get_rapid_f0_change_indices(f0_list: list, detect_threshold: list, ignore_th
     """急峻なf0変化を検出する。
 
     1区間での変化量が前後を含めた3区間の変化量の半分を上回る場合、急峻な変化とみなす。
+
+    >>> get_rapid_f0_change_indices([1, 1, 1, 2, 2, 2, 0, 3, 3, 4, 5], 0.6, 0.01).tolist()
+    [2]
     """
-    indices = []
-    # f0のリスト内ループ
-    for i, _ in enumerate(f0_list[1:-2], 1):
+    f0_array = np.asarray(f0_list, dtype=np.float64)
+    # i-1, i, i+1, i+2 番目の点 (i = 1, ..., N-3)
+    f0_a, f0_b, f0_c, f0_d = f0_array[:-3], f0_array[1:-2], f0_array[2:-1], f0_array[3:]
+    # 1区間の音程変化
+    delta_1 = f0_c - f0_b
+    # 3区間の音程変化
+    delta_3 = f0_d - f0_a
+    mask = (
         # 計算する区間の両端のf0が無効なときはスキップ
-        if any((f0_list[i-1] == 0, f0_list[i] == 0, f0_list[i+1] == 0, f0_list[i+2] == 0)):
-            continue
-        # 1区間の音程変化
-        delta_1 = f0_list[i+1] - f0_list[i]
-        # 3区間の音程変化
-        delta_3 = f0_list[i+2] - f0_list[i-1]
+        (f0_a != 0) & (f0_b != 0) & (f0_c != 0) & (f0_d != 0)
         # ゼロ除算しそうなときはスキップ
-        if delta_3 == 0:
-            continue
+        & (delta_3 != 0)
         # f0変化が小さいときに誤判定しないようにスキップ
-        if abs(delta_1) < ignore_threshold:
-            continue
-        # 一定以上の急峻さで検出
-        if delta_1 / delta_3 > detect_threshold:
-            indices.append(i)
-    return indices
+        & (np.abs(delta_1) >= ignore_threshold)
+    )
+    # 一定以上の急峻さで検出
+    ratio = np.divide(delta_1, delta_3, out=np.zeros_like(delta_1), where=mask)
+    return np.flatnonzero(mask & (ratio > detect_threshold)) + 1
 
     # def get_rapid_f0_change_indices(f0_list: list, detect_threshold: list, ignore_threshold, width=SMOOTHEN_WIDTH):
     #     """急峻なf0変化を検出する。
@@ -175,35 +185,37 @@ def get_adjusted_widths(f0_list: list, rapid_f0_change_indices: list, default_wi
 
     返すリストは 0 以上の整数からなるリストで、
     0の時は補正を行わないことになるのでスキップしていいと思う。
+
+    >>> get_adjusted_widths([1, 1, 1, 1, 1, 1, 1, 0, 1], [1, 3, 4, 6], 6).tolist()
+    [1, 2, 1, 0]
+    >>> get_adjusted_widths([1, 1, 1, 1, 1, 1, 1, 1, 1], [6], 6).tolist()
+    [1]
     """
     # 万が一負の値が入ったていたら止める
     assert default_width >= 0
 
-    # 結果を格納するリスト
-    adjusted_widths = []
-    len_f0_list = len(f0_list)
-
-    # 指定されたf0の点の周辺を順に調べる
-    for f0_idx in rapid_f0_change_indices:
-        # 急峻な変化をする2点の前後を近い順に調査
-        width = default_width
-        # そもそも両端がIndexErrorになってしまうのを回避する必要がある。
-        # f0の長さが足りない場合は補正幅を狭める。
-        while (f0_idx - width) < 0 or (f0_idx + width + 1) > len_f0_list:
-            width -= 1
-        # 両端のf0が0な場合は、平滑化の幅を狭める。
-        # ただし、wが負になって右側と左側のf0の位置が逆転する前にループを止める。
-        # while width > 0 and (f0_list[f0_idx - width] == 0 or f0_list[f0_idx + width + 1] == 0):
-        while width > 0 and (0 in f0_list[f0_idx - width: f0_idx + width + 2]):
-            width -= 1
-        # 調整後の値をリストに追加
-        adjusted_widths.append(width)
+    f0_array = np.asarray(f0_list)
+    indices = np.asarray(rapid_f0_change_indices, dtype=np.int64)
+    len_f0_list = len(f0_array)
+    # f0の長さが足りない場合は補正幅を狭める。(右端の f0_idx + width + 1 も範囲内にする)
+    widths = np.minimum(default_width, np.minimum(indices, len_f0_list - indices - 2))
+    # f0=0 の点の累積数。区間内に0があるかを引き算で調べる。
+    zero_counts = np.concatenate(([0], np.cumsum(f0_array == 0)))
+    # 区間 [f0_idx - width, f0_idx + width + 1] に0が含まれる場合は、平滑化の幅を狭める。
+    # ただし、wが負になって右側と左側のf0の位置が逆転する前にやめる。
+    for _ in range(default_width):
+        stop = np.minimum(indices + widths + 2, len_f0_list)
+        has_zero = zero_counts[stop] - zero_counts[indices - widths] > 0
+        narrow = (widths > 0) & has_zero
+        if not narrow.any():
+            break
+        widths[narrow] -= 1
 
     # 一応長さ確認
-    assert len(adjusted_widths) == len(rapid_f0_change_indices)
+    assert len(widths) == len(indices)
 
-    # 調整した幅の一覧をリストにして返す
-    return adjusted_widths
+    # 調整した幅の一覧を返す
+    return widths
 
 
 def get_target_f0_list(f0_list: list, rapid_f0_change_indices: list, adjusted_widths: list):
@@ -215,39 +227,42 @@ def get_target_f0_list(f0_list: list, rapid_f0_change_indices: list, adjusted_wi
     # 念のため
     assert len(rapid_f0_change_indices) == len(adjusted_widths)
 
-    # 補正の基準にするf0の値
-    target_f0_list = []
-
-    # 急峻な変化がある場所について、前から順に平均値を計算していく。
-    for f0_idx, width in zip(rapid_f0_change_indices, adjusted_widths):
-        f0_left = f0_list[f0_idx - width]
-        f0_right = f0_list[f0_idx + width + 1]
-        target_f0 = (f0_left + f0_right) / 2
-        target_f0_list.append(target_f0)
+    f0_array = np.asarray(f0_list, dtype=np.float64)
+    indices = np.asarray(rapid_f0_change_indices, dtype=np.int64)
+    widths = np.asarray(adjusted_widths, dtype=np.int64)
+    # 急峻な変化がある場所について、平均値をまとめて計算する。
+    return (f0_array[indices - widths] + f0_array[indices + widths + 1]) / 2
 
-    # こんな感じのリストを返す → [(f0_idx, width), ...]
-    return target_f0_list
 
+def get_blend_weight_tables(max_width: int) -> list:
+    """補正幅ごとに、元の値をどのくらい使うかの重みの表を作る。
 
-def get_smoothened_f0_list(f0_list, width, detect_threshold, ignore_threshold):
-    """修正すべき区間と、修正の基準として使う値を返す。
-    [(idx, target_f0), ...]
+    table[width][i] は、中心から i 番目の点で元の値を使う割合。
 
+    >>> [round(w, 3) for w in get_blend_weight_tables(2)[2]]
+    [0.309, 0.809]
     """
+    return [
+        np.array([cos(pi * ((width - i) / (2 * width + 1))) for i in range(width)])
+        for width in range(max_width + 1)
+    ]
+
+
+def get_smoothened_f0_list(f0_list, width, detect_threshold, ignore_threshold):
+    """急峻なf0変化を検出して、その周辺を基準値に寄せてなめらかにしたf0を返す。"""
     # もとのf0を残すために複製して使う。
-    f0_list = copy(f0_list)
+    f0_array = np.array(f0_list, dtype=np.float64)
 
     # 補正したほうがいい場所を検出する。
     rapid_f0_change_indices = get_rapid_f0_change_indices(
-        f0_list,
+        f0_array,
         detect_threshold,
         ignore_threshold
     )
-    # rapid_f0_change_indices = reduce_indices(rapid_f0_change_indices)
 
     # 不具合が起きないように補正幅を調整
     adjusted_widths = get_adjusted_widths(
-        f0_list,
+        f0_array,
         rapid_f0_change_indices,
         width
     )
@@ -256,41 +271,42 @@ def get_smoothened_f0_list(f0_list, width, detect_threshold, ignore_threshold):
     # 該当箇所の9区間の最初と最後の平均 (元の長さ: N-9, 追加後長さ: N-1)
     # ・-・-・-・-・=・-・-・-・-・
     target_f0_list = get_target_f0_list(
-        f0_list,
+        f0_array,
         rapid_f0_change_indices,
         adjusted_widths
     )
     assert len(rapid_f0_change_indices) == len(target_f0_list)
 
-    # 動作内容確認用に出力
-    # pprint(list(zip(rapid_f0_change_indices, adjusted_widths, target_f0_list)))
-
-    # 検出済みの場所と、その周辺に適用するターゲット値の組でループする
-    for (f0_idx, width, target_f0) in zip(rapid_f0_change_indices, adjusted_widths, target_f0_list):
-        # 調整不要(不可能)な場合はスキップ
-        if width <= 0:
-            continue
-        # 修正必要なf0点の前後数点を、近くから順に補正する。
-        for i in range(width):
-            # 元の値をどのくらい使うか
-            ratio_of_original_f0 = cos(
-                pi * ((width - i) / (2 * width + 1)))
-            # ターゲット値にどのくらい寄せるか
-            ratio_of_target_f0 = 1 - ratio_of_original_f0
-            # 過去側のf0の点を補正する
-            f0_list[f0_idx - i] = (
-                ratio_of_target_f0 * target_f0 +
-                ratio_of_original_f0 * f0_list[f0_idx - i]
-            )
-            # 未来側のf0の点を補正する
-            f0_list[f0_idx + i + 1] = (
-                ratio_of_target_f0 * target_f0 +
-                ratio_of_original_f0 * f0_list[f0_idx + i + 1]
-            )
+    # 補正する全ての点について (f0の位置, 元の値を使う割合, ターゲット値) を並べる。
+    # 過去側は f0_idx - i 、未来側は f0_idx + i + 1 の点を補正する。
+    tables = get_blend_weight_tables(width)
+    widths = adjusted_widths[adjusted_widths > 0]
+    centers = np.repeat(rapid_f0_change_indices[adjusted_widths > 0], widths)
+    offsets = np.concatenate([np.arange(w) for w in widths] or [np.zeros(0, dtype=np.int64)])
+    ratios = np.concatenate([tables[w] for w in widths] or [np.zeros(0)])
+    targets = np.repeat(target_f0_list[adjusted_widths > 0], widths)
+    positions = np.concatenate([centers - offsets, centers + offsets + 1])
+    ratios = np.concatenate([ratios, ratios])
+    targets = np.concatenate([targets, targets])
+    # 検出箇所の順番
+    order = np.concatenate([np.repeat(np.arange(len(widths)), widths)] * 2)
+
+    # 同じ点が複数回補正される場合は、検出箇所の順番どおりに重ねて補正する。
+    # 点ごとに何回目の補正かを数えて、1回目の補正、2回目の補正…とまとめて適用する。
+    sort_idx = np.lexsort((order, positions))
+    positions, ratios, targets = positions[sort_idx], ratios[sort_idx], targets[sort_idx]
+    group_starts = np.flatnonzero(np.concatenate(([True], positions[1:] != positions[:-1])))
+    group_sizes = np.diff(np.append(group_starts, len(positions)))
+    ranks = np.arange(len(positions)) - np.repeat(group_starts, group_sizes)
+    for rank in range(int(ranks.max(initial=-1)) + 1):
+        mask = ranks == rank
+        pos, ratio_of_original_f0 = positions[mask], ratios[mask]
+        # ターゲット値にどのくらい寄せるか
+        ratio_of_target_f0 = 1 - ratio_of_original_f0
+        f0_array[pos] = ratio_of_target_f0 * targets[mask] + ratio_of_original_f0 * f0_array[pos]
 
     print(f'Smoothed {len(rapid_f0_change_indices)} points')
-    # [(idx, target_f0), ...] の形にして返す
-    return f0_list
+    return f0_array
 
 
 def main():
@@ -313,12 +329,11 @@ def main():
         path_out = path_in
 
     # f0のファイルを読み取る
-    with open(path_in, 'r', encoding='utf-8') as f:
-        f0_list = list(map(float, f.read().splitlines()))
+    f0_list = enulib.features.load_column(path_in)
 
     # 底を10とした対数に変換する (長さ: N)
     # f0が負や0だと対数変換できないのを回避しつつ、log(f0)>0 となるようにする。
-    log_f0_list = [log10(max(f0, 1)) for f0 in f0_list]
+    log_f0_list = np.log10(np.maximum(f0_list, 1))
 
     # 突発的な0Hzを直す。
     print('Repairing unnaturally sudden 0Hz in f0')
@@ -338,21 +353,11 @@ def main():
     )
 
     # log(f0) でエラーが出ないためにf0=1Hzにしてあるのを0Hzに戻す。
-    new_f0_list = []
-    for log_f0 in new_log_f0_list:
-        # log10(f0)=0 のときに f0=1Hz ではなく 0Hz にする。
-        if log_f0 == 0:
-            f0 = 0
-        else:
-            f0 = 10 ** log_f0
-        new_f0_list.append(f0)
-
-    # 文字列にする
-    s = '\n'.join(list(map(str, new_f0_list)))
+    # log10(f0)=0 のときに f0=1Hz ではなく 0Hz にする。
+    new_f0_list = np.where(new_log_f0_list == 0, 0, 10 ** new_log_f0_list)
 
-    # 出力
-    with open(path_out, 'w', encoding='utf-8') as f:
-        f.write(s)
+    # 出力 (0Hz は 0 と書く)
+    enulib.features.save_column(path_out, new_f0_list)
 
 
 if __name__ == "__main__":
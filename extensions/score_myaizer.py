@@ -2,11 +2,18 @@
 # Copyright (c) 2024 oatsu
 """
 LAB (score) の全部の歌詞を my a にする。
+
+config.yaml の score_editor に置換表 {rewrite: {vowel: a, default: my}} を書けば、
+このスクリプトを呼び出さずに同じ処理ができる。(enulib.score_rewriter)
 """
 
+import sys
 from argparse import ArgumentParser
+from os.path import abspath, dirname
 
-import utaupy
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.score_rewriter  # noqa: E402  # pylint: disable=wrong-import-position
 
 
 def main():
@@ -17,24 +24,10 @@ def main():
     # 使わない引数は無視して、必要な情報だけ取り出す。
     args, _ = parser.parse_known_args()
     path_full_score = args.full_score
-    # ustファイルを読み取る
-    full_score = utaupy.hts.load(path_full_score)
 
-    # 表情音源のプレフィックス・サフィックスをvoicecolorの文字列として抽出する
     print('[pau] と [N] はそのままにします。母音は [a] にします。それ以外は [my] にします。')
-    song = full_score.song
-    phonemes = song.all_phonemes
-    for phoneme in phonemes:
-        if phoneme.is_rest():
-            continue
-        if phoneme.identity == 'N':
-            continue
-        if phoneme.is_vowel():
-            phoneme.identity = 'a'
-            continue
-        phoneme.identity = 'my'
     # LABファイルを上書き
-    song.write(path_full_score)
+    enulib.score_rewriter.rewrite_file(path_full_score, [enulib.score_rewriter.MYAIZE_RULE])
     print('[pau] と [N] はそのままにしました。母音は [a] にしました。それ以外は [my] にしました。')
 
 
@@ -8,21 +8,37 @@ UST読み込んで加工する際に、各ノートに独自エントリを書
 USTにの [#SETTING] にすでに独自エントリがある場合はf0ファイルを編集する。
 """
 import re
+import sys
 from argparse import ArgumentParser
 from copy import copy
-from math import log2
-from pprint import pprint
+from os.path import abspath, dirname, exists, join
 
+import numpy as np
 import utaupy
 
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.features  # noqa: E402  # pylint: disable=wrong-import-position
+import enulib.render_range  # noqa: E402  # pylint: disable=wrong-import-position
+import enulib.timing  # noqa: E402  # pylint: disable=wrong-import-position
+
 STYLE_SHIFT_FLAG_PATTERN = re.compile(r'S(\d+|\+\d+|-\d+)')
+STYLE_SHIFT_KEY = '$EnunuStyleShift'
+# 合成ごとの状態保存用フォルダに置く、ノートごとのスタイルシフト量のファイル
+STATE_FILE_NAME = 'style_shift.txt'
+# 区間分割合成のときに、処理済みのf0のフレーム数を記録するファイル
+OFFSET_FILE_NAME = 'f0_offset.txt'
+# f0 のフレーム周期[ms] (引数で指定されない場合)
+FRAME_PERIOD = 5
+# HTSラベルの時刻の単位[ms]
+HTS_TIME_UNIT_MS = 1e-4
 
 
 def shift_ust_notes(ust) -> utaupy.ust.Ust:
     """フラグに基づいてUST内のノート番号をずらし、その分を独自エントリに追加する。
     """
     ust = copy(ust)
-    key = '$EnunuStyleShift'
+    key = STYLE_SHIFT_KEY
     ust.setting[key] = True
     for note in ust.notes:
         # フラグ内のスタイルシフトのパラメータを取得する
@@ -43,50 +59,89 @@ def shift_ust_notes(ust) -> utaupy.ust.Ust:
     return ust
 
 
-def shift_f0(ust, full_timing, f0_list: list) -> list:
-    """f0をいい感じに編集する
+def export_style_shifts(ust, path_state) -> utaupy.ust.Ust:
+    """shift_ust_notes でUSTに書き込んだスタイルシフト量を状態保存用のファイルに移す。
+
+    USTには独自エントリを残さないので、USTで動作モードを判別する必要がなくなる。
     """
-    ust_notes = ust.notes
-    hts_notes = full_timing.song.all_notes
-    # ノート数が一致することを確認しておく
-    if len(ust_notes) != len(hts_notes):
-        raise ValueError(
-            f'USTのノート数({len(ust_notes)}) と フルラベルのノート数({len(hts_notes)}) が一致していません。')
+    ust.setting.pop(STYLE_SHIFT_KEY, None)
+    style_shift_list = [int(note.pop(STYLE_SHIFT_KEY, 0)) for note in ust.notes]
+    with open(path_state, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(map(str, style_shift_list)))
+    return ust
+
 
-    # 各ノートのf0開始スライスと終了スライス
-    f0_point_slices = [
-        (round(note.start / 50000), round(note.end / 50000)) for note in hts_notes]
+def load_style_shifts(path_state) -> list:
+    """状態保存用のファイルからノートごとのスタイルシフト量を読み取る。"""
+    with open(path_state, 'r', encoding='utf-8') as f:
+        return [int(line) for line in f.read().splitlines() if line.strip()]
 
-    # スタイルシフトの量をUSTのノートから取り出してリストにする
-    style_shift_list = [
-        int(note.get('$EnunuStyleShift', 0)) for note in ust_notes]
 
+def get_frame_shifts(
+    note_starts, note_ends, style_shift_list, n_frames, frame_period=FRAME_PERIOD, frame_offset=0
+):
+    """ノートごとのスタイルシフト量を、f0 のフレームごとの配列にする。
+
+    frame_offset は曲全体の中での f0 の先頭フレームの位置。(区間分割合成用)
+    ノートの外側のフレームのシフト量は 0 にする。
+
+    >>> get_frame_shifts([100000, 200000], [200000, 250000], [2, -1], 6).tolist()
+    [0.0, 0.0, 2.0, 2.0, -1.0, 0.0]
+    >>> get_frame_shifts([100000, 200000], [200000, 250000], [2, -1], 3, frame_offset=2).tolist()
+    [2.0, 2.0, -1.0]
+
+    タイミングの推定でノートの開始時刻が前のノートより前になっている場合は、前のノートと重なる部分を
+    前のノートのシフト量にする。(timing_repairer を使わない場合)
+    >>> get_frame_shifts(
+    ...     [100000, 300000, 250000], [300000, 250000, 350000], [2, -1, 3], 8
+    ... ).tolist()
+    [0.0, 0.0, 2.0, 2.0, 2.0, 2.0, 3.0, 0.0]
+    """
+    # ノートの境界のフレーム位置
+    frame_shift_100ns = frame_period / HTS_TIME_UNIT_MS
+    bounds = np.round(np.append(note_starts, note_ends[-1]) / frame_shift_100ns).astype(int)
+    # 開始時刻が前のノートより前になっているノートは、前のノートの開始時刻より前に始まらないことにする
+    bounds = np.maximum.accumulate(bounds)
+    # 最初のノートの前は 0 にして、各ノートのシフト量をそのフレーム数だけ繰り返す
+    frame_shifts = np.concatenate(
+        (np.zeros(bounds[0]), np.repeat(np.asarray(style_shift_list, float), np.diff(bounds)))
+    )
+    frame_shifts = frame_shifts[frame_offset : frame_offset + n_frames]
+    # 最後のノートより後ろのフレームも 0 にする
+    return np.pad(frame_shifts, (0, n_frames - len(frame_shifts)))
+
+
+def shift_f0(f0_list, frame_shifts):
+    """フレームごとのスタイルシフト量の分だけf0をずらす。
+
+    シフト量が正のときはUSTの音高を上げてあるので、f0はその分下げて元の高さに戻す。
+
+    >>> shift_f0([0, 440, 440], [12, 12, -12]).round(6).tolist()
+    [0.0, 220.0, 880.0]
+    """
+    f0 = np.asarray(f0_list, dtype=np.float64)
     # 計算しやすいように対数に変換
-    log2_f0_list = [log2(hz) if hz > 0 else 0 for hz in f0_list]
-
-    # f0のリストをノートごとに区切って2次元にする
-    log2_f0_list_2d = [
-        log2_f0_list[slice_start: slice_end] for (slice_start, slice_end) in f0_point_slices
-    ]
-
-    # ノート区切りごとにf0を調製して、新しいf0のリストを作る
-    # このとき一番最初の開始時刻が0出ない時にf0点数が合わなくなるのを回避する。
-    offset = round(hts_notes[0].start / 50000)
-    new_log2_f0_list = log2_f0_list[0:offset]
-    for f0_list_for_note, shift_amount in zip(log2_f0_list_2d, style_shift_list):
-        delta_log2_f0 = shift_amount / (-12)
-        new_log2_f0_list += [f0 + delta_log2_f0 if f0 >
-                             0 else 0 for f0 in f0_list_for_note]
-    # 書き換えたやつ対数から元に戻す
-    new_f0_list = [
-        (2 ** log2_f0 if log2_f0 > 0 else 0) for log2_f0 in new_log2_f0_list]
-    return new_f0_list
+    log2_f0 = np.log2(np.where(f0 > 0, f0, 1))
+    new_log2_f0 = log2_f0 - np.asarray(frame_shifts) / 12
+    # 無声部分と 1Hz 以下になった部分は 0 にして、対数から元に戻す
+    return np.where((log2_f0 > 0) & (new_log2_f0 > 0), 2**new_log2_f0, 0)
+
+
+def load_frame_offset(path_offset, default: int = 0) -> int:
+    """区間分割合成のときに、これまでに処理したf0のフレーム数を読み取る。
+
+    まだ処理していない場合は default (最初に合成する区間の先頭フレームの位置) を返す。
+    """
+    if path_offset is None or not exists(path_offset):
+        return default
+    with open(path_offset, 'r', encoding='utf-8') as f:
+        return int(f.read().strip())
 
 
 def switch_mode(ust) -> str:
     """どのタイミングで起動されたかを、USTから調べて動作モードを切り替える。
     """
-    if '$EnunuStyleShift' in ust.setting:
+    if STYLE_SHIFT_KEY in ust.setting:
         return 'f0_editor'
     return 'ust_editor'
 
@@ -96,6 +151,8 @@ def main():
     parser.add_argument('--ust', help='選択部分のノートのUSTファイルのパス')
     parser.add_argument('--f0', help='f0の情報を持ったCSVファイルのパス')
     parser.add_argument('--full_timing', help='タイミング推定済みのフルラベルファイルのパス')
+    parser.add_argument('--state_dir', help='合成ごとの状態保存用フォルダのパス')
+    parser.add_argument('--frame_period', type=float, default=FRAME_PERIOD, help='f0のフレーム周期[ms]')
 
     # 使わない引数は無視して、必要な情報だけ取り出す。
     args, _ = parser.parse_known_args()
@@ -104,12 +161,20 @@ def main():
     ust = utaupy.ust.load(path_ust)
 
     # ust_editor として起動されたか、acoustic_editor として起動されたかを取得して動作切り替える
-    mode = switch_mode(ust)
+    # 状態保存用フォルダが指定されている場合は、USTではなくそのフォルダの中身で判別する。
+    path_state = None
+    if args.state_dir is not None:
+        path_state = join(args.state_dir, STATE_FILE_NAME)
+        mode = 'f0_editor' if exists(path_state) else 'ust_editor'
+    else:
+        mode = switch_mode(ust)
 
     # ust編集のステップで実行された場合、ustの音高操作などをする。
     if mode == 'ust_editor':
         print('USTの音高を加工します。/ Shifting notes in UST.')
         ust = shift_ust_notes(ust)
+        if path_state is not None:
+            ust = export_style_shifts(ust, path_state)
         ust.write(path_ust)
         print('USTの音高を加工しました。/ Shifted notes in UST.')
 
@@ -118,16 +183,38 @@ def main():
         print('f0を加工します。/ Shifting f0.')
         # f0のファイルを読み取る
         path_f0 = args.f0
-        with open(path_f0, 'r', encoding='utf-8') as f:
-            f0_list = list(map(float, f.read().splitlines()))
-        # フルラベルファイルを読み取る
-        full_timing = utaupy.hts.load(args.full_timing)
+        f0_list = enulib.features.load_column(path_f0)
+        # フルラベルファイルからノートの時刻だけを読み取る
+        note_starts, note_ends = enulib.timing.load_note_times(args.full_timing)
+        # スタイルシフト量を読み取る
+        if path_state is not None:
+            style_shift_list = load_style_shifts(path_state)
+        else:
+            style_shift_list = [int(note.get(STYLE_SHIFT_KEY, 0)) for note in ust.notes]
+        # 範囲を指定して合成している場合は、フルラベルは範囲のノートだけになっている
+        range_info = enulib.render_range.load_range_info(args.state_dir)
+        if range_info is not None:
+            note_offset = range_info['note_offset']
+            style_shift_list = style_shift_list[note_offset : note_offset + range_info['n_notes']]
+        # ノート数が一致することを確認しておく
+        if len(style_shift_list) != len(note_starts):
+            raise ValueError(
+                f'USTのノート数({len(style_shift_list)}) と フルラベルのノート数({len(note_starts)}) が一致していません。')
+        # 区間分割合成のときは、処理済みのフレーム数の分だけずらして適用する
+        # 範囲を指定して合成している場合は、最初に合成する区間の位置から数える
+        path_offset = None if args.state_dir is None else join(args.state_dir, OFFSET_FILE_NAME)
+        frame_offset = load_frame_offset(
+            path_offset, enulib.render_range.first_f0_frame(range_info, args.frame_period)
+        )
         # f0を編集する
-        new_f0_list = shift_f0(ust, full_timing, f0_list)
-        new_f0_list = list(map(str, new_f0_list))
-        s_f0 = '\n'.join(new_f0_list) + '\n'
-        with open(path_f0, 'w', encoding='utf-8') as f:
-            f.write(s_f0)
+        frame_shifts = get_frame_shifts(
+            note_starts, note_ends, style_shift_list, len(f0_list), args.frame_period, frame_offset
+        )
+        new_f0_list = shift_f0(f0_list, frame_shifts)
+        enulib.features.save_column(path_f0, new_f0_list, end='\n')
+        if path_offset is not None:
+            with open(path_offset, 'w', encoding='utf-8') as f:
+                f.write(str(frame_offset + len(f0_list)))
         print('f0を加工しました。/ Shifted f0.')
 
     # それ以外
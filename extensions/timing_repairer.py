@@ -4,20 +4,19 @@
 発声開始時刻が逆転してエラーになるのを修復する。
 """
 
+import sys
 from argparse import ArgumentParser
+from os.path import abspath, dirname
 
-import utaupy
-from tqdm import tqdm
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.timing  # noqa: E402  # pylint: disable=wrong-import-position
 
 
 def repair_label(path_label, time_unit=50000):
     """発声開始時刻が直前のノートの発声開始時刻より早くなっている音素を直す。"""
-    label = utaupy.label.load(path_label)
-    previous_start = label[0].start
-    for phoneme in tqdm(label):
-        current_start = phoneme.start
-        phoneme.start = max(previous_start + time_unit, current_start)
-        previous_start = current_start
+    label = enulib.timing.load(path_label)
+    label = enulib.timing.repair_start_times(label, time_unit)
     label.write(path_label)
 
 
@@ -27,8 +26,15 @@ if __name__ == '__main__':
     parser.add_argument(
         '--mono_timing', help='発声タイミングの情報を持ったHTSフルラベルファイルのパス'
     )
+    parser.add_argument(
+        '--full_timing', help='発声タイミングの情報を持ったHTSフルラベルファイルのパス'
+    )
     # 使わない引数は無視
     args, _ = parser.parse_known_args()
     # 実行引数を渡して処理
-    repair_label(path_label=args.mono_timing)
+    # フルラベルがある場合は、フルラベルとモノラベルをまとめて直す。
+    if args.full_timing is not None:
+        enulib.timing.timing_pass(args.full_timing, args.mono_timing, repair=True)
+    else:
+        repair_label(path_label=args.mono_timing)
     print('-------------------------------------------------------')
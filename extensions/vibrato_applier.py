@@ -36,14 +36,28 @@ VBR=65,180,35,20,20,0,0
 
 """
 
+import json
 import math
+import sys
 from argparse import ArgumentParser
-from os.path import dirname, join
+from os.path import abspath, dirname, exists, join
 
+import numpy as np
 import utaupy  # utaupy>=1.21.0 is required
 from utaupy.ust import Ust
 
+# SimpleEnunu の enulib を使う
+sys.path.append(dirname(dirname(abspath(__file__))))
+import enulib.features  # noqa: E402  # pylint: disable=wrong-import-position
+import enulib.render_range  # noqa: E402  # pylint: disable=wrong-import-position
+
 MODE_SWITCH_KEY = '$EnunuVibratoApplier'
+# 合成ごとの状態保存用フォルダに置く、ビブラートのパラメータのファイル
+STATE_FILE_NAME = 'vibrato_params.json'
+# 区間分割合成のときに、処理済みのf0のフレーム数を記録するファイル
+OFFSET_FILE_NAME = 'f0_offset.txt'
+# f0 のフレーム周期[ms] (引数で指定されない場合)
+FRAME_PERIOD = 5
 
 
 def get_vibrato_start_times(ust: Ust):
@@ -68,83 +82,169 @@ def get_vibrato_start_times(ust: Ust):
     return l
 
 
-def get_vibrato_shapes(ust: Ust):
+def get_vibrato_params(ust: Ust) -> list:
     """
-    USTを読み取ってビブラートの形状を計算する。
+    USTを読み取って、ビブラートごとのパラメータを ms と cent の単位で計算する。
+    f0 のフレーム周期によらないので、ust_editor の段階で計算して acoustic_editor の段階に渡せる。
     """
-    vibrato_shapes = []
-    for note in ust.notes:
-        if note.vibrato is None:
-            continue
+    vibrato_start_times = get_vibrato_start_times(ust)
+    vibrato_notes = [note for note in ust.notes if note.vibrato is not None]
+    vibrato_params = []
+    for note, vibrato_start_time in zip(vibrato_notes, vibrato_start_times):
         # 長さ[ms]
         vibrato_duration = note.vibrato[0] / 100 * note.length_ms
         # 周期[ms]
         vibrato_period = note.vibrato[1]
-        # 深さ[cent]
-        vibrato_depth = note.vibrato[2]
-        # 位相[ms]
-        vibrato_phase = note.vibrato[5] / 100 * vibrato_period
-        # フェードイン[ms]
-        vibrato_fade_in = note.vibrato[3] / 100 * vibrato_duration
-        # フェードアウト[ms]
-        vibrato_fade_out = note.vibrato[4] / 100 * vibrato_duration
-
-        # ビブラートの形状を計算
-        shape = []
-        # 1ms ごとに形状を計算する
-        for t in range(int(vibrato_duration)):
-            # 位相を考慮した正弦波の計算
-            phase_adjusted_time = (t + vibrato_phase) % vibrato_period
-            vibrato_value = vibrato_depth * \
-                math.sin((2 * math.pi) * (phase_adjusted_time / vibrato_period))
-            # フェードインの処理
-            if t <= vibrato_fade_in:
-                vibrato_value *= t / vibrato_fade_in
-            # フェードアウトの処理
-            elif t >= vibrato_duration - vibrato_fade_out:
-                vibrato_value *= (vibrato_duration - t) / vibrato_fade_out
-            # 登録
-            shape.append(vibrato_value)
+        vibrato_params.append(
+            {
+                'start': vibrato_start_time,
+                'duration': vibrato_duration,
+                'period': vibrato_period,
+                # 深さ[cent]
+                'depth': note.vibrato[2],
+                # 位相[ms]
+                'phase': note.vibrato[5] / 100 * vibrato_period,
+                # フェードイン[ms]
+                'fade_in': note.vibrato[3] / 100 * vibrato_duration,
+                # フェードアウト[ms]
+                'fade_out': note.vibrato[4] / 100 * vibrato_duration,
+            }
+        )
+    return vibrato_params
+
+
+def vibrato_frame_span(params: dict, f0_time_unit_ms: float = FRAME_PERIOD) -> tuple:
+    """ビブラート区間に含まれる f0 のフレームを (最初のフレーム, 最後のフレーム + 1) で返す。"""
+    first_frame = math.ceil(params['start'] / f0_time_unit_ms)
+    last_time = params['start'] + int(params['duration'])
+    return first_frame, math.ceil(last_time / f0_time_unit_ms)
+
+
+def params_to_shapes(vibrato_params: list, f0_time_unit_ms: float = FRAME_PERIOD) -> list:
+    """
+    ビブラートのパラメータから、f0 のフレームの時刻(f0_time_unit_ms の倍数[ms])での形状を計算して、
+    (開始フレーム, 形状) のリストを返す。
+    """
+    vibrato_shapes = []
+    for params in vibrato_params:
+        vibrato_start_time = params['start']
+        vibrato_duration = params['duration']
+        vibrato_period = params['period']
+        vibrato_fade_in = params['fade_in']
+        vibrato_fade_out = params['fade_out']
+
+        # ビブラート区間に含まれる f0 のフレーム
+        first_frame, end_frame = vibrato_frame_span(params, f0_time_unit_ms)
+        frames = np.arange(first_frame, end_frame)
+        # ビブラート開始からの経過時間[ms]
+        t = frames * f0_time_unit_ms - vibrato_start_time
+
+        # 位相を考慮した正弦波の計算
+        phase_adjusted_time = (t + params['phase']) % vibrato_period
+        shape = params['depth'] * np.sin((2 * np.pi) * (phase_adjusted_time / vibrato_period))
+        # フェードインの処理
+        fade_in = t <= vibrato_fade_in
+        if vibrato_fade_in > 0:
+            shape[fade_in] *= t[fade_in] / vibrato_fade_in
+        # フェードアウトの処理
+        fade_out = ~fade_in & (t >= vibrato_duration - vibrato_fade_out)
+        if vibrato_fade_out > 0:
+            shape[fade_out] *= (vibrato_duration - t[fade_out]) / vibrato_fade_out
         # ビブラートの形状をリストに追加
-        vibrato_shapes.append(shape)
+        vibrato_shapes.append((first_frame, shape))
 
     # ビブラートの形状のリストを返す[cent]
     return vibrato_shapes
 
 
-def get_flat_baseline(ust: Ust):
+def get_vibrato_shapes(ust: Ust, f0_time_unit_ms: float = FRAME_PERIOD):
+    """
+    USTを読み取ってビブラートの形状を計算する。
+    f0 のフレームの時刻(f0_time_unit_ms の倍数[ms])での値だけを計算して、
+    (開始フレーム, 形状) のリストを返す。
+    """
+    return params_to_shapes(get_vibrato_params(ust), f0_time_unit_ms)
+
+
+def get_total_length_ms(ust: Ust) -> int:
+    """USTの全体の長さ[ms]を返す。"""
+    return math.ceil(sum(note.length_ms for note in ust.notes))
+
+
+def get_flat_baseline(ust: Ust, f0_time_unit_ms: float = FRAME_PERIOD):
     """
     USTを読み取って、ビブラートのないノートのベースラインを作成する。
-    要素数 = UST全体の長さ[ms] になっている 0cent のリストを返す。
+    要素数 = UST全体の長さ[ms] / f0_time_unit_ms になっている 0cent の配列を返す。
     """
-    total_length_ms = math.ceil(sum(note.length_ms for note in ust.notes))
-    return [0] * total_length_ms  # ベースラインは全て0centで初期化
+    # ベースラインは全て0centで初期化
+    return np.zeros(math.ceil(get_total_length_ms(ust) / f0_time_unit_ms))
+
+
+def render_delta_f0(
+    vibrato_params: list,
+    total_length_ms: float,
+    f0_time_unit_ms: float = FRAME_PERIOD,
+    start_frame: int = 0,
+    n_frames=None,
+) -> np.ndarray:
+    """
+    ビブラートのパラメータから、f0 のフレームごとのΔf0[cent]を計算する。
+
+    曲頭から数えて start_frame から n_frames フレームの分だけを返す。n_frames を省略すると曲末まで。
+    区間分割合成では区間ごとに呼ばれるので、その範囲に重なるビブラートの形状だけを計算する。
+
+    >>> params = [{'start': 0, 'duration': 20, 'period': 20, 'depth': 100, 'phase': 0,
+    ...            'fade_in': 0, 'fade_out': 0}]
+    >>> render_delta_f0(params, 30, 5).round(6).tolist()
+    [0.0, 100.0, 0.0, -100.0, 0.0, 0.0]
+    >>> render_delta_f0(params, 30, 10).round(6).tolist()
+    [0.0, 0.0, 0.0]
+    >>> render_delta_f0(params, 30, 5, start_frame=2, n_frames=3).round(6).tolist()
+    [0.0, -100.0, 0.0]
+    """
+    # 曲末を越える部分は返さない
+    end_frame = math.ceil(total_length_ms / f0_time_unit_ms)
+    if n_frames is not None:
+        end_frame = min(end_frame, start_frame + n_frames)
+    # ベースラインは全て0centで初期化
+    vibrato_heights = np.zeros(max(0, end_frame - start_frame))
+    # 範囲に重なるビブラートだけを計算する
+    spans = [vibrato_frame_span(params, f0_time_unit_ms) for params in vibrato_params]
+    overlapping = [
+        params
+        for params, (first, end) in zip(vibrato_params, spans)
+        if first < end_frame and end > start_frame
+    ]
+    # ベースラインにビブラートの形状の、範囲に入る部分を書き込む
+    for first_frame, shape in params_to_shapes(overlapping, f0_time_unit_ms):
+        lo = max(first_frame, start_frame)
+        hi = min(first_frame + len(shape), end_frame)
+        if lo < hi:
+            vibrato_heights[lo - start_frame : hi - start_frame] = shape[
+                lo - first_frame : hi - first_frame
+            ]
+    return vibrato_heights
 
 
 def hz_to_cent(f0_list):
-    """f0のリストを受け取り、centに変換する。
+    """f0の配列を受け取り、centに変換する。
     f0が0の場合は1に置き換える。
     """
-    return [math.log2(max(f0, 1)) * 1200 for f0 in f0_list]  # 1オクターブ = 1200cent
+    # 1オクターブ = 1200cent
+    return np.log2(np.maximum(np.asarray(f0_list, dtype=np.float64), 1)) * 1200
 
 
 def cent_to_hz(cent_list):
-    """centのリストを受け取り、f0に変換する。
+    """centの配列を受け取り、f0に変換する。
     計算結果が1以下の場合は0に置き換える。
+
+    >>> cent_to_hz(hz_to_cent([0, 440, 880])).round(6).tolist()
+    [0.0, 440.0, 880.0]
     """
     # POWER!!
-    f0_list = [2 ** (cent / 1200) for cent in cent_list]
+    f0_list = 2 ** (np.asarray(cent_list, dtype=np.float64) / 1200)
     # 1以下の値は0に置き換える
-    f0_list = [x if x > 1 else 0 for x in f0_list]
-    return f0_list
-
-
-def load_f0_file(path_f0):
-    """f0のファイルを読み取り、f0のリストを返す。
-    ファイルは1行に1つのf0値が書かれていると仮定する。
-    """
-    with open(path_f0, 'r', encoding='utf-8') as f:
-        f0_list = list(map(float, f.read().splitlines()))
+    f0_list[f0_list <= 1] = 0
     return f0_list
 
 
@@ -156,94 +256,174 @@ def switch_mode(ust) -> str:
     return 'ust_editor'
 
 
-def calc_and_export_vibrato_shapes(path_ust: str, path_delta_f0_cent_out: str, f0_time_unit_ms: int = 5):
+def switch_mode_by_state(path_state: str) -> str:
+    """どのタイミングで起動されたかを、状態保存用フォルダのパラメータのファイルの有無で調べる。
+    """
+    if exists(path_state):
+        return 'acoustic_editor'
+    return 'ust_editor'
+
+
+def calc_and_export_vibrato_shapes(
+    path_ust: str,
+    path_delta_f0_cent_out: str,
+    f0_time_unit_ms: float = FRAME_PERIOD,
+    write_mode_switch: bool = True,
+):
     """
     USTからビブラートの形状を計算し、Δf0[cent]のファイルに出力する。
     Δf0のファイルが出力済みであることを示すため、
-    USTの[#SETTING]に $EnunuVibratoApplier を追加する。
+    USTの[#SETTING]に $EnunuVibratoApplier を追加する。(write_mode_switch=False の場合は追加しない)
     """
     # USTファイルを読み込む
     ust = utaupy.ust.load(path_ust)
-    # ベースラインを取得
-    vibrato_heights = get_flat_baseline(ust)
-    # ビブラートの開始時刻を取得
-    vibrato_start_times = get_vibrato_start_times(ust)
-    # ビブラートの形状を取得
-    vibrato_shapes = get_vibrato_shapes(ust)
-
-    # ビブラートの個数が一致することを確認する
-    print(f'ビブラート形状のリストの要素数: {len(vibrato_shapes)}')
-    print(f'ビブラート開始時刻のリストの要素数: {len(vibrato_start_times)}')
-    assert len(vibrato_start_times) == len(vibrato_shapes), \
-        f'ビブラート開始時刻のリスト({len(vibrato_start_times)}) と ビブラート形状のリスト({len(vibrato_shapes)}) の要素数が一致しません。'
-
-    # ベースラインにビブラートの形状を加算する
-    for t, shape in zip(vibrato_start_times, vibrato_shapes):
-        vibrato_heights[t:t + len(shape)] = shape
-    # NNSVSのf0は5ms刻みなので5つごとに間引く。
-    vibrato_heights = vibrato_heights[::f0_time_unit_ms]
+    # ビブラートのパラメータを取得
+    vibrato_params = get_vibrato_params(ust)
+    print(f'ビブラート形状のリストの要素数: {len(vibrato_params)}')
+    # ベースラインにビブラートの形状を書き込む
+    vibrato_heights = render_delta_f0(vibrato_params, get_total_length_ms(ust), f0_time_unit_ms)
 
     # ビブラート形状のピッチ線をファイル出力
-    s = '\n'.join(list(map(str, vibrato_heights)))
-    with open(path_delta_f0_cent_out, 'w', encoding='utf-8') as f:
-        f.write(s)
+    enulib.features.save_column(path_delta_f0_cent_out, vibrato_heights)
     # USTの設定に $EnunuVibratoApplier を追加して上書き
-    ust.setting[MODE_SWITCH_KEY] = True
-    ust.write(path_ust)
+    if write_mode_switch:
+        ust.setting[MODE_SWITCH_KEY] = True
+        ust.write(path_ust)
 
     return vibrato_heights
 
 
+def export_vibrato_params(path_ust: str, path_state: str) -> list:
+    """
+    USTからビブラートのパラメータを計算して、状態保存用のファイルに出力する。
+
+    f0 のフレーム周期は acoustic_editor の段階で --frame_period で渡されるので、
+    ここではフレーム周期によらないパラメータ[ms]のまま残しておく。
+    """
+    ust = utaupy.ust.load(path_ust)
+    vibrato_params = get_vibrato_params(ust)
+    print(f'ビブラート形状のリストの要素数: {len(vibrato_params)}')
+    state = {'total_length_ms': get_total_length_ms(ust), 'vibratos': vibrato_params}
+    with open(path_state, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    return vibrato_params
+
+
+def load_frame_offset(path_offset: str, default: int = 0) -> int:
+    """区間分割合成のときに、これまでに処理したf0のフレーム数を読み取る。
+
+    まだ処理していない場合は default (最初に合成する区間の先頭フレームの位置) を返す。
+    """
+    if not exists(path_offset):
+        return default
+    with open(path_offset, 'r', encoding='utf-8') as f:
+        return int(f.read().strip())
+
+
+def add_vibrato(f0_list, delta_f0_cent_list) -> np.ndarray:
+    """
+    f0 にΔf0[cent]を加算する。ただし、f0 = 0Hz の時は無声部分なのでビブラートを無視する。
+    Δf0 が足りない部分はビブラートなし(0cent)として扱う。
+
+    >>> add_vibrato([0, 440, 440], [1200, 1200]).round(6).tolist()
+    [0.0, 880.0, 440.0]
+    """
+    f0_cent_list = hz_to_cent(f0_list)
+    len_f0_list = len(f0_cent_list)
+    delta = np.zeros(len_f0_list)
+    delta[:min(len_f0_list, len(delta_f0_cent_list))] = delta_f0_cent_list[:len_f0_list]
+    f0_cent_list = np.where(f0_cent_list > 0, f0_cent_list + delta, f0_cent_list)
+    # f0 を cent から Hz に戻す
+    return cent_to_hz(f0_cent_list)
+
+
+def apply_vibrato_with_state(
+    path_f0_in: str, path_f0_out: str, state_dir: str, f0_time_unit_ms: float = FRAME_PERIOD
+) -> np.ndarray:
+    """
+    状態保存用のファイルのビブラートのパラメータから、f0 のフレーム周期でΔf0を計算して適用する。
+    区間分割合成のときは、処理済みのフレーム数の分だけずらして適用する。
+    範囲を指定して合成している場合は、ビブラートは曲全体のUSTで計算してあるので、
+    最初に合成する区間の曲頭からの位置から数える。
+    """
+    with open(join(state_dir, STATE_FILE_NAME), 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    path_offset = join(state_dir, OFFSET_FILE_NAME)
+    frame_offset = load_frame_offset(
+        path_offset,
+        enulib.render_range.first_f0_frame(
+            enulib.render_range.load_range_info(state_dir), f0_time_unit_ms, from_song_start=True
+        ),
+    )
+    f0_list = enulib.features.load_column(path_f0_in)
+    delta_f0_cent_list = render_delta_f0(
+        state['vibratos'],
+        state['total_length_ms'],
+        f0_time_unit_ms,
+        start_frame=frame_offset,
+        n_frames=len(f0_list),
+    )
+    print(f'f0の要素数               : {len(f0_list)}')
+    print(f'Δf0 (ビブラート) の要素数: {len(delta_f0_cent_list)}')
+    new_f0_list = add_vibrato(f0_list, delta_f0_cent_list)
+    enulib.features.save_column(path_f0_out, new_f0_list)
+    with open(path_offset, 'w', encoding='utf-8') as f:
+        f.write(str(frame_offset + len(f0_list)))
+    return new_f0_list
+
+
 def apply_vibrato_to_f0(path_f0_in: str, path_f0_out: str, path_delta_f0_cent: str):
     """
     Δf0[cent]のファイルを読み取り、f0 にビブラートを適用して出力する。
-    f0_time_unit_ms は f0 の時間単位で、デフォルトは 5ms。
+    Δf0 は f0 と同じフレーム周期で計算してあるものとする。
     """
     # f0のファイルを読み取る
-    f0_list = load_f0_file(path_f0_in)
+    f0_list = enulib.features.load_column(path_f0_in)
     len_f0_list = len(f0_list)
-    # f0をcentに変換する
-    f0_cent_list = hz_to_cent(f0_list)
     # Δf0[cent]のファイルを読み取る
-    delta_f0_cent_list = load_f0_file(path_delta_f0_cent)
+    delta_f0_cent_list = enulib.features.load_column(path_delta_f0_cent)
 
     # 要素数が概ね合っているかチェック
     print(f'f0の要素数               : {len_f0_list}')
     print(f'Δf0 (ビブラート) の要素数: {len(delta_f0_cent_list)}')
 
-    # # ベースラインの要素数に対してf0の要素数が少ない場合は、f0の要素数に合わせてベースラインを切り詰める。
-    # if len(f0_cent_list) < len(delta_f0_cent_list):
-    #     delta_f0_cent_list = delta_f0_cent_list[:len(f0_cent_list)]
-
-    # f0 にビブラートを加算する。ただし、f0 = 0Hz (f0_cent=0) の時は無声部分なのでビブラートを無視する。
-    f0_cent_list = [
-        f0_cent + delta if f0_cent > 0 else f0_cent
-        for f0_cent, delta in zip(f0_cent_list, delta_f0_cent_list)
-    ]
-
-    # f0 を cent から Hz に戻す
-    f0_list = cent_to_hz(f0_cent_list)
+    # f0 にビブラートを加算する
+    f0_list = add_vibrato(f0_list, delta_f0_cent_list)
 
     # f0ファイルを上書き保存
-    s = '\n'.join(list(map(str, f0_list)))
-    with open(path_f0_out, 'w', encoding='utf-8') as f:
-        f.write(s)
+    enulib.features.save_column(path_f0_out, f0_list)
 
     # Δf0 のうち、使用済みの要素を削除して上書き保存する。
     delta_f0_cent_list = delta_f0_cent_list[len_f0_list:-1]
-    s = '\n'.join(list(map(str, delta_f0_cent_list)))
-    with open(path_delta_f0_cent, 'w', encoding='utf-8') as f:
-        f.write(s)
-    return f0_cent_list
+    enulib.features.save_column(path_delta_f0_cent, delta_f0_cent_list)
+    return f0_list
 
 
-def main(path_f0_in: str, path_f0_out: str, path_ust: str):
+def main(
+    path_f0_in: str,
+    path_f0_out: str,
+    path_ust: str,
+    state_dir=None,
+    frame_period: float = FRAME_PERIOD,
+):
     """
     全体時の処理をやる
+
+    state_dir が指定されている場合は、合成ごとの状態保存用フォルダにビブラートのパラメータを置いて、
+    その有無で動作モードを切り替える。Δf0 は acoustic_editor の段階で frame_period[ms] ごとに計算する。
+    指定されていない場合(古いENUNUから呼ばれた場合)は、スクリプトの隣に 5ms ごとのΔf0 を置いて
+    USTで切り替える。
     """
-    # 一時ファイルの置き場を指定
+    # 合成ごとの状態保存用フォルダを使う場合
+    if state_dir is not None:
+        if switch_mode_by_state(join(state_dir, STATE_FILE_NAME)) == 'ust_editor':
+            # USTのビブラートのパラメータを計算して出力する
+            return export_vibrato_params(path_ust, join(state_dir, STATE_FILE_NAME))
+        # f0 のフレーム周期でビブラートを計算してf0ファイルを加工する
+        return apply_vibrato_with_state(path_f0_in, path_f0_out, state_dir, frame_period)
+
+    # 一時ファイルの置き場を指定してモード分岐する
     path_delta_f0_cent = join(dirname(__file__), 'temp_delta_f0_cent.csv')
-    # モード分岐する
     mode = switch_mode(utaupy.ust.load(path_ust))
 
     # 分岐処理する
@@ -262,25 +442,20 @@ def test():
     """テスト用の関数。input関数でUSTファイルを指定して読み込み、ビブラートの形状を計算して表示する。
     """
     # f0のCSVファイルのパスを指定して読み込む
-    f0_list = load_f0_file(input('f0のCSVファイルのパス: ').strip())
+    f0_list = enulib.features.load_column(input('f0のCSVファイルのパス: ').strip())
     print("ビブラートの形状を計算します。USTファイルを指定してください。")
     # USTファイルを読み込む
     ust = utaupy.ust.load(input('USTファイルのパス: ').strip())
-    vibrato_start_times = get_vibrato_start_times(ust)
     vibrato_shapes = get_vibrato_shapes(ust)
     baseline = get_flat_baseline(ust)
     # baselineの要素数とf0の要素数を確認する
     print(f'length of f0_list: {len(f0_list)}')
     print(f'length of baseline: {len(baseline)}')
 
-    assert len(vibrato_start_times) == len(vibrato_shapes), \
-        f'ビブラート開始時刻のリスト({len(vibrato_start_times)}) と ビブラート形状のリスト({len(vibrato_shapes)}) の要素数が一致しません。'
-
-    # ベースラインにビブラートの形状を加算する
-    for t, shape in zip(vibrato_start_times, vibrato_shapes):
-        baseline[t:t + len(shape)] = shape
-    # f0 は 5ms 刻みなので5つごとに間引く。
-    baseline = baseline[::5]
+    # ベースラインにビブラートの形状を書き込む
+    for first_frame, shape in vibrato_shapes:
+        n_frames = len(baseline[first_frame:first_frame + len(shape)])
+        baseline[first_frame:first_frame + n_frames] = shape[:n_frames]
     # baselineを matplib でプロットする
     import matplotlib.pyplot as plt
     plt.plot(baseline)
@@ -297,13 +472,17 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--f0', help='f0の情報を持ったCSVファイルのパス')
     parser.add_argument('--ust', help='USTファイルのパス')
+    parser.add_argument('--state_dir', help='合成ごとの状態保存用フォルダのパス')
+    parser.add_argument('--frame_period', type=float, default=FRAME_PERIOD, help='f0のフレーム周期[ms]')
 
     # 使わない引数は無視して、必要な情報だけ取り出す。
     args, _ = parser.parse_known_args()
 
     # ENUNUから呼び出しているとき
     if any([args.f0 is not None or args.ust]):
-        main(args.f0, args.f0, args.ust)
+        main(
+            args.f0, args.f0, args.ust, state_dir=args.state_dir, frame_period=args.frame_period
+        )
     # ENUNUからの呼び出しがうまくいっていないか、テスト実行の場合
     else:
         test()
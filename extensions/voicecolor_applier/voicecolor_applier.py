@@ -6,16 +6,24 @@ HTSフルラベルの特定のカラムに対応する文字列を登録するEN
 ust_editor と lab_editor として呼び出す。
 歌詞はひらがなとカタカナと休符だけ対応する。それ以外の歌詞はフラグを立てない。
 
-辞書内の順序に依存するので、Python3.7以降でないと正常に動作しないことに注意。
+サフィックスと表情の対応は voicecolor_table.txt から読み取る。
+同じ長さのサフィックスは表の順序を優先するので、Python3.7以降でないと正常に動作しないことに注意。
 """
 
-from copy import copy
+import re
 from argparse import ArgumentParser
-from tqdm import tqdm
-from tqdm.contrib import tzip
-import utaupy
+from copy import copy
+from os.path import dirname, exists, join
 from pprint import pprint
 
+import numpy as np
+import utaupy
+
+# 同梱の表情サフィックスの対応表
+PATH_VOICECOLOR_TABLE = join(dirname(__file__), 'voicecolor_table.txt')
+# 歌詞をつなげて一度に検索するときの区切り文字
+LYRIC_SEPARATOR = '\n'
+
 VOICECOLOR_DICT = {
     '通常': 'Normal',
     '強': 'Loud',
@@ -31,6 +39,46 @@ VOICECOLOR_DICT = {
     'Pop': 'Pop'
 }
 
+
+def parse_voicecolor_table(text: str) -> dict:
+    """表情サフィックスの対応表の文字列を辞書にする。
+
+    タブまたは半角スペースで区切る。シャープから始まる行と空行は無視する。
+
+    >>> parse_voicecolor_table('# comment\\n強\\tLoud\\n\\n裏 Falsetto')
+    {'強': 'Loud', '裏': 'Falsetto'}
+    """
+    voicecolor_dict = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        suffix, voicecolor = line.split(maxsplit=1)
+        voicecolor_dict[suffix] = voicecolor.strip()
+    return voicecolor_dict
+
+
+def compile_voicecolor_table(voicecolor_dict: dict):
+    """表情サフィックスを長い順に並べた正規表現にする。
+
+    先読みで囲むので、歌詞の全ての位置で、その位置から始まる一番長いサフィックスが見つかる。
+    返り値は (正規表現, {サフィックス: 優先順位}) の組。
+    """
+    # サフィックスを文字数順にソートする (同じ長さのときは表の順)
+    suffixes = sorted(voicecolor_dict, key=len, reverse=True)
+    priorities = {k: i for i, k in enumerate(suffixes)}
+    pattern = re.compile('(?=(' + '|'.join(map(re.escape, suffixes)) + '))')
+    return pattern, priorities
+
+
+def load_voicecolor_table(path=PATH_VOICECOLOR_TABLE) -> dict:
+    """表情サフィックスの対応表のファイルを読み取る。ファイルがない場合は VOICECOLOR_DICT を使う。"""
+    if not exists(path):
+        return VOICECOLOR_DICT
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_voicecolor_table(f.read())
+
+
 def pop_voicecolors_in_ust(ust: utaupy.ust.Ust, voicecolor_dict: dict):
     """USTオブジェクト内の全ノートのサフィックスを取得しつつ、元のノートからは削除する。
 
@@ -50,9 +98,6 @@ def pop_voicecolors_in_ust(ust: utaupy.ust.Ust, voicecolor_dict: dict):
     ust.setting[key] = True
     ust = copy(ust)
 
-    # サフィックスの辞書を文字数順にソートする
-    voicecolor_dict = dict(sorted(voicecolor_dict.items(), key=lambda x: len(x[0]), reverse=True))
-
     # TODO: ここ実装する
     if ust.previous_note is not None:
         pass
@@ -60,28 +105,38 @@ def pop_voicecolors_in_ust(ust: utaupy.ust.Ust, voicecolor_dict: dict):
     if ust.next_note is not None:
         pass
 
-    # 取り出したsuffixのリスト
-    l_suffixes = []
-    l_voicecolors = []
-    for note in tqdm(ust.notes):
-        # 表情の文字列があったらリストに取り出して次のノートに移る
-        for k, v in voicecolor_dict.items():
-            if k in note.lyric:
-                note.lyric = note.lyric.replace(k, '')
-                l_suffixes.append(k)
-                l_voicecolors.append(v)
-                break
-        # 表情の文字列がなかったら空白文字をリストに登録して次のノートに移る
-        else:
-            l_suffixes.append('')
-            l_voicecolors.append('')
+    notes = ust.notes
+    pattern, priorities = compile_voicecolor_table(voicecolor_dict)
+    # 全ノートの歌詞をつなげて、1回の検索でサフィックスを探す
+    lyrics = [note.lyric for note in notes]
+    offsets = np.cumsum([0] + [len(lyric) + len(LYRIC_SEPARATOR) for lyric in lyrics])
+    matches = [(m.start(), m.group(1)) for m in pattern.finditer(LYRIC_SEPARATOR.join(lyrics))]
+    # ノートごとに、一番優先順位の高い(長い)サフィックスを選ぶ
+    best = np.full(len(notes), len(priorities))
+    if matches:
+        positions, found = zip(*matches)
+        note_indices = np.searchsorted(offsets, positions, side='right') - 1
+        np.minimum.at(best, note_indices, [priorities[k] for k in found])
+    suffixes_by_priority = list(priorities) + ['']
+
+    # 表情の文字列があったら歌詞から取り除いてリストに取り出す
+    # 表情の文字列がなかったら空白文字をリストに登録する
+    l_suffixes = [suffixes_by_priority[i] for i in best]
+    l_voicecolors = [voicecolor_dict.get(k, '') for k in l_suffixes]
+    for note, suffix in zip(notes, l_suffixes):
+        if suffix:
+            note.lyric = note.lyric.replace(suffix, '')
     assert len(l_suffixes) == len(l_voicecolors) == len(ust.notes)
     return ust, l_suffixes, l_voicecolors
 
 
-def main(voicecolor_dict=VOICECOLOR_DICT):
+def main(voicecolor_dict=None):
     """全体の処理をする
+
+    voicecolor_dict を指定しない場合は voicecolor_table.txt を読み取る。
     """
+    if voicecolor_dict is None:
+        voicecolor_dict = load_voicecolor_table()
     parser = ArgumentParser()
     parser.add_argument('--ust', help='選択部分のノートのUSTファイルのパス')
     # 使わない引数は無視して、必要な情報だけ取り出す。
@@ -96,7 +151,7 @@ def main(voicecolor_dict=VOICECOLOR_DICT):
 
     # voicecolorの文字列をフラグに付加する
     print('VoiceColorを一時ファイルのフラグに転記します。/ Copying VoiceColors to flags.')
-    for note, voicecolor in tzip(ust.notes, l_voicecolors):
+    for note, voicecolor in zip(ust.notes, l_voicecolors):
         note.flags = note.flags + voicecolor
 
     # USTファイルを上書き
@@ -107,6 +162,7 @@ def main(voicecolor_dict=VOICECOLOR_DICT):
 
 if __name__ == '__main__':
     print('voicecolor_applier.py (2024-04-28) -------------------------')
-    pprint(VOICECOLOR_DICT)
-    main(VOICECOLOR_DICT)
+    voicecolor_dict = load_voicecolor_table()
+    pprint(voicecolor_dict)
+    main(voicecolor_dict)
     print('-------------------------------------------------------')
@@ -48,13 +48,14 @@ def copy_python_dir(python_dir, enunu_release_dir):
     shutil.copytree(python_dir, join(enunu_release_dir, python_dir))
 
 
-def create_enunu_bat(path_out: str, python_exe: str, version: str):
+def create_enunu_bat(path_out: str, python_exe: str, version: str, options: str = '--play'):
     """
     プラグインの各フォルダに simple_enunu.bat を作成する。
+    options は simple_enunu.py に渡すコマンドライン引数。
     """
     s = '@echo off\n\n' +\
         f'echo _____ SimpleEnunu v{version} ________\n' +\
-        f'{python_exe} simple_enunu.py %1 --play\n\nPAUSE\n'
+        f'{python_exe} simple_enunu.py %1 {options}\n\nPAUSE\n'
     with open(path_out, 'w', encoding='cp932') as f:
         f.write(s)
 
@@ -155,6 +156,10 @@ def main():
     print('Creating enunu.bat')
     create_enunu_bat(
         join(enunu_release_dir, 'simple_enunu.bat'),  python_exe, version)
+    # 下書き合成用。plugin.txt の execute をこちらにすると下書きで合成する。
+    create_enunu_bat(
+        join(enunu_release_dir, 'simple_enunu_draft.bat'),  python_exe, version,
+        options='--play --draft')
 
     # plugin.txt をリリースフォルダに作成
     print('Creating plugin.txt')
@@ -8,27 +8,33 @@
 import colored_traceback.auto  # noqa: F401
 
 from importlib.util import find_spec
+import gc
 import logging
 import shutil
 import sys
 import time
 import tkinter
-from argparse import ArgumentParser
+from argparse import ArgumentParser, BooleanOptionalAction
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 from glob import glob
-from os import chdir, listdir, makedirs, rename, startfile
+from os import chdir, cpu_count, environ, listdir, makedirs, remove, rename, startfile
 from os.path import (
     abspath,
     basename,
     dirname,
     exists,
     expanduser,
+    getsize,
+    isdir,
     join,
     relpath,
     splitext,
 )
+from pathlib import Path
 from shutil import move
-from tempfile import TemporaryDirectory, mkdtemp
+from tempfile import TemporaryDirectory, gettempdir, mkdtemp
 from tkinter.filedialog import asksaveasfilename
 from typing import Union
 from collections.abc import Iterable
@@ -36,10 +42,10 @@ import numpy as np
 import utaupy
 import yaml
 from nnmnkwii.io import hts
-from scipy.io import wavfile
 
 # import warnings
 import enulib
+import enulib.waveform
 
 # scikit-learn で警告が出るのを無視
 # warnings.simplefilter("ignore")
@@ -54,6 +60,21 @@ logger = logging.getLogger('simple_enunu')
 
 
 SEGMENTED_SYNTHESIS = True
+# 合成ごとの処理時間などを追記するファイル
+PERF_HISTORY_PATH = join(dirname(abspath(__file__)), 'perf_history.jsonl')
+# モデルと CPU ごとの torch のスレッド数の自動調整結果
+TORCH_THREADS_CACHE_PATH = join(dirname(abspath(__file__)), 'torch_threads.json')
+# 下書き (--draft) で合成するときの engine.svs の設定。音質より速さを優先する。
+# WORLD で合成するのでニューラルボコーダは読み込まず、ポストフィルタと特徴量の平滑化をせず、
+# NNSVS の区間分割 (休符で区切るだけ) で合成する。
+# NOTE: merlin のポストフィルタは高い次数の変換をフレームごとに行うので gv より遅い。
+DRAFT_SVS_OPTIONS = {
+    'vocoder_type': 'world',
+    'post_filter_type': 'none',
+    'trajectory_smoothing': False,
+    'segmented_synthesis': True,
+    'segmentation_method': 'fixed',
+}
 
 # torch をimportする。インストールされていない場合は新規インストールする ------
 if find_spec('torch') is None:
@@ -96,10 +117,16 @@ for pkg_name, pkg_url in _special_packages.items():
 import nnsvs  # noqa: E402
 from nnsvs.svs import SPSVS  # noqa: E402
 
+import enulib.precision  # noqa: E402
+import enulib.thread_tuning  # noqa: E402
+import enulib.torchscript  # noqa: E402
 from enulib import enunu2nnsvs  # noqa: E402
 
 logger.debug('Imported NNSVS module: %s', nnsvs)
 
+# ニューラルボコーダをまだ読み込んでいないことを表す値
+VOCODER_NOT_LOADED = object()
+
 
 def get_project_path(path_utauplugin):
     """
@@ -117,23 +144,6 @@ def get_project_path(path_utauplugin):
     return path_ust, voice_dir, cache_dir
 
 
-def estimate_bit_depth(wav: np.ndarray) -> str:
-    """
-    wavformのビット深度を判定する。
-    16bitか32bit
-    16bitの最大値: 32767
-    32bitの最大値: 2147483647
-    """
-    # 音量の最大値を取得
-    max_gain = np.nanmax(np.abs(wav))
-    # 学習データのビット深度を推定(8388608=2^24)
-    if max_gain > 8388608:
-        return 'int32'
-    if max_gain > 8:
-        return 'int16'
-    return 'float'
-
-
 def wrapped_enunu2nnsvs(voice_dir, out_dir):
     """ENUNU用のディレクトリ構造のモデルをNNSVS用に再構築する。"""
     # torch.save() の出力パスに日本語が含まれているとセーブできないので、一時フォルダを作ってそこに保存してから移動する。
@@ -172,27 +182,98 @@ def find_table(model_dir: str) -> str:
     return table_files[0]
 
 
-def adjust_wav_gain_for_float32(wav: np.ndarray):
+def prepare_temp_dir(persist_dir: str, songname: str, scratch_dir: Union[str, None] = None) -> str:
+    """
+    中間ファイルを置く作業フォルダを作成してパスを返す。
+
+    同じ曲を同時にレンダリングしても中間ファイルや拡張機能の状態が衝突しないように、
+    毎回別のフォルダを作る。
+    scratch_dir が指定されていない場合は、USTの隣のフォルダ(persist_dir)の中に作って、
+    中間ファイルをコピーせずにそのまま残す。
+    scratch_dir が指定されている場合は、RAMディスクや高速なSSDなどに作る。
+    'auto' を指定するとOSの一時フォルダを使う。
     """
-    wavformのビット深度を判定して、float32で適切な音量で出力する。
-    16bitか32bit
-    16bitの最大値: 32767
-    32bitの最大値: 2147483647
-    ビット深度を指定してファイル出力(32bit float)
+    if scratch_dir is None or scratch_dir == '':
+        makedirs(persist_dir, exist_ok=True)
+        return mkdtemp(prefix='render-', dir=persist_dir)
+    if scratch_dir == 'auto':
+        scratch_dir = gettempdir()
+    makedirs(scratch_dir, exist_ok=True)
+    return mkdtemp(prefix=f'{songname}_enutemp-', dir=scratch_dir)
+
+
+def is_inside_persist_dir(temp_dir: str, persist_dir: str) -> bool:
+    """作業フォルダを中間ファイルを残すフォルダの中に作ったかどうか (scratch_dir を指定していない場合)"""
+    return dirname(abspath(temp_dir)) == abspath(persist_dir)
 
+
+def persist_intermediates(
+    temp_dir: str, persist_dir: str, keep: Union[bool, str, Iterable, None]
+) -> list[str]:
+    """
+    作業フォルダの中間ファイルのうち、残したいものだけをUSTの隣のフォルダにコピーする。
+
+    作業フォルダがUSTの隣のフォルダの中にある場合は、コピーせずに残さないファイルだけを削除する。
+    何も残さない場合は作業フォルダごと削除する。
+
+    Args:
+        temp_dir (str): 作業フォルダ
+        persist_dir (str): 中間ファイルを残すフォルダ (USTの隣の *_enutemp)
+        keep: True なら全部、False や None なら何も残さない。
+            文字列またはそのリストを指定した場合は、一致するファイル名(glob)だけ残す。
+
+    Returns:
+        list[str]: 残したファイルのパスのリスト
     """
-    # 音量の最大値を取得
-    max_gain = np.nanmax(np.abs(wav))
+    if not keep:
+        patterns = []
+    elif keep is True:
+        patterns = ['*']
+    elif isinstance(keep, str):
+        patterns = [keep]
+    elif isinstance(keep, Iterable):
+        patterns = list(keep)
+    else:
+        raise TypeError(f'keep_intermediates must be bool or strings or list, not {type(keep)}')
+
+    if is_inside_persist_dir(temp_dir, persist_dir):
+        kept = {path for pattern in patterns for path in glob(join(temp_dir, pattern))}
+        for path in glob(join(temp_dir, '*')):
+            if path in kept:
+                continue
+            if isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                remove(path)
+        if not kept:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return sorted(kept)
+
+    copied = []
+    makedirs(persist_dir, exist_ok=True)
+    for pattern in patterns:
+        for path in glob(join(temp_dir, pattern)):
+            path_out = join(persist_dir, basename(path))
+            if isdir(path):
+                shutil.copytree(path, path_out, dirs_exist_ok=True)
+            else:
+                shutil.copy2(path, path_out)
+            copied.append(path_out)
+    return copied
+
 
-    # 学習データのビット深度を推定(8388608=2^24)
-    # int32 -> float
-    if max_gain > 8388608:
-        return wav / 2147483647
-    # int16 -> float
-    if max_gain > 8:
-        return wav / 32767
-    # float
-    return wav
+@contextmanager
+def defer_vocoder_loading():
+    """SPSVS の初期化でニューラルボコーダを読み込まないようにして、元の読み込み関数を返す。
+
+    ボコーダのファイルがある場合、vocoder には VOCODER_NOT_LOADED が入る。
+    """
+    load_vocoder = nnsvs.svs.load_vocoder
+    nnsvs.svs.load_vocoder = lambda *args, **kwargs: (VOCODER_NOT_LOADED, None, None)
+    try:
+        yield load_vocoder
+    finally:
+        nnsvs.svs.load_vocoder = load_vocoder
 
 
 class ENUNU(SPSVS):
@@ -201,6 +282,7 @@ class ENUNU(SPSVS):
     Args:
         model_dir (str): NNSVSのモデルがあるフォルダ
         device (str): 'cuda' or 'cpu'
+        tracer (enulib.trace.Tracer): 段階ごとの処理時間を記録する。省略すると新しく作る。
     """
 
     def __init__(
@@ -208,6 +290,7 @@ class ENUNU(SPSVS):
         model_dir: str,
         device=None,
         verbose=0,
+        tracer=None,
         **kwargs,
     ):
         # automatic device select
@@ -217,8 +300,29 @@ class ENUNU(SPSVS):
                 if torch.accelerator.is_available()
                 else torch.device('cpu')
             )
+        self.tracer = tracer if tracer is not None else enulib.trace.Tracer()
         # initialize
-        super().__init__(model_dir, device=device, verbose=verbose, **kwargs)
+        # NOTE: ニューラルボコーダは重みのファイルが大きく、WORLD で合成する場合は使わないので、
+        #       predict_waveform で初めて使うときに読み込む。
+        with defer_vocoder_loading() as load_vocoder:
+            super().__init__(model_dir, device=device, verbose=verbose, **kwargs)
+        self._load_vocoder = load_vocoder
+        self.model_dir = model_dir
+        # CPU で推論するときは、設定に応じて低い精度 (int8, bf16) のモデルにする
+        self.precision = enulib.precision.apply_precision(
+            self, self.get_option('precision', 'fp32'), model_dir, self.logger
+        )
+        # TorchScript に書き出したモデルがあれば使う。低い精度のモデルにした場合は使わない。
+        # ニューラルボコーダは読み込むときに置き換える。
+        self.scripted_models = []
+        if self.precision == 'fp32':
+            self.scripted_models = enulib.torchscript.apply_scripted_models(
+                self,
+                model_dir,
+                self.get_option('backend', 'auto'),
+                self.logger,
+                model_types=enulib.torchscript.MODEL_TYPES[:3],
+            )
         # self.voice_dir = None
         # self.path_plugin = None
         self.path_ust = None
@@ -232,7 +336,77 @@ class ENUNU(SPSVS):
         self.path_vuv = None
         self.path_bap = None
         self.path_feedback = None
+        self.path_waveform_spill = None
         # self.path_wav = None
+        # 範囲を指定して合成するときに拡張機能に渡す範囲の情報
+        self.range_info = None
+
+    @property
+    def vocoder(self):
+        """ニューラルボコーダ。読み込んでいない場合はここで読み込む。"""
+        if self._vocoder is VOCODER_NOT_LOADED:
+            self.load_vocoder()
+        return self._vocoder
+
+    @vocoder.setter
+    def vocoder(self, value):
+        self._vocoder = value
+
+    @property
+    def has_vocoder(self) -> bool:
+        """ニューラルボコーダがあるかどうか。読み込んでいなくても、ファイルがあれば True。"""
+        return self._vocoder is not None
+
+    @property
+    def vocoder_loaded(self) -> bool:
+        """ニューラルボコーダを読み込み済みかどうか。"""
+        return self._vocoder is not None and self._vocoder is not VOCODER_NOT_LOADED
+
+    def vocoder_path(self) -> str:
+        """ニューラルボコーダの重みのファイルのパスを返す。"""
+        return join(self.model_dir, 'vocoder_model.pth')
+
+    def load_vocoder(self):
+        """ニューラルボコーダを読み込む。"""
+        with self.tracer.span('load_vocoder'):
+            self.logger.info('Loading vocoder: %s', self.vocoder_path())
+            self._vocoder, self.vocoder_in_scaler, self.vocoder_config = self._load_vocoder(
+                Path(self.vocoder_path()), self.device, self.acoustic_config
+            )
+            if self.precision == 'fp32':
+                self.scripted_models += enulib.torchscript.apply_scripted_models(
+                    self,
+                    self.model_dir,
+                    self.get_option('backend', 'auto'),
+                    self.logger,
+                    model_types=('vocoder',),
+                )
+
+    def unload_vocoder(self):
+        """読み込んだニューラルボコーダを解放する。次に使うときにまた読み込む。"""
+        if not self.vocoder_loaded:
+            return
+        self._vocoder = VOCODER_NOT_LOADED
+        self.vocoder_in_scaler = None
+        self.vocoder_config = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.logger.info('Unloaded vocoder')
+
+    def predict_waveform(self, multistream_features, vocoder_type='world', vuv_threshold=0.5):
+        """音響特徴量から波形を作る。WORLD で合成する場合はニューラルボコーダを読み込まない。"""
+        if vocoder_type != 'world' or self._vocoder is not VOCODER_NOT_LOADED:
+            return super().predict_waveform(
+                multistream_features, vocoder_type=vocoder_type, vuv_threshold=vuv_threshold
+            )
+        self._vocoder = None
+        try:
+            return super().predict_waveform(
+                multistream_features, vocoder_type=vocoder_type, vuv_threshold=vuv_threshold
+            )
+        finally:
+            self._vocoder = VOCODER_NOT_LOADED
 
     def set_paths(self, temp_dir, songname, path_feedback=None):
         """ファイル入出力のPATHを設定する"""
@@ -242,13 +416,224 @@ class ENUNU(SPSVS):
         self.path_mono_score = join(temp_dir, f'{songname}_score.lab')
         self.path_full_timing = join(temp_dir, f'{songname}_timing.full')
         self.path_mono_timing = join(temp_dir, f'{songname}_timing.lab')
-        self.path_mgc = join(temp_dir, f'{songname}_acoustic_mgc.csv')
-        self.path_f0 = join(temp_dir, f'{songname}_acoustic_f0.csv')
-        self.path_vuv = join(temp_dir, f'{songname}_acoustic_vuv.csv')
-        self.path_bap = join(temp_dir, f'{songname}_acoustic_bap.csv')
+        # 拡張機能に渡す音響特徴量のファイル形式 (csv または npy)
+        ext = 'npy' if self.get_option('feature_format', 'csv') == 'npy' else 'csv'
+        self.path_mgc = join(temp_dir, f'{songname}_acoustic_mgc.{ext}')
+        self.path_f0 = join(temp_dir, f'{songname}_acoustic_f0.{ext}')
+        self.path_vuv = join(temp_dir, f'{songname}_acoustic_vuv.{ext}')
+        self.path_bap = join(temp_dir, f'{songname}_acoustic_bap.{ext}')
+        self.path_waveform_spill = join(temp_dir, f'{songname}_waveform.raw')
+        self.path_state_dir = join(temp_dir, 'extension_state')
         if path_feedback is not None:
             self.path_feedback = path_feedback
 
+    def reset_extension_state(self):
+        """拡張機能の状態を保存するフォルダを空にする。合成を始める前に呼ぶ。"""
+        shutil.rmtree(self.path_state_dir, ignore_errors=True)
+        makedirs(self.path_state_dir, exist_ok=True)
+        self.range_info = None
+
+    def get_extension_state_dir(self, path_extension: str) -> str:
+        """
+        拡張機能ごとの状態保存用フォルダを返す。
+        ust_editor と acoustic_editor のように複数の段階で呼ばれる拡張機能は、
+        同じフォルダを使って段階をまたいだ情報を受け渡す。
+        合成ごとに別々に作る作業フォルダの中に作るので、同時に複数の合成をしても混ざらない。
+        範囲を指定して合成している場合は、範囲の情報もこのフォルダに書き出す。
+        """
+        path_extension = enulib.extensions.parse_extension_path(path_extension)
+        name = splitext(basename(path_extension.strip('\'"')))[0]
+        state_dir = join(self.path_state_dir, name)
+        makedirs(state_dir, exist_ok=True)
+        if self.range_info is not None:
+            enulib.render_range.save_range_info(state_dir, self.range_info)
+        return state_dir
+
+    def get_option(self, key, default=None):
+        """
+        config.yaml の simple_enunu 項目から SimpleEnunu 独自の設定値を取得する。
+        項目がないか値が NULL の場合は default を返す。
+        """
+        options = self.config.get('simple_enunu')
+        if options is None:
+            return default
+        value = options.get(key)
+        if value is None:
+            return default
+        return value
+
+    def estimate_model_memory_mb(self) -> float:
+        """読み込み済みのモデルの重みが使っているメモリ量[MB]を返す。"""
+        models = [
+            self.timelag_model,
+            self.duration_model,
+            self.acoustic_model,
+            self.postfilter_model,
+        ]
+        n_bytes = 0
+        # ニューラルボコーダを読み込んでいない場合は、重みのファイルの大きさで見積もる
+        if self.vocoder_loaded:
+            models.append(self.vocoder)
+        elif self.has_vocoder:
+            n_bytes += getsize(self.vocoder_path())
+        for model in models:
+            # uSFGAN はラッパーの中にモデルがある
+            model = getattr(model, 'generator', model)
+            if isinstance(model, torch.nn.Module):
+                n_bytes += sum(p.numel() * p.element_size() for p in model.parameters())
+        return n_bytes / 1024 / 1024
+
+    def get_thread_benchmarks(self) -> list:
+        """
+        torch のスレッド数を自動調整するときに時間を測る関数のリストを返す。
+        各関数は、読み込んだモデルに短いゼロの入力を1回通す。
+        """
+        thread_tuning = enulib.thread_tuning
+        funcs = []
+        for model, config, n_frames in (
+            (self.timelag_model, self.timelag_config, thread_tuning.BENCHMARK_PHONEMES),
+            (self.duration_model, self.duration_config, thread_tuning.BENCHMARK_PHONEMES),
+            (self.acoustic_model, self.acoustic_config, thread_tuning.BENCHMARK_FRAMES),
+        ):
+            x = torch.zeros(1, n_frames, config.netG.in_dim, device=self.device)
+            funcs.append(partial(model.inference, x, [n_frames]))
+        # ニューラルボコーダは種類によって入力が違うので、通せるものだけ測る。
+        # 時間を測るためだけには読み込まない。
+        in_scaler = getattr(self, 'vocoder_in_scaler', None)
+        if self.vocoder_loaded and hasattr(self.vocoder, 'inference') and in_scaler:
+            n_frames = thread_tuning.BENCHMARK_FRAMES
+            c = torch.zeros(n_frames, len(in_scaler.mean_), device=self.device)
+            forward = partial(self.vocoder.inference, c)
+            try:
+                with torch.inference_mode():
+                    forward()
+                funcs.append(forward)
+            except Exception as e:  # noqa: BLE001
+                self.logger.debug('Vocoder is not used for thread tuning: %s', e)
+        return funcs
+
+    def configure_torch_threads(self, num_threads=None, path_cache=None):
+        """
+        CPU で推論するときの torch のスレッド数を設定する。
+
+        num_threads、環境変数 SIMPLE_ENUNU_TORCH_THREADS、config.yaml の
+        simple_enunu.torch_threads の順に見て、最初に指定されている値を使う。
+        'auto' の場合 (何も指定されていない場合も) は、モデルに短い入力を通して一番速いスレッド数を
+        選び、モデルと CPU の組み合わせごとに path_cache に保存して次から使う。
+        GPU で推論する場合は、明示的に指定されていなければ何もしない。
+        """
+        thread_tuning = enulib.thread_tuning
+        for value in (
+            num_threads,
+            environ.get(thread_tuning.THREADS_ENV),
+            self.get_option('torch_threads'),
+        ):
+            num_threads = thread_tuning.parse_threads(value)
+            if num_threads is not None:
+                break
+        else:
+            num_threads = 'auto' if torch.device(self.device).type == 'cpu' else None
+        # inter-op スレッド数は指定された場合だけ設定する
+        interop_threads = self.get_option('torch_interop_threads')
+        if interop_threads is not None and not thread_tuning.set_interop_threads(
+            int(interop_threads)
+        ):
+            self.logger.warning('torch inter-op threads can not be changed after startup.')
+        if num_threads is None:
+            return
+        if num_threads != 'auto':
+            torch.set_num_threads(num_threads)
+            self.logger.info('torch threads: %s', num_threads)
+            return
+
+        key = (
+            f'{thread_tuning.model_signature(self.model_dir)}|{thread_tuning.cpu_signature()}'
+        )
+        cache = thread_tuning.load_cache(path_cache) if path_cache is not None else {}
+        if key in cache:
+            num_threads = cache[key]['num_threads']
+            torch.set_num_threads(num_threads)
+            self.logger.info('torch threads: %s (cached)', num_threads)
+            return
+        candidates = thread_tuning.candidate_thread_counts(cpu_count() or 1)
+        num_threads, timings = thread_tuning.tune(self.get_thread_benchmarks(), candidates)
+        torch.set_num_threads(num_threads)
+        self.logger.info(
+            'torch threads: %s (tuned: %s)',
+            num_threads,
+            ', '.join(f'{n}: {t * 1000:.1f} ms' for n, t in timings.items()),
+        )
+        if path_cache is None:
+            return
+        # 他のプロセスが書いた結果を消さないように、読み直してから追加する
+        cache = thread_tuning.load_cache(path_cache)
+        cache[key] = {'num_threads': num_threads, 'timings': timings}
+        try:
+            thread_tuning.save_cache(path_cache, cache)
+        except OSError as e:
+            self.logger.warning('Failed to save torch thread settings: %s', e)
+
+    def segment_labels(
+        self, duration_modified_labels, method=None, max_segment_memory_mb=None
+    ) -> list:
+        """
+        config.yaml の simple_enunu.segmentation の設定に従って、ラベルを合成区間に分割する。
+
+        method: fixed の場合は NNSVS の segment_labels をそのまま使う。
+        method: adaptive の場合は曲の長さと並列数とメモリ上限から区間を決める。
+        引数で method や max_segment_memory_mb を指定した場合は config.yaml より優先する。
+        """
+        options = self.get_option('segmentation', {})
+        if method is None:
+            method = options.get('method', 'fixed')
+        if max_segment_memory_mb is None:
+            max_segment_memory_mb = options.get('max_segment_memory_mb')
+        # the following parameters are based on experiments in the NNSVS's paper
+        # tuned with Namine Ritsu's database
+        silence_threshold = options.get('silence_threshold', 0.1)
+        min_duration = options.get('min_duration', 5.0)
+
+        if method == 'fixed':
+            return nnsvs.io.hts.segment_labels(
+                duration_modified_labels,
+                silence_threshold=silence_threshold,
+                min_duration=min_duration,
+                force_split_threshold=options.get('force_split_threshold', 5.0),
+            )
+        if method != 'adaptive':
+            raise ValueError(f'Unknown segmentation method: {method}')
+
+        # 区間を外部のワーカープロセスで並列に合成する場合の並列数
+        # NOTE: この関数で作った区間は1つずつ順番に合成するので、CPUのコア数に合わせて
+        #       区間を増やしても速くならず、区間のつなぎ目が増えるだけになる。
+        workers = options.get('workers', 1)
+        if workers == 'auto':
+            self.logger.warning('segmentation.workers: auto is no longer supported. Using 1.')
+            workers = 1
+        # 1区間あたりのメモリ上限から、1区間の最大長を決める
+        max_duration = None
+        if max_segment_memory_mb is not None:
+            memory_per_second = enulib.segmentation.estimate_memory_per_second(
+                sample_rate=self.sample_rate,
+                frame_period=self.config.frame_period,
+                n_linguistic=len(self.binary_dict) + len(self.numeric_dict),
+                n_acoustic=sum(self.acoustic_config.stream_sizes),
+                neural_vocoder=self.has_vocoder,
+            )
+            max_duration = max_segment_memory_mb / memory_per_second
+            self.logger.info(
+                'Estimated memory: %.1f MB/s, max segment duration: %.1f sec',
+                memory_per_second,
+                max_duration,
+            )
+        return enulib.segmentation.plan_segments(
+            duration_modified_labels,
+            workers=int(workers),
+            max_duration=max_duration,
+            min_duration=min_duration,
+            silence_threshold=silence_threshold,
+        )
+
     def get_extension_path_list(self, key) -> list[str]:
         """
         拡張機能のパスのリストを取得する。
@@ -276,6 +661,20 @@ class ENUNU(SPSVS):
             f'not {type(extension_list)} for {extension_list}'
         )
 
+    def get_extension_names(self) -> list[str]:
+        """
+        設定されている拡張機能を、段階:名前 (score_editor:rewrite など) のリストにして返す。
+        """
+        names = []
+        for key in ('ust_editor', 'score_editor', 'timing_editor', 'acoustic_editor'):
+            for path_extension in self.get_extension_path_list(key):
+                if enulib.score_rewriter.is_rewrite_rule(path_extension):
+                    name = 'rewrite'
+                else:
+                    name = splitext(basename(path_extension.strip('\'"')))[0]
+                names.append(f'{key}:{name}')
+        return names
+
     def edit_ust(self, ust: utaupy.ust.Ust, key='ust_editor') -> utaupy.ust.Ust:
         """
         合成前に、外部ツールでUSTを編集する。
@@ -297,6 +696,7 @@ class ENUNU(SPSVS):
                 ust=self.path_ust,
                 table=self.path_table,
                 feedback=self.path_feedback,
+                state_dir=self.get_extension_state_dir(path_extension),
             )
         # 編集後のustファイルを読み取る
         ust = utaupy.ust.load(self.path_ust)
@@ -305,22 +705,39 @@ class ENUNU(SPSVS):
     def edit_score(self, score_labels, key='score_editor'):
         """
         USTから変換して生成したフルラベルを外部ツールで編集する。
+
+        拡張機能のパスの代わりに置換表 ({rewrite: {...}, keep: [...]}) が指定されている場合は、
+        外部ツールを呼び出さずに音素記号を書き換える。
+        続けて指定された置換表はまとめて適用して、ファイルの読み書きは外部ツールの前後だけ行う。
         """
         # LAB加工ツールのパスを取得
         extension_list = self.get_extension_path_list(key)
         # LAB加工ツールが指定されていない時はSkip
         if len(extension_list) == 0:
             return score_labels
+        # 外部ツールを呼び出すまでためておく置換表
+        rules = []
         # 外部ツールでラベルを編集
         for path_extension in extension_list:
+            if enulib.score_rewriter.is_rewrite_rule(path_extension):
+                self.logger.info('Rewriting LAB (score) with %s', dict(path_extension))
+                rules.append(enulib.score_rewriter.RewriteRule.from_config(path_extension))
+                continue
+            # ためておいた置換表を適用してから外部ツールに渡す
+            if rules:
+                enulib.score_rewriter.rewrite_file(self.path_full_score, rules)
+                rules = []
             self.logger.info('Editing LAB (score) with %s', path_extension)
             enulib.extensions.run_extension(
                 path_extension,
                 ust=self.path_ust,
                 table=self.path_table,
                 feedback=self.path_feedback,
+                state_dir=self.get_extension_state_dir(path_extension),
                 full_score=self.path_full_score,
             )
+        if rules:
+            enulib.score_rewriter.rewrite_file(self.path_full_score, rules)
         score_labels = hts.load(self.path_full_score).round_()
         return score_labels
 
@@ -345,6 +762,7 @@ class ENUNU(SPSVS):
                 ust=self.path_ust,
                 table=self.path_table,
                 feedback=self.path_feedback,
+                state_dir=self.get_extension_state_dir(path_extension),
                 full_score=self.path_full_score,
                 mono_score=self.path_mono_score,
                 full_timing=self.path_full_timing,
@@ -387,23 +805,26 @@ class ENUNU(SPSVS):
             )
             return multistream_features
 
-        # ツールが指定されている場合はCSV書き出し
+        # ツールが指定されている場合はCSV (または npy) 書き出し
+        # NOTE: 特徴量は float32 のまま扱い、float64 に変換しない。
+        multistream_features = enulib.features.as_float32(multistream_features)
         if feature_type == 'world':
             assert len(multistream_features) == 4
             mgc, lf0, vuv, bap = multistream_features
-            f0 = np.exp(lf0)
-            np.savetxt(self.path_mgc, mgc, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_f0, f0, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_vuv, vuv, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_bap, bap, fmt='%.16f', delimiter=',')
+            enulib.features.save_feature(self.path_mgc, mgc)
+            enulib.features.save_feature(self.path_f0, np.exp(lf0))
+            enulib.features.save_feature(self.path_vuv, vuv)
+            enulib.features.save_feature(self.path_bap, bap)
         elif feature_type == 'melf0':
             assert len(multistream_features) == 3
             mgc, lf0, vuv = multistream_features
-            f0 = np.exp(lf0)
-            # CSV書き出し
-            np.savetxt(self.path_mgc, mgc, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_f0, f0, fmt='%.16f', delimiter=',')
-            np.savetxt(self.path_vuv, vuv, fmt='%.16f', delimiter=',')
+            enulib.features.save_feature(self.path_mgc, mgc)
+            enulib.features.save_feature(self.path_f0, np.exp(lf0))
+            enulib.features.save_feature(self.path_vuv, vuv)
+        # 書き出したら元の特徴量は不要なので解放する
+        del multistream_features, mgc, lf0, vuv
+        # f0_feedbacker がピッチ点を削減するときの許容誤差[cent]
+        tolerance_cent = self.get_option('feedback_tolerance_cent')
 
         # 複数ツールのすべてについて処理実施する
         for path_extension in extension_list:
@@ -413,6 +834,7 @@ class ENUNU(SPSVS):
                 ust=self.path_ust,
                 table=self.path_table,
                 feedback=self.path_feedback,
+                state_dir=self.get_extension_state_dir(path_extension),
                 full_score=self.path_full_score,
                 mono_score=self.path_mono_score,
                 full_timing=self.path_full_timing,
@@ -421,27 +843,81 @@ class ENUNU(SPSVS):
                 f0=self.path_f0,
                 vuv=self.path_vuv,
                 bap=self.path_bap,
+                frame_period=str(self.config.frame_period),
+                tolerance_cent=None if tolerance_cent is None else str(tolerance_cent),
             )
 
-        # 編集が終わったらCSV読み取り
+        # 編集が終わったら読み取り (float32)
         if feature_type == 'world':
-            mgc = np.loadtxt(self.path_mgc, delimiter=',', dtype=np.float64)
-            lf0 = np.log(np.loadtxt(self.path_f0, delimiter=',', dtype=np.float64)).reshape(-1, 1)
-            vuv = np.loadtxt(self.path_vuv, delimiter=',', dtype=np.float64).reshape(-1, 1)
-            bap = np.loadtxt(self.path_bap, delimiter=',', dtype=np.float64)
+            mgc = enulib.features.load_feature(self.path_mgc)
+            lf0 = np.log(enulib.features.load_feature(self.path_f0, column=True))
+            vuv = enulib.features.load_feature(self.path_vuv, column=True)
+            bap = enulib.features.load_feature(self.path_bap)
             # 統合
             multistream_features = (mgc, lf0, vuv, bap)
         elif feature_type == 'melf0':
-            # 編集が終わったらCSV読み取り
-            mgc = np.loadtxt(self.path_mgc, delimiter=',', dtype=np.float64)
-            lf0 = np.log(np.loadtxt(self.path_f0, delimiter=',', dtype=np.float64)).reshape(-1, 1)
-            vuv = np.loadtxt(self.path_vuv, delimiter=',', dtype=np.float64).reshape(-1, 1)
+            mgc = enulib.features.load_feature(self.path_mgc)
+            lf0 = np.log(enulib.features.load_feature(self.path_f0, column=True))
+            vuv = enulib.features.load_feature(self.path_vuv, column=True)
             # 統合
             multistream_features = (mgc, lf0, vuv)
         else:
             raise Exception('Unexpected Error')
         return multistream_features
 
+    def crop_labels(self, labels, render_range: tuple, padding: float) -> tuple:
+        """
+        合成する範囲[s]の前後に padding[s] 以上の文脈を含むようにフルラベルを切り取る。
+
+        切り取ったラベルは開始時刻を0にそろえる。(切り取ったラベル, ラベル上の範囲[s]) を返す。
+        拡張機能に渡すUSTも同じノートだけにして、範囲の情報を self.range_info に残す。
+        """
+        timing_label = enulib.timing.TimingLabel(
+            np.asarray(labels.start_times), np.asarray(labels.end_times), list(labels.contexts)
+        )
+        note_start_mask = timing_label.note_start_mask()
+        first, last = enulib.render_range.choose_window(
+            timing_label.starts * enulib.segmentation.HTS_TIME_UNIT,
+            note_start_mask,
+            *render_range,
+            padding,
+        )
+        window = labels[first : last + 1]
+        offset = window.start_times[0]
+        window.start_times = np.asarray(window.start_times) - offset
+        window.end_times = np.asarray(window.end_times) - offset
+        offset_sec = offset * enulib.segmentation.HTS_TIME_UNIT
+        note_offset, n_notes = enulib.render_range.window_notes(note_start_mask, first, last)
+        self.crop_ust(note_offset, n_notes, int(note_start_mask.sum()))
+        self.range_info = {
+            'note_offset': note_offset,
+            'n_notes': n_notes,
+            'label_offset': float(offset_sec),
+        }
+        self.logger.info(
+            'Range %.3f-%.3f sec: using labels %s-%s of %s',
+            *render_range,
+            first,
+            last,
+            len(labels),
+        )
+        return window, (render_range[0] - offset_sec, render_range[1] - offset_sec)
+
+    def crop_ust(self, note_offset: int, n_notes: int, n_label_notes: int):
+        """
+        拡張機能に渡すUSTを、切り取ったラベルに含まれるノートだけにする。
+        USTとラベルのノート数が一致しない場合は、ノートの対応がわからないので切り取らない。
+        """
+        ust = utaupy.ust.load(self.path_ust)
+        if len(ust.notes) != n_label_notes:
+            self.logger.warning(
+                'UST has %s notes but labels have %s notes. Extensions get the whole UST.',
+                len(ust.notes),
+                n_label_notes,
+            )
+            return
+        enulib.render_range.crop_ust(ust, note_offset, n_notes).write(self.path_ust)
+
     def svs(
         self,
         labels,
@@ -459,6 +935,11 @@ class ENUNU(SPSVS):
         loudness_norm=False,
         target_loudness=-20,
         segmented_synthesis=False,
+        segmentation_method=None,
+        low_memory=False,
+        memory_budget_mb=4096,
+        render_range=None,
+        range_padding=enulib.render_range.DEFAULT_PADDING,
         **kwargs,
     ):
         """Synthesize waveform from HTS labels.
@@ -477,10 +958,23 @@ class ENUNU(SPSVS):
             force_fix_vuv (bool): Whether to correct VUV.
             fill_silence_to_rest (bool): Fill silence to rest frames.
             dtype (np.dtype): Data type of the output waveform.
+                For ``np.float32``, post-processing is done in place and the gain is
+                adjusted according to the bit depth of the training data.
             peak_norm (bool): Whether to normalize the waveform by peak value.
             loudness_norm (bool): Whether to normalize the waveform by loudness.
             target_loudness (float): Target loudness in dB.
             segmneted_synthesis (bool): Whether to use segmented synthesis.
+            segmentation_method (str): ``fixed`` or ``adaptive``. If None, the method in
+                config.yaml is used.
+            low_memory (bool): Whether to keep memory usage within memory_budget_mb.
+                Segmented synthesis is forced, features are released as soon as they
+                are vocoded and waveforms are spilled to disk.
+            memory_budget_mb (float): Memory budget in MB for low_memory mode.
+            render_range (tuple): (start, end) in seconds from the beginning of the labels.
+                If specified, timings are predicted for the range with ``range_padding``
+                seconds of context on each side, only the segments overlapping the range
+                are synthesized and the waveform is trimmed to the range.
+            range_padding (float): Context in seconds around ``render_range``.
         """
         start_time = time.time()
         vocoder_type = vocoder_type.lower()
@@ -489,36 +983,67 @@ class ENUNU(SPSVS):
         if post_filter_type not in ['merlin', 'nnsvs', 'gv', 'none']:
             raise ValueError(f'Unknown post-filter type: {post_filter_type}')
 
+        tracer = self.tracer
+        # 範囲を指定した場合は、前後に余裕を持たせた部分だけを使う
+        if render_range is not None:
+            with tracer.span('crop_labels'):
+                labels, render_range = self.crop_labels(labels, render_range, range_padding)
+
         # Predict timinigs
-        duration_modified_labels = self.predict_timing(labels)
+        with tracer.span('predict_timing') as span:
+            duration_modified_labels = self.predict_timing(labels)
+            span['frames'] = duration_modified_labels.num_frames()
 
         # NOTE: ここにタイミング補正のための割り込み処理を追加-----------
-        # mono_score を出力
-        with open(self.path_mono_score, 'w', encoding='utf-8') as f:
-            f.write(str(nnsvs.io.hts.full_to_mono(labels)))
-        # mono_timing を出力
-        with open(self.path_mono_timing, 'w', encoding='utf-8') as f:
-            f.write(str(nnsvs.io.hts.full_to_mono(duration_modified_labels)))
-        # full_timing を出力
-        with open(self.path_full_timing, 'w', encoding='utf-8') as f:
-            f.write(str(duration_modified_labels))
-        # 外部で加工した結果でタイミング情報を置換
-        duration_modified_labels = self.edit_timing(duration_modified_labels)
+        with tracer.span('timing_editor'):
+            # mono_score を出力
+            with open(self.path_mono_score, 'w', encoding='utf-8') as f:
+                f.write(str(nnsvs.io.hts.full_to_mono(labels)))
+            # mono_timing を出力
+            with open(self.path_mono_timing, 'w', encoding='utf-8') as f:
+                f.write(str(nnsvs.io.hts.full_to_mono(duration_modified_labels)))
+            # full_timing を出力
+            with open(self.path_full_timing, 'w', encoding='utf-8') as f:
+                f.write(str(duration_modified_labels))
+            # 外部で加工した結果でタイミング情報を置換
+            duration_modified_labels = self.edit_timing(duration_modified_labels)
         # ---------------------------------------------------------------
 
+        # 区間の時刻は0にそろえられるので、分割する前にラベルの開始時刻を覚えておく
+        labels_start = duration_modified_labels.start_times[0] * enulib.segmentation.HTS_TIME_UNIT
+
         # NOTE: segmented synthesis is not well tested. There MUST be better ways
         # to do this.
-        if segmented_synthesis:
+        if low_memory:
+            # モデルの重みを除いた分を、1区間あたりで使えるメモリ量にする
+            model_memory_mb = self.estimate_model_memory_mb()
+            max_segment_memory_mb = memory_budget_mb - model_memory_mb
+            self.logger.info(
+                'Low memory mode: budget %.0f MB, models %.0f MB, segment %.0f MB',
+                memory_budget_mb,
+                model_memory_mb,
+                max_segment_memory_mb,
+            )
+            if max_segment_memory_mb <= 0:
+                self.logger.warning('Memory budget is smaller than the models.')
+                max_segment_memory_mb = memory_budget_mb / 4
+            with tracer.span('segmentation'):
+                duration_modified_labels_segs = self.segment_labels(
+                    duration_modified_labels,
+                    method='adaptive',
+                    max_segment_memory_mb=max_segment_memory_mb,
+                )
+            # 曲全体のラベルは以降使わないので解放する
+            del duration_modified_labels
+            waveform_spill = enulib.waveform.WaveformSpill(self.path_waveform_spill)
+            from tqdm.auto import tqdm  # pylint: disable=C0415
+        elif segmented_synthesis:
             self.logger.warning('Segmented synthesis is not well tested. Use it on your own risk.')
             # NOTE: ここsegment_labels が nnsvs の中の関数にあるので呼び出せるように改造済み
-            duration_modified_labels_segs = nnsvs.io.hts.segment_labels(
-                duration_modified_labels,
-                # the following parameters are based on experiments in the NNSVS's paper
-                # tuned with Namine Ritsu's database
-                silence_threshold=0.1,
-                min_duration=5.0,
-                force_split_threshold=5.0,
-            )
+            with tracer.span('segmentation'):
+                duration_modified_labels_segs = self.segment_labels(
+                    duration_modified_labels, method=segmentation_method
+                )
             from tqdm.auto import tqdm  # pylint: disable=C0415
         else:
             duration_modified_labels_segs = [duration_modified_labels]
@@ -526,64 +1051,129 @@ class ENUNU(SPSVS):
             def tqdm(x, **kwargs):
                 return x
 
+        # 範囲を指定した場合は、範囲に重なる区間だけを合成する
+        if render_range is not None:
+            first, last, wav_start = enulib.render_range.select_segments(
+                [
+                    (seg.end_times[-1] - seg.start_times[0]) * enulib.segmentation.HTS_TIME_UNIT
+                    for seg in duration_modified_labels_segs
+                ],
+                labels_start,
+                *render_range,
+            )
+            # 拡張機能が f0 のフレームの時刻を計算できるように、最初の区間の開始時刻を渡す
+            self.range_info['f0_start'] = wav_start
+            self.logger.info(
+                'Synthesizing segments %s-%s of %s',
+                first,
+                last,
+                len(duration_modified_labels_segs),
+            )
+            duration_modified_labels_segs = duration_modified_labels_segs[first : last + 1]
+
         # Run acoustic model and vocoder
         hts_frame_shift = int(self.config.frame_period * 1e4)
         wavs = []
         self.logger.info('Number of segments: %s', len(duration_modified_labels_segs))
-        for duration_modified_labels_seg in tqdm(
-            duration_modified_labels_segs,
+        for i_seg in tqdm(
+            range(len(duration_modified_labels_segs)),
             desc='[segment]',
             total=len(duration_modified_labels_segs),
         ):
+            duration_modified_labels_seg = duration_modified_labels_segs[i_seg]
+            if low_memory:
+                # 合成済みの区間のラベルを持ち続けないようにする
+                duration_modified_labels_segs[i_seg] = None
             duration_modified_labels_seg.frame_shift = hts_frame_shift
 
             # Predict acoustic features
             # NOTE: if non-zero pre_f0_shift_in_cent is specified, the input pitch
             # will be shifted before running the acoustic model
-            acoustic_features = self.predict_acoustic(
-                duration_modified_labels_seg,
-                f0_shift_in_cent=style_shift * 100,
-            )
+            with tracer.span('predict_acoustic', segment=i_seg) as span:
+                acoustic_features = self.predict_acoustic(
+                    duration_modified_labels_seg,
+                    f0_shift_in_cent=style_shift * 100,
+                )
+                n_frames = len(acoustic_features)
+                span['frames'] = n_frames
 
             # Post-processing for acoustic features
             # NOTE: if non-zero post_f0_shift_in_cent is specified, the output pitch
             # will be shifted as a part of post-processing
-            multistream_features = self.postprocess_acoustic(
-                acoustic_features=acoustic_features,
-                duration_modified_labels=duration_modified_labels_seg,
-                trajectory_smoothing=trajectory_smoothing,
-                trajectory_smoothing_cutoff=trajectory_smoothing_cutoff,
-                trajectory_smoothing_cutoff_f0=trajectory_smoothing_cutoff_f0,
-                force_fix_vuv=force_fix_vuv,
-                fill_silence_to_rest=fill_silence_to_rest,
-                f0_shift_in_cent=-style_shift * 100,
-            )
+            with tracer.span('postprocess_acoustic', segment=i_seg, frames=n_frames):
+                multistream_features = self.postprocess_acoustic(
+                    acoustic_features=acoustic_features,
+                    duration_modified_labels=duration_modified_labels_seg,
+                    trajectory_smoothing=trajectory_smoothing,
+                    trajectory_smoothing_cutoff=trajectory_smoothing_cutoff,
+                    trajectory_smoothing_cutoff_f0=trajectory_smoothing_cutoff_f0,
+                    force_fix_vuv=force_fix_vuv,
+                    fill_silence_to_rest=fill_silence_to_rest,
+                    f0_shift_in_cent=-style_shift * 100,
+                )
+                # NOTE: 後処理で float64 になっている特徴量を、ボコーダに渡すまで float32 で扱う。
+                multistream_features = enulib.features.as_float32(multistream_features)
 
             # NOTE: ここにピッチ補正のための割り込み処理を追加-----------
-            multistream_features = self.edit_acoustic(
-                multistream_features, feature_type=self.feature_type
-            )
+            with tracer.span('acoustic_editor', segment=i_seg, frames=n_frames):
+                multistream_features = self.edit_acoustic(
+                    multistream_features, feature_type=self.feature_type
+                )
 
             # Generate waveform by vocoder
-            wav = self.predict_waveform(
-                multistream_features=multistream_features,
-                vocoder_type=vocoder_type,
-                vuv_threshold=vuv_threshold,
-            )
-
-            wavs.append(wav)
-
-        # Concatenate segmented waveforms
-        wav = np.concatenate(wavs, axis=0).reshape(-1)
+            with tracer.span('predict_waveform', segment=i_seg, frames=n_frames) as span:
+                wav = self.predict_waveform(
+                    multistream_features=multistream_features,
+                    vocoder_type=vocoder_type,
+                    vuv_threshold=vuv_threshold,
+                )
+                span['samples'] = len(wav)
+
+            if low_memory:
+                # 特徴量はボコーダに通したらすぐ解放して、波形はファイルに書き出す
+                del acoustic_features, multistream_features, duration_modified_labels_seg
+                waveform_spill.append(wav)
+                del wav
+                gc.collect()
+            else:
+                wavs.append(wav)
 
-        # Post-processing for the output waveform
-        wav = self.postprocess_waveform(
-            wav,
-            dtype=dtype,
-            peak_norm=peak_norm,
-            loudness_norm=loudness_norm,
-            target_loudness=target_loudness,
-        )
+        with tracer.span('postprocess_waveform') as span:
+            if low_memory:
+                # 書き出した波形をmemmapで開く
+                wav = waveform_spill.open()
+            else:
+                # Concatenate segmented waveforms
+                wav = enulib.waveform.concatenate(wavs)
+            # 範囲ぴったりに切り取る
+            if render_range is not None:
+                begin, end = enulib.render_range.trim_samples(
+                    *render_range, wav_start, self.sample_rate, len(wav)
+                )
+                wav = wav[begin:end]
+            span['samples'] = len(wav)
+
+            if dtype in (np.float32, 'float32'):
+                # 帯域通過フィルタと音量の調整を、波形を複製せずにその場で行う
+                enulib.waveform.bandpass_filter_inplace(wav, self.sample_rate)
+                stats = enulib.waveform.finalize_waveform(
+                    wav,
+                    self.sample_rate,
+                    peak_norm=peak_norm,
+                    loudness_norm=loudness_norm,
+                    target_loudness=target_loudness,
+                )
+                if stats.has_nan:
+                    self.logger.warning('Output waveform contains NaN.')
+            else:
+                # Post-processing for the output waveform
+                wav = self.postprocess_waveform(
+                    np.asarray(wav),
+                    dtype=dtype,
+                    peak_norm=peak_norm,
+                    loudness_norm=loudness_norm,
+                    target_loudness=target_loudness,
+                )
         # pylint: disable=W1203
         self.logger.info(f'Total time: {time.time() - start_time:.3f} sec')
         RT = (time.time() - start_time) / (len(wav) / self.sample_rate)
@@ -592,10 +1182,43 @@ class ENUNU(SPSVS):
         return wav, self.sample_rate
 
 
-def main(path_plugin: str, path_wav: Union[str, None] = None, play_wav: bool = False) -> str:
+def append_perf_record(path_perf_history: str, record: dict, tracer: enulib.trace.Tracer):
     """
-    UTAUプラグインのファイルから音声を生成する
+    合成1回分の処理時間などの記録を、処理の記録のファイルに追記する。
+    書き込めなくても合成は失敗させない。
+    """
+    record['segments'] = tracer.count('predict_acoustic')
+    record['stages'] = {name: round(t, 4) for name, t in tracer.stage_times().items()}
+    record['total_sec'] = round(tracer.total_time, 4)
+    audio_sec = record.get('audio_sec')
+    record['rtf'] = round(tracer.total_time / audio_sec, 4) if audio_sec else None
+    record['peak_rss_mb'] = round(enulib.memory.get_peak_rss() / 1024 / 1024, 1)
+    try:
+        enulib.perf_history.append_record(path_perf_history, record)
+    except OSError as e:
+        logging.warning('Failed to write performance history to %s: %s', path_perf_history, e)
+
+
+def render(
+    path_plugin: str,
+    path_wav: Union[str, None],
+    play_wav: bool,
+    scratch_dir: Union[str, None],
+    keep_intermediates: Union[bool, None],
+    tracer: enulib.trace.Tracer,
+    record: Union[dict, None] = None,
+    torch_threads=None,
+    draft: Union[bool, None] = None,
+    render_range: Union[tuple, None] = None,
+) -> str:
+    """
+    UTAUプラグインのファイルから音声を生成する。引数は main と同じ。
+
+    各段階の処理時間とメモリ使用量は tracer に記録する。
+    record を渡すと、音源名や曲の長さなど処理の記録に使う情報を書き込む。
     """
+    if record is None:
+        record = {}
     # 引用符を削除
     path_plugin = path_plugin.strip('"\'')
     if path_wav is not None:
@@ -620,19 +1243,19 @@ def main(path_plugin: str, path_wav: Union[str, None] = None, play_wav: bool = F
         if path_ust is not None:
             songname = splitext(basename(path_ust))[0]
             out_dir = dirname(path_ust)
-            temp_dir = join(out_dir, f'{songname}_enutemp')
+            persist_dir = join(out_dir, f'{songname}_enutemp')
         # WAV出力パス指定なしかつUST未保存の場合
         else:
             logging.info('USTが保存されていないのでデスクトップにWAV出力します。')
             songname = f'temp__{str_now}'
             out_dir = mkdtemp(prefix='enunu-')
-            temp_dir = join(out_dir, f'{songname}_enutemp')
+            persist_dir = join(out_dir, f'{songname}_enutemp')
 
     # WAV出力パスが指定されている場合
     else:
         songname = splitext(basename(path_wav))[0]
         out_dir = dirname(path_wav)
-        temp_dir = join(out_dir, f'{songname}_enutemp')
+        persist_dir = join(out_dir, f'{songname}_enutemp')
         path_wav = abspath(path_wav)
 
     # ENUNU=>1.0.0 または SimpleEnunu 用に作成されたNNSVSモデルの場合
@@ -661,13 +1284,16 @@ def main(path_plugin: str, path_wav: Union[str, None] = None, play_wav: bool = F
     # カレントディレクトリを音源フォルダに変更する
     chdir(voice_dir)
 
-    # 一時フォルダを作成する
-    makedirs(temp_dir, exist_ok=True)
-
     # モデルを読み取る
     logging.info('Loading models')
-    engine = ENUNU(model_dir)
-    engine.set_paths(temp_dir=temp_dir, songname=songname, path_feedback=path_plugin)
+    with tracer.span('load_models'):
+        engine = ENUNU(model_dir, tracer=tracer)
+    with tracer.span('thread_tuning'):
+        engine.configure_torch_threads(torch_threads, path_cache=TORCH_THREADS_CACHE_PATH)
+    record['torch_threads'] = torch.get_num_threads()
+    record['precision'] = engine.precision
+    record['scripted_models'] = engine.scripted_models
+    record['voicebank'] = basename(abspath(voice_dir))
 
     # NOTE: 後方互換のため
     # enuconfigが存在する場合、そこに記載されている拡張機能のパスをconfigに追加する
@@ -677,48 +1303,104 @@ def main(path_plugin: str, path_wav: Union[str, None] = None, play_wav: bool = F
         engine.config['extensions'] = enuconfig.get('extensions')
         del enuconfig
 
-    # USTを一時フォルダに複製
-    print(f'{datetime.now()} : copying UST')
-    shutil.copy2(path_plugin, engine.path_ust)
-    # Tableファイルを一時フォルダに複製
-    print(f'{datetime.now()} : copying Table')
-    shutil.copy2(find_table(model_dir), engine.path_table)
+    # 一時フォルダを作成する
+    # scratch_dir が指定されている場合は、USTの隣ではなく高速なドライブで作業する。
+    if scratch_dir is None:
+        scratch_dir = engine.get_option('scratch_dir')
+    temp_dir = prepare_temp_dir(persist_dir, songname, scratch_dir)
+    # 作業フォルダを指定していない場合は、従来通り中間ファイルを全部USTの隣に残す
+    if keep_intermediates is None:
+        keep_intermediates = engine.get_option('keep_intermediates', scratch_dir in (None, ''))
+    if draft is None:
+        draft = engine.get_option('draft', False)
+    record['draft'] = bool(draft)
+    logging.info('Working directory: %s', temp_dir)
+    record['extensions'] = engine.get_extension_names()
+    engine.set_paths(temp_dir=temp_dir, songname=songname, path_feedback=path_plugin)
+    engine.reset_extension_state()
+
+    with tracer.span('ust_copy'):
+        # USTを一時フォルダに複製
+        print(f'{datetime.now()} : copying UST')
+        shutil.copy2(path_plugin, engine.path_ust)
+        # Tableファイルを一時フォルダに複製
+        print(f'{datetime.now()} : copying Table')
+        shutil.copy2(find_table(model_dir), engine.path_table)
 
     # USTファイルを編集する
-    ust = utaupy.ust.load(engine.path_ust)
-    ust = engine.edit_ust(ust)
-    ust.write(engine.path_ust)
+    with tracer.span('ust_editor'):
+        ust = utaupy.ust.load(engine.path_ust)
+        ust = engine.edit_ust(ust)
+        ust.write(engine.path_ust)
+    record['notes'] = len(ust.notes)
 
     # UST → LAB の変換をする
     logging.info('Converting UST -> LAB')
-    enulib.utauplugin2score.utauplugin2score(
-        engine.path_ust,
-        engine.path_table,
-        engine.path_full_score,
-        strict_sinsy_style=False,
-    )
+    with tracer.span('score_conversion'):
+        enulib.utauplugin2score.utauplugin2score(
+            engine.path_ust,
+            engine.path_table,
+            engine.path_full_score,
+            strict_sinsy_style=False,
+        )
 
     # フルラベルファイルを読み取る
     logging.info('Loading LAB')
-    labels = hts.load(engine.path_full_score)
+    with tracer.span('label_load'):
+        labels = hts.load(engine.path_full_score)
 
     # LABファイルを編集する。
-    labels = engine.edit_score(labels)
+    with tracer.span('score_editor'):
+        labels = engine.edit_score(labels)
+
+    # 合成する範囲を、ラベルの先頭からの秒にする
+    if render_range is not None:
+        start, end, unit = render_range
+        if unit == 'ticks':
+            notes = utaupy.utauplugin.load(engine.path_ust).notes
+            start, end = enulib.render_range.ticks_to_seconds(
+                [start, end],
+                [note.length for note in notes],
+                [note.length_ms / 1000 for note in notes],
+            )
+        render_range = (float(start), float(end))
+        record['range'] = list(render_range)
 
     # 音声を生成する
     # NOTE: engine.svs を分解してタイミング補正を行えるように改造中。
     logging.info('Generating WAV')
-    wav_data, sample_rate = engine.svs(
-        labels,
-        dtype=np.float32,
-        vocoder_type='auto',
-        post_filter_type='gv',
-        force_fix_vuv=True,
-        segmented_synthesis=SEGMENTED_SYNTHESIS,
-    )
-
-    # wav出力のフォーマットを確認する
-    wav_data = adjust_wav_gain_for_float32(wav_data)
+    svs_options = {
+        'vocoder_type': 'auto',
+        'post_filter_type': 'gv',
+        'segmented_synthesis': engine.get_option('segmentation', {}).get(
+            'enabled', SEGMENTED_SYNTHESIS
+        ),
+    }
+    if draft:
+        logging.info('Draft mode: %s', DRAFT_SVS_OPTIONS)
+        svs_options.update(DRAFT_SVS_OPTIONS)
+    with tracer.span('svs'):
+        wav_data, sample_rate = engine.svs(
+            labels,
+            dtype=np.float32,
+            force_fix_vuv=True,
+            low_memory=engine.get_option('low_memory', False),
+            memory_budget_mb=engine.get_option('memory_budget_mb', 4096),
+            render_range=render_range,
+            range_padding=engine.get_option(
+                'range_padding', enulib.render_range.DEFAULT_PADDING
+            ),
+            **svs_options,
+        )
+    record['audio_sec'] = len(wav_data) / sample_rate
+    # ニューラルボコーダは使うときに読み込むので、読み込まれていなければ WORLD で合成している
+    vocoder = engine.vocoder if engine.vocoder_loaded else None
+    if isinstance(vocoder, enulib.torchscript.ScriptedModel):
+        vocoder = vocoder.model
+    record['vocoder'] = 'world' if vocoder is None else type(vocoder).__name__
+    # 長く動かすプロセスでは、ボコーダのメモリを次の合成まで持ち続けないように解放する
+    if engine.get_option('unload_vocoder', engine.get_option('low_memory', False)):
+        engine.unload_vocoder()
 
     # WAV出力先が未定の場合
     if path_wav is None:
@@ -739,7 +1421,22 @@ def main(path_plugin: str, path_wav: Union[str, None] = None, play_wav: bool = F
     assert path_wav != '', 'ファイル名が入力されていません'
 
     # wav出力
-    wavfile.write(path_wav, rate=sample_rate, data=wav_data)
+    with tracer.span('write_wav'):
+        enulib.waveform.write_wav(path_wav, wav_data, sample_rate)
+    # 省メモリモードでは波形が作業フォルダ内のファイルを参照しているので、先に解放する
+    del wav_data
+    # 波形の一時ファイルは大きいので残さない
+    if exists(engine.path_waveform_spill):
+        remove(engine.path_waveform_spill)
+
+    # 残したい中間ファイルだけUSTの隣に残して、作業フォルダを削除する
+    # NOTE: 途中でエラー終了した場合は、デバッグ用に作業フォルダを残す。
+    kept = persist_intermediates(temp_dir, persist_dir, keep_intermediates)
+    if is_inside_persist_dir(temp_dir, persist_dir):
+        logging.info('Kept %s intermediate files in %s', len(kept), temp_dir)
+    else:
+        logging.info('Kept %s intermediate files in %s', len(kept), persist_dir)
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
     # 音声を再生する。
     if exists(path_wav) and play_wav is True:
@@ -748,6 +1445,74 @@ def main(path_plugin: str, path_wav: Union[str, None] = None, play_wav: bool = F
     return path_wav
 
 
+def main(
+    path_plugin: str,
+    path_wav: Union[str, None] = None,
+    play_wav: bool = False,
+    scratch_dir: Union[str, None] = None,
+    keep_intermediates: Union[bool, None] = None,
+    path_trace: Union[str, None] = None,
+    profile_memory: bool = False,
+    path_perf_history: Union[str, None] = PERF_HISTORY_PATH,
+    torch_threads: Union[int, str, None] = None,
+    draft: Union[bool, None] = None,
+    render_range: Union[tuple, None] = None,
+) -> str:
+    """
+    UTAUプラグインのファイルから音声を生成する
+
+    Args:
+        scratch_dir: 中間ファイルの作業フォルダを作る場所。config.yaml の設定より優先する。
+        keep_intermediates: 中間ファイルをUSTの隣に残すかどうか。config.yaml の設定より優先する。
+        path_trace: 段階ごとの処理時間を Chrome のトレース形式で書き出す JSON ファイルのパス。
+        profile_memory: 段階の区切りごとにメモリ使用量を記録して、最大になった段階を表示する。
+        path_perf_history: 処理時間などの記録を追記するファイルのパス。None の場合は記録しない。
+        torch_threads: torch のスレッド数 ('auto' で自動調整)。環境変数や config.yaml より優先する。
+        draft: 音質より速さを優先して、下書きとして合成する。config.yaml の設定より優先する。
+        render_range: 合成する範囲。enulib.render_range.parse_range の戻り値 (開始, 終了, 単位)。
+    """
+    # 音源フォルダに移動する前に絶対パスにしておく
+    if path_trace is not None:
+        path_trace = abspath(path_trace.strip('"\''))
+    # 相対パスの作業フォルダが音源フォルダの中にならないようにする ('auto' はそのまま)
+    if scratch_dir not in (None, '', 'auto'):
+        scratch_dir = abspath(scratch_dir.strip('"\''))
+    memory = enulib.memory.MemoryMonitor() if profile_memory else None
+    tracer = enulib.trace.Tracer(memory=memory)
+    if memory is not None:
+        memory.start()
+    record = {'time': datetime.now().isoformat(timespec='seconds'), 'status': 'failed'}
+    # NOTE: メモリ不足などで途中でエラー終了した場合も、そこまでの記録を表示して書き出す。
+    try:
+        path_wav = render(
+            path_plugin,
+            path_wav,
+            play_wav,
+            scratch_dir,
+            keep_intermediates,
+            tracer,
+            record,
+            torch_threads=torch_threads,
+            draft=draft,
+            render_range=render_range,
+        )
+        record['status'] = 'ok'
+        return path_wav
+    finally:
+        if path_perf_history is not None:
+            append_perf_record(path_perf_history, record, tracer)
+        logging.info(
+            'Stage times: %s',
+            ', '.join(f'{name} {t:.3f}s' for name, t in tracer.stage_times().items()),
+        )
+        if memory is not None:
+            memory.stop()
+            logging.info('Memory usage:\n%s', memory.format_summary())
+        if path_trace is not None:
+            tracer.write_chrome_trace(path_trace)
+            logging.info('Wrote trace to %s', path_trace)
+
+
 if __name__ == '__main__':
     logging.debug('sys.argv: %s', sys.argv)
     if len(sys.argv) == 1:
@@ -756,9 +1521,84 @@ if __name__ == '__main__':
     else:
         # コマンドライン引数を取得する。
         parser = ArgumentParser()
-        parser.add_argument('ust', type=str, help='Input file path (UST or TMP)')
+        parser.add_argument('ust', type=str, nargs='?', help='Input file path (UST or TMP)')
         parser.add_argument('--wav', type=str, required=False, help='Output file path (WAV)')
         parser.add_argument('--play', action='store_true', help='Play WAV after rendering or not')
+        parser.add_argument(
+            '--scratch_dir',
+            type=str,
+            required=False,
+            help='Directory to create working files in (e.g. RAM disk). "auto" for OS temp dir',
+        )
+        parser.add_argument(
+            '--keep_intermediates',
+            action=BooleanOptionalAction,
+            default=None,
+            help='Copy intermediate files next to UST after rendering (overrides config.yaml)',
+        )
+        parser.add_argument(
+            '--trace',
+            type=str,
+            required=False,
+            help='Write stage timings as a Chrome trace JSON file (chrome://tracing)',
+        )
+        parser.add_argument(
+            '--profile_memory',
+            action='store_true',
+            help='Record memory usage at every stage and report where it peaked',
+        )
+        parser.add_argument(
+            '--torch_threads',
+            type=str,
+            required=False,
+            help='Number of torch threads for CPU inference, or "auto" to tune and cache it',
+        )
+        parser.add_argument(
+            '--draft',
+            action=BooleanOptionalAction,
+            default=None,
+            help='Render a quick draft (WORLD vocoder, no post-filter, no smoothing). '
+            '--no-draft overrides draft: true in config.yaml',
+        )
+        parser.add_argument(
+            '--range',
+            type=enulib.render_range.parse_range,
+            required=False,
+            help='Render only this range, in ticks ("1920-3840") or seconds ("12.5-20s")',
+        )
+        parser.add_argument(
+            '--perf_history',
+            type=str,
+            default=PERF_HISTORY_PATH,
+            help='File to append the performance record of each render to',
+        )
+        parser.add_argument(
+            '--perf_report',
+            '--perf-report',
+            action='store_true',
+            help='Summarize the performance history and exit',
+        )
         args = parser.parse_args()
+        # 処理の記録を集計して表示する
+        if args.perf_report:
+            if not exists(args.perf_history):
+                sys.exit(f'Performance history does not exist: {args.perf_history}')
+            records = enulib.perf_history.load_records(args.perf_history)
+            print(enulib.perf_history.format_report(records))
+            sys.exit(0)
+        if args.ust is None:
+            parser.error('the following arguments are required: ust')
         # 実行
-        main(args.ust, path_wav=args.wav, play_wav=args.play)
+        main(
+            args.ust,
+            path_wav=args.wav,
+            play_wav=args.play,
+            scratch_dir=args.scratch_dir,
+            keep_intermediates=args.keep_intermediates,
+            path_trace=args.trace,
+            profile_memory=args.profile_memory,
+            path_perf_history=args.perf_history,
+            torch_threads=args.torch_threads,
+            draft=args.draft,
+            render_range=args.range,
+        )
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+numpy で配列処理するようにした f0_smoother が、以前のループの実装と同じ結果になることを確かめる。
+
+以前の実装 (2022-04-24 版) を reference_* としてここに残しておく。
+以前の実装は曲末の2フレーム前で急峻な変化を検出すると IndexError で止まっていたので、
+その場合だけは以前の実装と比べずに、補正幅を狭めて処理できることを確かめる。
+"""
+
+import sys
+from copy import copy
+from math import cos, pi
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pytest
+
+sys.path.append(join(dirname(dirname(abspath(__file__))), 'extensions'))
+import f0_smoother  # noqa: E402
+
+WIDTH = f0_smoother.SMOOTHEN_WIDTH
+DETECT_THRESHOLD = f0_smoother.DETECT_THRESHOLD
+IGNORE_THRESHOLD = f0_smoother.IGNORE_THRESHOLD
+
+
+def reference_repair_sudden_zero_f0(f0_list):
+    newf0_list = copy(f0_list)
+    for i, f0 in enumerate(f0_list[1:-2], 1):
+        if all((f0 == 0, f0_list[i - 1] != 0, f0_list[i + 1] != 0)):
+            newf0_list[i] = (f0_list[i - 1] + f0_list[i + 1]) / 2
+    return newf0_list
+
+
+def reference_get_rapid_f0_change_indices(f0_list, detect_threshold, ignore_threshold):
+    indices = []
+    for i, _ in enumerate(f0_list[1:-2], 1):
+        if any((f0_list[i - 1] == 0, f0_list[i] == 0, f0_list[i + 1] == 0, f0_list[i + 2] == 0)):
+            continue
+        delta_1 = f0_list[i + 1] - f0_list[i]
+        delta_3 = f0_list[i + 2] - f0_list[i - 1]
+        if delta_3 == 0:
+            continue
+        if abs(delta_1) < ignore_threshold:
+            continue
+        if delta_1 / delta_3 > detect_threshold:
+            indices.append(i)
+    return indices
+
+
+def reference_get_adjusted_widths(f0_list, rapid_f0_change_indices, default_width):
+    adjusted_widths = []
+    len_f0_list = len(f0_list)
+    for f0_idx in rapid_f0_change_indices:
+        width = default_width
+        while (f0_idx - width) < 0 or (f0_idx + width + 1) > len_f0_list:
+            width -= 1
+        while width > 0 and (0 in f0_list[f0_idx - width : f0_idx + width + 2]):
+            width -= 1
+        adjusted_widths.append(width)
+    return adjusted_widths
+
+
+def reference_get_target_f0_list(f0_list, rapid_f0_change_indices, adjusted_widths):
+    target_f0_list = []
+    for f0_idx, width in zip(rapid_f0_change_indices, adjusted_widths):
+        target_f0_list.append((f0_list[f0_idx - width] + f0_list[f0_idx + width + 1]) / 2)
+    return target_f0_list
+
+
+def reference_get_smoothened_f0_list(f0_list, width, detect_threshold, ignore_threshold):
+    f0_list = copy(f0_list)
+    indices = reference_get_rapid_f0_change_indices(f0_list, detect_threshold, ignore_threshold)
+    widths = reference_get_adjusted_widths(f0_list, indices, width)
+    targets = reference_get_target_f0_list(f0_list, indices, widths)
+    for f0_idx, width, target_f0 in zip(indices, widths, targets):
+        if width <= 0:
+            continue
+        for i in range(width):
+            ratio_of_original_f0 = cos(pi * ((width - i) / (2 * width + 1)))
+            ratio_of_target_f0 = 1 - ratio_of_original_f0
+            f0_list[f0_idx - i] = (
+                ratio_of_target_f0 * target_f0 + ratio_of_original_f0 * f0_list[f0_idx - i]
+            )
+            f0_list[f0_idx + i + 1] = (
+                ratio_of_target_f0 * target_f0 + ratio_of_original_f0 * f0_list[f0_idx + i + 1]
+            )
+    return f0_list
+
+
+def make_log_f0(seed: int, n_frames: int = 2000) -> list:
+    """休符、ノート境界の段差、突発的な0Hz、近接した急峻な変化を含む log10(f0) を作る。"""
+    rng = np.random.default_rng(seed)
+    # ノートごとの音高と、その上のゆらぎ
+    note_lengths = rng.integers(20, 120, size=n_frames // 20)
+    notenums = rng.integers(55, 76, size=len(note_lengths))
+    f0 = 440 * 2 ** ((np.repeat(notenums, note_lengths)[:n_frames] - 69) / 12)
+    f0 *= 2 ** (rng.normal(0, 0.02, size=n_frames) / 12)
+    # 休符
+    for start in rng.integers(0, n_frames - 50, size=n_frames // 400):
+        f0[start : start + rng.integers(5, 50)] = 0
+    # 突発的な0Hz
+    f0[rng.integers(1, n_frames - 2, size=n_frames // 200)] = 0
+    # 1-3フレームおきに続く急峻な変化 (補正が重なる場合)
+    for start in rng.integers(10, n_frames - 20, size=n_frames // 300):
+        f0[start : start + 8 : rng.integers(1, 4)] *= 1.3
+    # 曲末は休符 (曲末の2フレーム前での検出は test_rapid_change_at_end_of_track で確かめる)
+    f0[-10:] = 0
+    return np.log10(np.maximum(f0, 1)).tolist()
+
+
+def end_of_track_log_f0() -> list:
+    """曲末の2フレーム前に急峻な変化がある log10(f0)。以前の実装は IndexError になる。"""
+    return [2.0] * 12 + [2.3, 2.3]
+
+
+LOG_F0_TRACKS = [make_log_f0(seed) for seed in range(20)] + [
+    # 急峻な変化がない
+    [2.0] * 100,
+    # 全部休符
+    [0.0] * 100,
+    # 曲頭の近くで検出される
+    [2.0, 2.0, 2.3, 2.3] + [2.3] * 20,
+    # 補正幅を狭める必要のある休符の直前の段差
+    [2.0] * 20 + [2.3, 2.3, 0.0, 2.3] + [2.3] * 20,
+    # 短すぎて何もしない
+    [2.0, 2.3],
+]
+
+
+@pytest.mark.parametrize('log_f0', LOG_F0_TRACKS)
+def test_same_as_reference(log_f0):
+    repaired = f0_smoother.repair_sudden_zero_f0(log_f0)
+    reference_repaired = reference_repair_sudden_zero_f0(log_f0)
+    np.testing.assert_array_equal(repaired, reference_repaired)
+
+    indices = f0_smoother.get_rapid_f0_change_indices(
+        repaired, DETECT_THRESHOLD, IGNORE_THRESHOLD
+    )
+    reference_indices = reference_get_rapid_f0_change_indices(
+        reference_repaired, DETECT_THRESHOLD, IGNORE_THRESHOLD
+    )
+    assert indices.tolist() == reference_indices
+
+    widths = f0_smoother.get_adjusted_widths(repaired, indices, WIDTH)
+    reference_widths = reference_get_adjusted_widths(reference_repaired, reference_indices, WIDTH)
+    assert widths.tolist() == reference_widths
+
+    targets = f0_smoother.get_target_f0_list(repaired, indices, widths)
+    reference_targets = reference_get_target_f0_list(
+        reference_repaired, reference_indices, reference_widths
+    )
+    np.testing.assert_array_equal(targets, reference_targets)
+
+    smoothened = f0_smoother.get_smoothened_f0_list(
+        repaired, WIDTH, DETECT_THRESHOLD, IGNORE_THRESHOLD
+    )
+    reference_smoothened = reference_get_smoothened_f0_list(
+        reference_repaired, WIDTH, DETECT_THRESHOLD, IGNORE_THRESHOLD
+    )
+    np.testing.assert_array_equal(smoothened, reference_smoothened)
+
+
+def test_tracks_detect_rapid_changes():
+    """比較に使う f0 で、補正が重なる場合も含めて急峻な変化が検出されていることを確かめる。"""
+    n_detected = 0
+    n_overlapped = 0
+    for log_f0 in LOG_F0_TRACKS:
+        indices = f0_smoother.get_rapid_f0_change_indices(
+            f0_smoother.repair_sudden_zero_f0(log_f0), DETECT_THRESHOLD, IGNORE_THRESHOLD
+        )
+        n_detected += len(indices)
+        n_overlapped += int(np.sum(np.diff(indices) <= 2 * WIDTH))
+    assert n_detected > 100
+    assert n_overlapped > 10
+
+
+def test_rapid_change_at_end_of_track():
+    log_f0 = end_of_track_log_f0()
+    indices = reference_get_rapid_f0_change_indices(log_f0, DETECT_THRESHOLD, IGNORE_THRESHOLD)
+    assert indices == [len(log_f0) - 3]
+    # 以前の実装は右端が曲末を越えてしまう
+    with pytest.raises(IndexError):
+        reference_get_smoothened_f0_list(log_f0, WIDTH, DETECT_THRESHOLD, IGNORE_THRESHOLD)
+    # 今の実装は補正幅を1にして処理する
+    widths = f0_smoother.get_adjusted_widths(log_f0, indices, WIDTH)
+    assert widths.tolist() == [1]
+    smoothened = f0_smoother.get_smoothened_f0_list(
+        log_f0, WIDTH, DETECT_THRESHOLD, IGNORE_THRESHOLD
+    )
+    assert len(smoothened) == len(log_f0)
+    # 段差の両側の2点だけが両端の平均値に寄せられる
+    np.testing.assert_array_equal(smoothened[:-3], log_f0[:-3])
+    assert log_f0[-3] < smoothened[-3] < smoothened[-2] < log_f0[-2]
+    assert smoothened[-1] == log_f0[-1]
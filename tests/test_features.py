@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+音響特徴量を float32 で受け渡しても、WORLD で合成した音声が float64 の場合と一致することを確かめる。
+
+mgc, lf0, vuv, bap は実際の音声と同じように、合成した歌声を WORLD で分析して作る。
+lf0 を float32 に丸めると、WORLD の合成で位相のずれとして積み重なるので、波形の差は
+最大振幅の 1e-3 程度 (SNR 約 80 dB) になる。mgc, bap の丸めによる差はそれよりずっと小さい。
+"""
+
+import sys
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pysptk
+import pyworld
+import pytest
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+from enulib import features  # noqa: E402
+
+SAMPLE_RATE = 48000
+FRAME_PERIOD = 5
+MGC_ORDER = 59
+# 合成した音声の差の許容値 (最大振幅に対する比と SNR[dB])
+TOLERANCE = 2e-3
+MIN_SNR_DB = 60
+# lf0 だけ float64 のままにした場合の許容値
+TOLERANCE_WITHOUT_LF0 = 1e-5
+
+
+def make_singing(seconds: float = 2.0) -> np.ndarray:
+    """ビブラートのかかった倍音の多い音と、無声の区間を含む波形を作る。"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    f0 = 220 * 2 ** (0.5 / 12 * np.sin(2 * np.pi * 5.5 * t))
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    wav = sum(np.sin(k * phase) / k for k in range(1, 30)) * 0.1
+    # 無声区間 (子音のかわり)
+    unvoiced = (t > 0.9) & (t < 1.1)
+    wav[unvoiced] = rng.standard_normal(unvoiced.sum()) * 0.02
+    return wav
+
+
+def analyze(wav: np.ndarray) -> tuple:
+    """WORLD で分析して、NNSVS と同じ形式の (mgc, lf0, vuv, bap) を float64 で返す。"""
+    f0, timeaxis = pyworld.harvest(wav, SAMPLE_RATE, frame_period=FRAME_PERIOD)
+    sp = pyworld.cheaptrick(wav, f0, timeaxis, SAMPLE_RATE)
+    ap = pyworld.d4c(wav, f0, timeaxis, SAMPLE_RATE)
+    alpha = pysptk.util.mcepalpha(SAMPLE_RATE)
+    mgc = pysptk.sp2mc(sp, order=MGC_ORDER, alpha=alpha)
+    bap = pyworld.code_aperiodicity(ap, SAMPLE_RATE)
+    vuv = (f0 > 0).astype(np.float64).reshape(-1, 1)
+    lf0 = np.zeros_like(f0)
+    lf0[f0 > 0] = np.log(f0[f0 > 0])
+    return mgc, lf0.reshape(-1, 1), vuv, bap
+
+
+def world_params(mgc, lf0, vuv, bap) -> tuple:
+    """mgc, bap を WORLD のスペクトル包絡と非周期性指標に戻す (NNSVS の gen_world_params と同じ変換)。"""
+    fftlen = pyworld.get_cheaptrick_fft_size(SAMPLE_RATE)
+    alpha = pysptk.util.mcepalpha(SAMPLE_RATE)
+    sp = pysptk.mc2sp(np.ascontiguousarray(mgc), fftlen=fftlen, alpha=alpha)
+    ap = pyworld.decode_aperiodicity(
+        np.ascontiguousarray(bap).astype(np.float64), SAMPLE_RATE, fftlen
+    )
+    ap[vuv.reshape(-1) < 0.5, 0] = 1.0
+    ap = np.clip(ap, 0.0, 1.0)
+    f0 = lf0.copy()
+    f0[np.nonzero(f0)] = np.exp(f0[np.nonzero(f0)])
+    f0[vuv < 0.5] = 0
+    return f0.flatten().astype(np.float64), sp.astype(np.float64), ap.astype(np.float64)
+
+
+def float32_features(multistream_features, tmp_path, suffix: str) -> tuple:
+    """エンジンと同じく float32 にして、acoustic_editor に渡すファイルを往復させる。"""
+    loaded = []
+    names = ('mgc', 'lf0', 'vuv', 'bap')
+    for name, feature in zip(names, features.as_float32(multistream_features)):
+        path = join(tmp_path, f'{name}{suffix}')
+        features.save_feature(path, feature)
+        loaded.append(features.load_feature(path).reshape(feature.shape))
+    assert all(x.dtype == np.float32 for x in loaded)
+    return tuple(loaded)
+
+
+def assert_same_waveform(wav_32: np.ndarray, wav_64: np.ndarray, tolerance: float = TOLERANCE):
+    assert wav_32.shape == wav_64.shape
+    diff = wav_32 - wav_64
+    assert np.max(np.abs(diff)) < tolerance * np.max(np.abs(wav_64))
+    assert 10 * np.log10(np.sum(wav_64**2) / max(np.sum(diff**2), 1e-30)) > MIN_SNR_DB
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.npy'])
+def test_float32_features_synthesize_same_waveform(tmp_path, suffix):
+    multistream_features = analyze(make_singing())
+    wav_64 = pyworld.synthesize(*world_params(*multistream_features), SAMPLE_RATE, FRAME_PERIOD)
+    features_32 = float32_features(multistream_features, tmp_path, suffix)
+    wav_32 = pyworld.synthesize(*world_params(*features_32), SAMPLE_RATE, FRAME_PERIOD)
+    assert_same_waveform(wav_32, wav_64)
+    # mgc, vuv, bap だけを float32 にした場合は、ほぼ同じ波形になる
+    mgc, _, vuv, bap = features_32
+    lf0 = multistream_features[1]
+    wav_32 = pyworld.synthesize(*world_params(mgc, lf0, vuv, bap), SAMPLE_RATE, FRAME_PERIOD)
+    assert_same_waveform(wav_32, wav_64, TOLERANCE_WITHOUT_LF0)
+
+
+def test_float32_features_with_nnsvs_gen_world_params(tmp_path):
+    gen = pytest.importorskip('nnsvs.gen')
+    multistream_features = analyze(make_singing())
+    params_64 = gen.gen_world_params(*multistream_features, SAMPLE_RATE, vuv_threshold=0.5)
+    wav_64 = pyworld.synthesize(*params_64, SAMPLE_RATE, FRAME_PERIOD)
+    features_32 = float32_features(multistream_features, tmp_path, '.csv')
+    params_32 = gen.gen_world_params(*features_32, SAMPLE_RATE, vuv_threshold=0.5)
+    wav_32 = pyworld.synthesize(*params_32, SAMPLE_RATE, FRAME_PERIOD)
+    assert_same_waveform(wav_32, wav_64)
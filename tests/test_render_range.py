@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+範囲を指定して合成するときに、同梱の拡張機能が範囲のノートと f0 のフレームで動くことを確かめる。
+
+エンジンと同じく、範囲の前後に余裕を持たせてラベルとUSTを切り取り、範囲の情報を
+状態保存用フォルダに置いてから拡張機能を呼び出す。
+simple_enunu.main で範囲を合成するテストは torch と nnsvs がある環境でだけ実行する。
+"""
+
+import filecmp
+import os
+import shutil
+import sys
+from os import makedirs
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pytest
+import utaupy
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(join(ROOT_DIR, 'extensions'))
+sys.path.append(join(ROOT_DIR, 'benchmarks'))
+import style_shifter  # noqa: E402
+import synthetic  # noqa: E402
+import vibrato_applier  # noqa: E402
+from enulib import extensions, features, render_range, segmentation, timing  # noqa: E402
+
+N_NOTES = 80
+FRAME_PERIOD = synthetic.FRAME_PERIOD
+RANGE_START = 20.0
+RANGE_END = 24.0
+PADDING = 2.0
+# 区間分割合成のかわりに、切り取ったラベルをこの長さ[s]ごとの区間に分ける
+SEGMENT_SEC = 3.0
+
+
+def run(name: str, state_root: str, range_info=None, **kwargs):
+    """エンジンと同じく、拡張機能ごとの状態保存用フォルダを渡して同梱の拡張機能を実行する。
+
+    ENUNU.get_extension_state_dir と同じく、範囲の情報があれば状態保存用フォルダに書き出す。
+    """
+    state_dir = join(state_root, name)
+    makedirs(state_dir, exist_ok=True)
+    if range_info is not None:
+        render_range.save_range_info(state_dir, range_info)
+    extensions.run_extension(
+        join(ROOT_DIR, 'extensions', f'{name}.py'), state_dir=state_dir, **kwargs
+    )
+    return state_dir
+
+
+def crop_song(song) -> tuple:
+    """ENUNU.crop_labels と同じく、範囲の前後のノートだけのラベルとUSTにする。
+
+    (曲全体のラベル, 範囲の情報) を返す。
+    """
+    label = timing.load(song.full_timing)
+    mask = label.note_start_mask()
+    first, last = render_range.choose_window(
+        label.starts * segmentation.HTS_TIME_UNIT, mask, RANGE_START, RANGE_END, PADDING
+    )
+    note_offset, n_notes = render_range.window_notes(mask, first, last)
+    ust = utaupy.ust.load(song.ust)
+    assert len(ust.notes) == mask.sum()
+    render_range.crop_ust(ust, note_offset, n_notes).write(song.ust)
+    offset = label.starts[first]
+    window = timing.TimingLabel(
+        label.starts[first : last + 1] - offset,
+        label.ends[first : last + 1] - offset,
+        label.contexts[first : last + 1],
+    )
+    window.write(song.full_timing)
+    window.as_mono().write(song.mono_timing)
+    label_offset = float(offset * segmentation.HTS_TIME_UNIT)
+    # 範囲に重なる区間の開始時刻 (切り取ったラベル上の時刻)
+    length = window.ends[-1] * segmentation.HTS_TIME_UNIT
+    durations = [SEGMENT_SEC] * int(length // SEGMENT_SEC) + [length % SEGMENT_SEC]
+    _, _, f0_start = render_range.select_segments(
+        durations, 0.0, RANGE_START - label_offset, RANGE_END - label_offset
+    )
+    range_info = {
+        'note_offset': note_offset,
+        'n_notes': n_notes,
+        'label_offset': label_offset,
+        'f0_start': f0_start,
+    }
+    return label, range_info
+
+
+@pytest.fixture(name='song')
+def fixture_song(tmp_path):
+    song = synthetic.make_song(str(tmp_path), N_NOTES, seed=5)
+    # ust_editor の段階は曲全体のUSTで実行する
+    state_root = join(tmp_path, 'extension_state')
+    run('style_shifter', state_root, ust=song.ust)
+    run('vibrato_applier', state_root, ust=song.ust)
+    full_ust = utaupy.ust.load(song.ust)
+    label, range_info = crop_song(song)
+    return song, state_root, full_ust, label, range_info
+
+
+def test_crop_keeps_tempo(tmp_path):
+    ust = synthetic.make_ust(10, seed=0)
+    # 4つ目のノートでテンポを変える
+    for note in ust.notes:
+        note.pop('Tempo', None)
+    ust.notes[3].tempo = 150
+    path_ust = join(tmp_path, 'song.ust')
+    render_range.crop_ust(ust, 5, 3).write(path_ust)
+    cropped = utaupy.ust.load(path_ust)
+    assert [note.tag for note in cropped.notes] == ['[#0000]', '[#0001]', '[#0002]']
+    assert float(cropped.tempo) == 150
+    assert [note.tempo for note in cropped.notes] == [150, 150, 150]
+
+
+def test_velocity_applier_in_range(song):
+    song, state_root, full_ust, _, range_info = song
+    assert 0 < range_info['n_notes'] < len(full_ust.notes)
+    before = timing.load(song.full_timing)
+    run(
+        'velocity_applier',
+        state_root,
+        range_info,
+        ust=song.ust,
+        full_timing=song.full_timing,
+        mono_timing=song.mono_timing,
+    )
+    after = timing.load(song.full_timing)
+    assert after.contexts == before.contexts
+    assert not np.array_equal(after.starts, before.starts)
+    np.testing.assert_array_equal(after.starts, timing.load(song.mono_timing).starts)
+
+
+def test_f0_editors_in_range(song, tmp_path):
+    song, state_root, full_ust, label, range_info = song
+    # 範囲に重なる区間の f0 を、曲全体の f0 から切り出す
+    f0_song = features.load_column(song.f0)
+    first_frame = render_range.first_f0_frame(range_info, FRAME_PERIOD, from_song_start=True)
+    f0 = f0_song[first_frame : first_frame + int(1000 * SEGMENT_SEC / FRAME_PERIOD)]
+    assert np.count_nonzero(f0) > 0
+
+    # vibrato_applier: 曲全体のUSTで計算したビブラートの、同じ時刻の部分が足される
+    path_f0 = join(tmp_path, 'vibrato_f0.csv')
+    features.save_column(path_f0, f0)
+    run('vibrato_applier', state_root, range_info, f0=path_f0, frame_period=str(FRAME_PERIOD))
+    params = vibrato_applier.get_vibrato_params(full_ust)
+    delta = vibrato_applier.render_delta_f0(
+        params, vibrato_applier.get_total_length_ms(full_ust), FRAME_PERIOD
+    )[first_frame : first_frame + len(f0)]
+    assert np.abs(delta).max() > 10
+    np.testing.assert_allclose(
+        features.load_column(path_f0), vibrato_applier.add_vibrato(f0, delta), rtol=1e-5
+    )
+
+    # style_shifter: 範囲のノートのスタイルシフト量を、切り取ったラベルの時刻で適用する
+    path_f0 = join(tmp_path, 'style_f0.csv')
+    features.save_column(path_f0, f0)
+    state_dir = run(
+        'style_shifter',
+        state_root,
+        range_info,
+        ust=song.ust,
+        f0=path_f0,
+        full_timing=song.full_timing,
+        frame_period=str(FRAME_PERIOD),
+    )
+    note_offset, n_notes = range_info['note_offset'], range_info['n_notes']
+    style_shifts = style_shifter.load_style_shifts(join(state_dir, style_shifter.STATE_FILE_NAME))
+    assert len(style_shifts) == len(full_ust.notes)
+    window_shifts = style_shifts[note_offset : note_offset + n_notes]
+    assert any(window_shifts)
+    note_starts, note_ends = timing.load_note_times(song.full_timing)
+    frame_shifts = style_shifter.get_frame_shifts(
+        note_starts,
+        note_ends,
+        window_shifts,
+        len(f0),
+        FRAME_PERIOD,
+        render_range.first_f0_frame(range_info, FRAME_PERIOD),
+    )
+    np.testing.assert_allclose(
+        features.load_column(path_f0), style_shifter.shift_f0(f0, frame_shifts), rtol=1e-5
+    )
+    # 曲全体のラベルで計算したシフト量の、同じ時刻の部分と一致する
+    song_note_starts = label.starts[label.note_start_mask()]
+    assert np.count_nonzero(frame_shifts) > 0
+    song_shifts = style_shifter.get_frame_shifts(
+        song_note_starts,
+        np.append(song_note_starts[1:], label.ends[-1]),
+        style_shifts,
+        len(f0_song),
+        FRAME_PERIOD,
+    )[first_frame : first_frame + len(f0)]
+    assert np.mean(song_shifts == frame_shifts) > 0.99
+
+
+def test_f0_feedbacker_skips_range(song, tmp_path):
+    song, state_root, _, _, range_info = song
+    path_feedback = join(tmp_path, 'feedback.tmp')
+    shutil.copy(song.ust, path_feedback)
+    run('f0_feedbacker', state_root, range_info, f0=song.f0, feedback=path_feedback)
+    assert filecmp.cmp(song.ust, path_feedback, shallow=False)
+
+
+def test_render_range_with_extensions(tmp_path):
+    """simple_enunu.main で、velocity_applier と vibrato_applier を使って範囲を合成する。"""
+    pytest.importorskip('torch')
+    pytest.importorskip('nnsvs')
+    simple_enunu = pytest.importorskip('simple_enunu')
+    import bench_e2e  # pylint: disable=import-outside-toplevel
+    import tiny_voicebank  # pylint: disable=import-outside-toplevel
+    from scipy.io import wavfile  # pylint: disable=import-outside-toplevel
+
+    voice_dir = join(tmp_path, 'voice')
+    tiny_voicebank.make_voicebank(voice_dir, extensions=tiny_voicebank.DEFAULT_EXTENSIONS)
+    path_ust = join(tmp_path, 'song.ust')
+    bench_e2e.make_input_ust(path_ust, voice_dir, N_NOTES, seed=5)
+    path_wav = join(tmp_path, 'song.wav')
+    cwd = os.getcwd()
+    try:
+        simple_enunu.main(
+            path_ust,
+            path_wav=path_wav,
+            path_perf_history=None,
+            render_range=render_range.parse_range(f'{RANGE_START}-{RANGE_END}s'),
+        )
+    finally:
+        # main は音源フォルダに移動するので元に戻す
+        os.chdir(cwd)
+    sample_rate, wav = wavfile.read(path_wav)
+    assert len(wav) == round((RANGE_END - RANGE_START) * sample_rate)
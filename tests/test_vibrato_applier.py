@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025 oatsu
+"""
+vibrato_applier が --frame_period の f0 のフレーム周期でビブラートを適用することを確かめる。
+
+ust_editor の段階ではフレーム周期によらないパラメータを残し、acoustic_editor の段階で
+渡されたフレーム周期で計算するので、5ms 以外のモデルでもビブラートの位置がずれない。
+"""
+
+import sys
+from os.path import abspath, dirname, join
+
+import numpy as np
+import pytest
+
+ROOT_DIR = dirname(dirname(abspath(__file__)))
+sys.path.append(join(ROOT_DIR, 'extensions'))
+sys.path.append(join(ROOT_DIR, 'benchmarks'))
+import synthetic  # noqa: E402
+import vibrato_applier  # noqa: E402
+from enulib import features  # noqa: E402
+
+F0_HZ = 440.0
+
+
+def prepare(tmp_path, frame_period: float) -> tuple:
+    """ust_editor の段階を実行して、(状態保存用フォルダ, f0 のパス, 曲全体のΔf0) を返す。"""
+    ust = synthetic.make_ust(40, seed=3)
+    path_ust = join(tmp_path, 'song.ust')
+    ust.write(path_ust)
+    state_dir = join(tmp_path, 'extension_state')
+    (tmp_path / 'extension_state').mkdir()
+    vibrato_applier.main(None, None, path_ust, state_dir=state_dir, frame_period=frame_period)
+    expected = vibrato_applier.render_delta_f0(
+        vibrato_applier.get_vibrato_params(ust),
+        vibrato_applier.get_total_length_ms(ust),
+        frame_period,
+    )
+    return state_dir, join(tmp_path, 'f0.csv'), expected
+
+
+def apply_segments(state_dir, path_f0, frame_period, segment_lengths) -> np.ndarray:
+    """区間分割合成と同じく、区間ごとに acoustic_editor の段階を実行する。"""
+    results = []
+    for n_frames in segment_lengths:
+        features.save_column(path_f0, np.full(n_frames, F0_HZ))
+        vibrato_applier.main(
+            path_f0, path_f0, None, state_dir=state_dir, frame_period=frame_period
+        )
+        results.append(features.load_column(path_f0))
+    return vibrato_applier.hz_to_cent(np.concatenate(results)) - vibrato_applier.hz_to_cent(F0_HZ)
+
+
+@pytest.mark.parametrize('frame_period', [5, 10, 2.5])
+def test_vibrato_at_frame_period(tmp_path, frame_period):
+    state_dir, path_f0, expected = prepare(tmp_path, frame_period)
+    assert np.abs(expected).max() > 10
+    delta = apply_segments(state_dir, path_f0, frame_period, [len(expected)])
+    np.testing.assert_allclose(delta, expected, atol=1e-3)
+
+
+def test_frame_period_keeps_vibrato_times(tmp_path):
+    """10ms のフレームのΔf0 は、5ms のフレームのΔf0 の1つおきと同じ時刻の値になる。"""
+    (tmp_path / '5ms').mkdir()
+    (tmp_path / '10ms').mkdir()
+    delta_5ms = prepare(tmp_path / '5ms', 5)[2]
+    delta_10ms = prepare(tmp_path / '10ms', 10)[2]
+    np.testing.assert_allclose(delta_10ms, delta_5ms[::2][: len(delta_10ms)], atol=1e-9)
+
+
+def test_segmented_synthesis(tmp_path):
+    frame_period = 10
+    state_dir, path_f0, expected = prepare(tmp_path, frame_period)
+    n_frames = len(expected)
+    segment_lengths = [n_frames // 3, n_frames // 4, n_frames - n_frames // 3 - n_frames // 4]
+    delta = apply_segments(state_dir, path_f0, frame_period, segment_lengths)
+    np.testing.assert_allclose(delta, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize('frame_period', [5, 10])
+def test_render_window(frame_period):
+    """区間の分だけ計算したΔf0が、曲全体のΔf0の同じ範囲と一致する。"""
+    ust = synthetic.make_ust(40, seed=3)
+    params = vibrato_applier.get_vibrato_params(ust)
+    total_length_ms = vibrato_applier.get_total_length_ms(ust)
+    expected = vibrato_applier.render_delta_f0(params, total_length_ms, frame_period)
+    n_total = len(expected)
+    for start, n_frames in [(0, 1), (0, n_total), (n_total // 3, 257), (n_total - 5, 100)]:
+        window = vibrato_applier.render_delta_f0(
+            params, total_length_ms, frame_period, start_frame=start, n_frames=n_frames
+        )
+        np.testing.assert_array_equal(window, expected[start : start + n_frames])
+    # 曲末より後ろは空になる
+    empty = vibrato_applier.render_delta_f0(
+        params, total_length_ms, frame_period, start_frame=n_total + 10, n_frames=10
+    )
+    assert len(empty) == 0